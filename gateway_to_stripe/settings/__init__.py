@@ -0,0 +1,27 @@
+"""
+Settings profiles for the gateway_to_stripe project, selected by DJANGO_ENV:
+
+    dev         local development, DEBUG on (default)
+    test        test runs: SQLite in memory, no external services
+    production  DEBUG off, cached templates, memory-bounded workers
+
+A profile can also be pinned directly with
+DJANGO_SETTINGS_MODULE=gateway_to_stripe.settings.<profile>. Every Procfile
+process sets DJANGO_ENV=production itself, and production refuses to start
+without DJANGO_SECRET_KEY and ALLOWED_HOSTS.
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+DJANGO_ENV = os.getenv('DJANGO_ENV', 'dev')
+
+if DJANGO_ENV == 'production':
+    from .production import *
+elif DJANGO_ENV == 'test':
+    from .test import *
+elif DJANGO_ENV == 'dev':
+    from .dev import *
+else:
+    raise ImproperlyConfigured(f"Unknown DJANGO_ENV {DJANGO_ENV!r}; expected dev, test or production.")
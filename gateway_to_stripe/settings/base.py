@@ -0,0 +1,366 @@
+"""
+Django settings shared by every profile of the gateway_to_stripe project.
+The profile (dev, test, production) is selected in gateway_to_stripe/settings/__init__.py.
+
+Generated by 'django-admin startproject' using Django 5.0.2.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.0/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/5.0/ref/settings/
+"""
+
+from pathlib import Path
+import os
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+# Loads variables from .env file in your project root. Deployed dynos get their
+# environment from the platform, so dotenv is only imported when the file exists.
+if (BASE_DIR / '.env').exists():
+    from dotenv import load_dotenv # Install with: pip install python-dotenv
+    load_dotenv(BASE_DIR / '.env')
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = 'django-insecure-a+(pjf*yh+=c5+zuhlvb657%0@p&_42+oevj#h^#fep8nm(_c&'
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = False
+
+ALLOWED_HOSTS = ['*']
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+
+            'django.contrib.sites',  # Required by allauth
+    'allauth',
+    'allauth.account',
+    'allauth.socialaccount',
+    'allauth.socialaccount.providers.google',
+
+
+    'subscriptions',  # Your app name here
+]
+
+MIDDLEWARE = [
+    'subscriptions.middleware.ProfilingMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+        'whitenoise.middleware.WhiteNoiseMiddleware',
+    'subscriptions.middleware.ReplicaRoutingMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+                    # Add the account middleware:
+    "allauth.account.middleware.AccountMiddleware",
+'subscriptions.middleware.CreditRefillMiddleware',
+]
+
+ROOT_URLCONF = 'gateway_to_stripe.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [os.path.join(BASE_DIR, 'templates/'),],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.debug',
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'gateway_to_stripe.wsgi.application'
+
+
+# Database
+# https://docs.djangoproject.com/en/5.0/ref/settings/#databases
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('DB_NAME'),  # autoposter_db
+        'USER': os.getenv('DB_USER'),  # autoposter_db_owner
+        'PASSWORD': os.getenv('DB_PASSWORD'),  # Rzs3MQ8molPY
+        'HOST': os.getenv('DB_HOST'),  # ep-autumn-pond-a1zj699v.ap-southeast-1.aws.neon.tech
+        'PORT': os.getenv('DB_PORT', '5432'),  # Default PostgreSQL port
+        'OPTIONS': {
+            'sslmode': os.getenv('DB_SSLMODE', 'require'),  # sslmode=require
+        },
+        # Check reused connections before handing them to a request, so a connection
+        # dropped by the remote server is replaced instead of failing the request.
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Connection reuse
+# By default each worker thread keeps its connection open for DB_CONN_MAX_AGE seconds,
+# so requests skip the TCP + TLS handshake and authentication to the remote Postgres.
+# DB_POOL=1 switches to psycopg 3's driver-level pool instead (psycopg[pool]). Under
+# the ASGI worker class each request runs its queries on a thread of its own, so
+# persistent connections would pile up unused: without DB_POOL they are closed after
+# every request there, as Django's deployment docs advise.
+
+DB_POOL = os.getenv('DB_POOL', '').lower() in ('1', 'true', 'yes')
+WEB_WORKER_CLASS = os.getenv('WEB_WORKER_CLASS', 'gthread')
+
+if DB_POOL:
+    DATABASES['default']['CONN_MAX_AGE'] = 0  # Pooling and persistent connections are exclusive
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),  # Seconds to wait for a free connection
+        'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', '300')),
+        'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', '1800')),
+    }
+elif WEB_WORKER_CLASS == 'asgi':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '600'))
+
+# Read replicas
+# DB_REPLICA_HOSTS is a comma-separated list of hosts serving streaming replicas of
+# the primary, reachable with the same credentials. Read-only queries go to them,
+# except right after a user's own writes (see subscriptions/db_router.py).
+
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+
+for index, host in enumerate(DB_REPLICA_HOSTS, start=1):
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'OPTIONS': {**DATABASES['default']['OPTIONS']},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['subscriptions.db_router.ReplicaRouter']
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', '10'))  # Reads stay on the primary this long after a write
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '2'))  # Seconds; laggier replicas get no reads
+DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', '5'))
+
+
+# Password validation
+# https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/5.0/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/5.0/howto/static-files/
+
+STATIC_URL = 'static/'
+
+STATICFILES_DIRS = [
+    os.path.join(BASE_DIR,'static')
+]
+
+STATIC_ROOT = os.path.join(BASE_DIR,'staticfiles')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+AUTHENTICATION_BACKENDS = (
+    'django.contrib.auth.backends.ModelBackend',
+    'allauth.account.auth_backends.AuthenticationBackend',
+)
+
+
+SOCIALACCOUNT_PROVIDERS = {
+    'google': {
+        'SCOPE' : [
+            'profile',
+            'email'
+        ],
+        'APP': {
+            # Only needed when a Google login is actually performed; management
+            # commands and workers must not fail to boot without them.
+            'client_id': os.environ.get('CLIENT_ID', ''),
+            'secret': os.environ.get('CLIENT_SECRET', ''),
+        },
+        'AUTH_PARAMS': {
+            'access_type':'online',
+        }
+    }
+}
+
+SITE_ID = 2
+
+LOGIN_URL = '/login/'  # Redirect to Google login when not logged in
+# LOGIN_REDIRECT_URL = '/'
+LOGOUT_REDIRECT_URL = '/'
+SOCIALACCOUNT_LOGIN_ON_GET=True
+ACCOUNT_SESSION_REMEMBER = True
+ACCOUNT_SIGNUP_REDIRECT_URL = '/'  # Redirect signup attempts
+ACCOUNT_LOGIN_ON_EMAIL_CONFIRMATION = False  # Disable login after email confirmation
+ACCOUNT_SIGNUP_REDIRECT_URL = '/accounts/google/login/'  # Redirect signup attempts
+
+# Metrics
+# StatsD is shared with gunicorn (see gunicorn.conf.py), so server and application
+# metrics land under the same prefix. STATSD_HOST is host[:port], STATSD_PORT the
+# port when it names none. Leave STATSD_HOST unset to disable.
+
+STATSD_HOST = os.getenv('STATSD_HOST')
+STATSD_PORT = int(os.getenv('STATSD_PORT', '8125'))
+STATSD_PREFIX = os.getenv('STATSD_PREFIX', 'gateway_to_stripe')
+
+STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY', 'your_default_public_key_here')
+STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', 'your_default_secret_key_here')
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', 'your_default_webhook_secret_here')
+
+# Create each user's Stripe customer in the background at signup (see subscriptions/customers.py)
+PROVISION_STRIPE_CUSTOMERS_ON_SIGNUP = True
+
+# Outbound Stripe traffic (see subscriptions/stripe_guard.py). STRIPE_API_BASE can
+# point at the local stand-in (`python manage.py stripe_standin`).
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_TIMEOUT = float(os.getenv('STRIPE_TIMEOUT', '10'))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', '2'))
+# Requests per second for the whole deployment; Stripe allows 100 in live mode.
+STRIPE_RATE_LIMIT = float(os.getenv('STRIPE_RATE_LIMIT', '50'))
+STRIPE_RATE_LIMIT_BURST = float(os.getenv('STRIPE_RATE_LIMIT_BURST', '20'))
+STRIPE_RATE_LIMIT_MAX_WAIT = float(os.getenv('STRIPE_RATE_LIMIT_MAX_WAIT', '2'))
+# Without Redis each process enforces STRIPE_RATE_LIMIT / STRIPE_RATE_LIMIT_PROCESSES,
+# so count every process that calls Stripe: all gunicorn workers (logged at startup,
+# derived from the CPU count unless WEB_CONCURRENCY is set) plus the outbox,
+# webhooks and usage worker processes. Production requires it when REDIS_URL is unset.
+STRIPE_RATE_LIMIT_PROCESSES = int(os.getenv('STRIPE_RATE_LIMIT_PROCESSES', '1'))
+STRIPE_BREAKER_FAILURE_THRESHOLD = int(os.getenv('STRIPE_BREAKER_FAILURE_THRESHOLD', '5'))
+STRIPE_BREAKER_RESET_TIMEOUT = float(os.getenv('STRIPE_BREAKER_RESET_TIMEOUT', '30'))
+
+# Verified webhook events are queued and applied by `python manage.py process_webhooks`
+# workers, partitioned by customer so each customer's events apply in order while
+# different customers run in parallel. A customer.subscription.updated event is
+# skipped while a newer one for the same subscription is queued, so a burst of them
+# is written once. Changing the partition count only affects events received afterwards.
+# A worker renews its partition lease every third of STRIPE_WEBHOOK_LEASE_SECONDS
+# while it applies events; the lease is never shorter than the worst-case time of a
+# Stripe call (stripe_guard.max_call_seconds()) plus 30 seconds.
+STRIPE_WEBHOOK_QUEUE = os.getenv('STRIPE_WEBHOOK_QUEUE', '1').lower() in ('1', 'true', 'yes')
+STRIPE_WEBHOOK_PARTITIONS = int(os.getenv('STRIPE_WEBHOOK_PARTITIONS', '16'))
+STRIPE_WEBHOOK_LEASE_SECONDS = int(os.getenv('STRIPE_WEBHOOK_LEASE_SECONDS', '120'))
+
+# Credit debits are summed per subscription and window, then reported to this
+# Stripe meter by `python manage.py export_usage` (see subscriptions/usage.py).
+# A window is exported STRIPE_USAGE_FLUSH_DELAY seconds after it closes.
+STRIPE_USAGE_METER_EVENT = os.getenv('STRIPE_USAGE_METER_EVENT', '')
+STRIPE_USAGE_WINDOW_SECONDS = int(os.getenv('STRIPE_USAGE_WINDOW_SECONDS', '60'))
+STRIPE_USAGE_FLUSH_DELAY = int(os.getenv('STRIPE_USAGE_FLUSH_DELAY', '30'))
+
+# Credits reserved for a long-running job (see subscriptions/reservations.py) go
+# back to the balance if the job neither commits nor releases them within this
+# many seconds; `python manage.py release_credit_reservations` returns them.
+CREDIT_RESERVATION_TTL = int(os.getenv('CREDIT_RESERVATION_TTL', '3600'))
+
+# Profiling (see subscriptions/profiling.py). Requests are profiled when they carry
+# an X-Profile token from `python manage.py profile_token`, valid for
+# PROFILE_TOKEN_MAX_AGE seconds, and at random at PROFILE_SAMPLE_RATE (0 to 1),
+# which also applies to the events the webhook workers process.
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', '1').lower() in ('1', 'true', 'yes')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN_MAX_AGE = int(os.getenv('PROFILE_TOKEN_MAX_AGE', '3600'))
+PROFILE_STACK_INTERVAL = float(os.getenv('PROFILE_STACK_INTERVAL', '0.001'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+SESSION_COOKIE_AGE = 315360000
+
+
+# Cache
+# A shared cache (Redis) is required for cached sessions to stay coherent across
+# gunicorn workers; without REDIS_URL each process only gets a local memory cache.
+
+REDIS_URL = os.getenv('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
+# Sessions
+# SESSION_BACKEND picks where sessions live:
+#   'db'             - every authenticated request reads django_session (Django default)
+#   'cached_db'      - reads are served from the cache, the database is the write-through fallback
+#   'signed_cookies' - no server-side storage, the session travels in the cookie
+# Prune the table with `python manage.py prune_sessions` (batched, safe to run on a live table).
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cached_db' if REDIS_URL else 'db')
+SESSION_ENGINE = SESSION_ENGINES[SESSION_BACKEND]
+SESSION_CACHE_ALIAS = 'default'
+
+# How long a worker may serve the plan catalog stamp (and the plans page fragment
+# versioned by it) before re-reading it. Saves through the ORM invalidate it
+# immediately in the shared cache; with a local memory cache other workers catch up
+# within this window.
+PLANS_CACHE_TIMEOUT = int(os.getenv('PLANS_CACHE_TIMEOUT', '300'))
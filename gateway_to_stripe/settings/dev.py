@@ -0,0 +1,7 @@
+"""
+Development profile: the settings the project has always run with locally.
+"""
+
+from .base import *
+
+DEBUG = True
@@ -0,0 +1,90 @@
+"""
+Production profile. DEBUG is off, so Django no longer records every SQL query in
+connection.queries, and long-lived workers keep a flat memory profile.
+
+Check memory with `python manage.py soak_rss` under DJANGO_ENV=production.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .base import *
+
+DEBUG = False
+
+# Fail closed: never fall back to the committed development key or to any host.
+SECRET_KEY = os.getenv('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    raise ImproperlyConfigured("Set DJANGO_SECRET_KEY for the production profile.")
+
+ALLOWED_HOSTS = [host.strip() for host in os.getenv('ALLOWED_HOSTS', '').split(',') if host.strip()]
+if not ALLOWED_HOSTS:
+    raise ImproperlyConfigured("Set ALLOWED_HOSTS (comma-separated) for the production profile.")
+
+# Each process only limits itself without Redis; guessing how many there are
+# would let them exceed Stripe's limit together.
+if not REDIS_URL and not os.getenv('STRIPE_RATE_LIMIT_PROCESSES'):
+    raise ImproperlyConfigured(
+        "Set REDIS_URL to share the Stripe rate limit, or STRIPE_RATE_LIMIT_PROCESSES to the "
+        "number of processes calling Stripe (gunicorn workers plus worker processes)."
+    )
+
+# Behind the platform's TLS-terminating router.
+SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+SESSION_COOKIE_SECURE = True
+CSRF_COOKIE_SECURE = True
+
+
+# Templates
+# Parse each template once per worker and keep the compiled version, and drop the
+# debug context processor.
+
+TEMPLATES[0]['APP_DIRS'] = False
+TEMPLATES[0]['OPTIONS'] = {
+    **TEMPLATES[0]['OPTIONS'],
+    'context_processors': [
+        processor for processor in TEMPLATES[0]['OPTIONS']['context_processors']
+        if processor != 'django.template.context_processors.debug'
+    ],
+    'loaders': [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ],
+}
+
+
+# Static files
+# WhiteNoise indexes the files collected by collectstatic once at startup and serves
+# hashed names with far-future caching. Never rescan the disk or the finders per
+# request, and only index the hashed copies to halve the in-memory file table.
+
+WHITENOISE_USE_FINDERS = False
+WHITENOISE_AUTOREFRESH = False
+WHITENOISE_KEEP_ONLY_HASHED_FILES = True
+
+
+# Memory bounds
+# Keep request bodies on disk past 2.5 MB and cap the per-process cache, so one
+# large upload or a hot cache cannot grow a worker indefinitely. gunicorn recycles
+# workers after WEB_MAX_REQUESTS as a final safety net.
+
+DATA_UPLOAD_MAX_MEMORY_SIZE = 2621440
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440
+
+if CACHES['default']['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache':
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': 1000}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.getenv('LOG_LEVEL', 'WARNING'),
+    },
+}
@@ -0,0 +1,43 @@
+"""
+Test profile: self-contained, no Postgres, Redis, StatsD or Stripe credentials needed.
+"""
+
+from .base import *
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+REDIS_URL = None
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+SESSION_BACKEND = 'db'
+SESSION_ENGINE = SESSION_ENGINES[SESSION_BACKEND]
+
+# Hashing is deliberately slow in production; tests create many users.
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+STORAGES = {
+    **STORAGES,
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+STATSD_HOST = None
+
+STRIPE_SECRET_KEY = 'sk_test_gateway_to_stripe'
+STRIPE_WEBHOOK_SECRET = 'whsec_gateway_to_stripe'
+STRIPE_WEBHOOK_QUEUE = False  # Apply events inside the webhook request
+
+PROVISION_STRIPE_CUSTOMERS_ON_SIGNUP = False
@@ -0,0 +1,111 @@
+"""
+Gunicorn configuration for gateway_to_stripe.
+
+Gunicorn loads this file automatically from the working directory. Everything can
+be overridden from the environment:
+
+    WEB_WORKER_CLASS   sync | gthread | asgi        (default: gthread)
+    WEB_CONCURRENCY    number of worker processes   (default: derived from CPU cores)
+    WEB_THREADS        threads per gthread worker   (default: 4)
+    WEB_TIMEOUT        seconds before a stuck worker is killed (default: 30)
+    WEB_MAX_REQUESTS   requests served before a worker is recycled (default: 1000)
+    PORT               port to bind                 (default: 8000)
+    STATSD_HOST        host[:port] of the StatsD collector shared with the app
+    DJANGO_ENV         settings profile             (default: production)
+
+Compare the worker models with `python manage.py loadtest_workers`.
+"""
+
+import os
+
+# gunicorn is how the app is served in production; pick that settings profile
+# unless the environment asks for another one.
+os.environ.setdefault('DJANGO_ENV', 'production')
+
+
+def available_cores():
+    """
+    Cores this process may actually use: the CPU affinity mask, further capped by
+    a cgroup v2 CPU quota when running inside a container (dynos, Docker).
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cores = min(cores, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'asgi': 'uvicorn_worker.UvicornWorker',
+}
+
+worker_model = os.getenv('WEB_WORKER_CLASS', 'gthread')
+if worker_model not in WORKER_CLASSES:
+    raise ValueError(f"WEB_WORKER_CLASS must be one of {sorted(WORKER_CLASSES)}, got {worker_model!r}")
+
+cores = available_cores()
+
+worker_class = WORKER_CLASSES[worker_model]
+if worker_model == 'sync':
+    # Sync workers block for the whole Stripe round trip, so oversubscribe the cores.
+    workers = int(os.getenv('WEB_CONCURRENCY', 2 * cores + 1))
+    threads = 1
+elif worker_model == 'gthread':
+    workers = int(os.getenv('WEB_CONCURRENCY', cores + 1))
+    threads = int(os.getenv('WEB_THREADS', '4'))
+else:
+    # The event loop already overlaps I/O; one process per core is enough.
+    workers = int(os.getenv('WEB_CONCURRENCY', cores))
+    threads = 1
+
+wsgi_app = 'gateway_to_stripe.asgi:application' if worker_model == 'asgi' else 'gateway_to_stripe.wsgi:application'
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Import Django once in the master so forked workers share its memory pages.
+preload_app = True
+
+# Stripe calls can take a few seconds; anything beyond this is a stuck worker.
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth; jitter avoids restarting all at once.
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '1000'))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+
+if os.getenv('STATSD_HOST'):
+    statsd_host = os.environ['STATSD_HOST'] if ':' in os.environ['STATSD_HOST'] \
+        else f"{os.environ['STATSD_HOST']}:{os.getenv('STATSD_PORT', '8125')}"
+    statsd_prefix = os.getenv('STATSD_PREFIX', 'gateway_to_stripe')
+
+
+def pre_fork(server, worker):
+    """
+    Nothing in the master may hold a database connection or pool when it forks,
+    otherwise workers would share one socket to Postgres.
+    """
+    from django.db import connections
+
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+        if getattr(connection, 'pool', None):
+            connection.close_pool()
+
+
+def post_fork(server, worker):
+    server.log.info(
+        "Worker %s started (%s, %s threads, %s workers on %s cores)",
+        worker.pid, worker_model, threads, workers, cores,
+    )
@@ -1,4 +1,226 @@
-from .models import StripePlan
-from django.contrib import admin
+import json
+from datetime import timedelta
 
-admin.site.register(StripePlan)
\ No newline at end of file
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.db.models import Max, Min, OuterRef, Subquery
+from django.db.models.functions import Now
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import live_updates, reservations
+from .models import CreditReservation, DailyPlanSummary, Invoice, StripePlan, StripeWebhookEvent, UserSubscription
+
+# Lists estimated above this many rows show the planner's estimate instead of an exact count.
+EXACT_COUNT_LIMIT = 10000
+# Bulk actions on more rows than this skip live updates; dashboards catch up on reload.
+LIVE_UPDATE_LIMIT = 1000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts large lists from the PostgreSQL planner's row estimate instead of
+    COUNT(*), which scans every matching row. Small lists and other databases
+    get an exact count.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+            if estimate > EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class IndexedDateHierarchyQuerySet(models.QuerySet):
+    """
+    date_hierarchy lists the distinct years, months or days of the rows shown,
+    which Django computes with a DISTINCT over every row. This probes each
+    candidate period between the first and last row with an EXISTS on the
+    indexed column instead: a few dozen index lookups at most.
+    """
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        if kind not in ('year', 'month', 'day'):
+            return super().datetimes(field_name, kind, order, tzinfo)
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        tzinfo = tzinfo or timezone.get_current_timezone()
+        first = timezone.localtime(bounds['first'], tzinfo)
+        last = timezone.localtime(bounds['last'], tzinfo)
+
+        periods = []
+        start = _period_start(first, kind)
+        while start <= last:
+            end = _next_period(start, kind)
+            if self.filter(**{f"{field_name}__gte": start, f"{field_name}__lt": end}).exists():
+                periods.append(start)
+            start = end
+        return periods[::-1] if order == 'DESC' else periods
+
+
+def _period_start(moment, kind):
+    moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if kind in ('year', 'month'):
+        moment = moment.replace(day=1)
+    if kind == 'year':
+        moment = moment.replace(month=1)
+    return moment
+
+
+def _next_period(start, kind):
+    if kind == 'year':
+        return start.replace(year=start.year + 1)
+    if kind == 'month':
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return _period_start(start + timedelta(days=1), 'day')
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables with millions of rows: estimated counts,
+    no second COUNT(*) of the unfiltered table, index-probing date hierarchy,
+    and no delete_selected action, which loads every selected row.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return IndexedDateHierarchyQuerySet(model=queryset.model, query=queryset.query, using=queryset._db)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+
+admin.site.register(StripePlan)
+
+
+@admin.register(UserSubscription)
+class UserSubscriptionAdmin(LargeTableAdmin):
+    list_display = ('user', 'plan', 'status', 'is_active', 'credits', 'current_period_end', 'stripe_subscription_id')
+    list_select_related = ('user', 'plan')
+    list_filter = ('status', 'is_active', 'plan')
+    # Exact matches only, so every term is an index lookup (see migration 0011 for email).
+    search_fields = ('stripe_subscription_id__exact', 'stripe_customer_id__exact',
+                     'user__email__iexact', 'user__username__exact')
+    search_help_text = "Exact Stripe subscription or customer id, email or username."
+    date_hierarchy = 'created_at'
+    raw_id_fields = ('user',)
+    readonly_fields = ('last_event_created', 'created_at', 'updated_at')
+    actions = ('refill_credits', 'revoke_credits')
+
+    @admin.action(description="Refill credits to the plan's monthly allotment")
+    def refill_credits(self, request, queryset):
+        allotment = StripePlan.objects.filter(pk=OuterRef('plan_id')).values('monthly_credit_allotment')[:1]
+        updated = queryset.filter(plan__isnull=False).update(
+            credits=Subquery(allotment), last_credit_refill_date=Now(), updated_at=Now())
+        self._publish(queryset, updated)
+        self.message_user(request, f"Refilled credits of {updated} subscriptions.", messages.SUCCESS)
+
+    @admin.action(description="Revoke all credits")
+    def revoke_credits(self, request, queryset):
+        updated = queryset.update(credits=0, updated_at=Now())
+        self._publish(queryset, updated)
+        self.message_user(request, f"Revoked credits of {updated} subscriptions.", messages.SUCCESS)
+
+    def _publish(self, queryset, updated):
+        # update() skips the post_save signal that normally publishes live updates.
+        if updated <= LIVE_UPDATE_LIMIT:
+            for user_sub in queryset.order_by().iterator():
+                live_updates.publish_subscription_update(user_sub)
+
+
+class InvoiceStatusFilter(admin.SimpleListFilter):
+    # A plain list_filter on status would run SELECT DISTINCT over the whole table.
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return [(status, status.title()) for status in ('draft', 'open', 'paid', 'uncollectible', 'void')]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(status=self.value())
+        return queryset
+
+
+@admin.register(Invoice)
+class InvoiceAdmin(LargeTableAdmin):
+    list_display = ('stripe_invoice_id', 'user', 'amount_due', 'currency', 'status',
+                    'is_successful_payment', 'period_start', 'created_at')
+    list_select_related = ('user',)
+    list_filter = (InvoiceStatusFilter, 'is_successful_payment')
+    search_fields = ('stripe_invoice_id__exact', 'user_subscription_id__exact',
+                     'user__email__iexact', 'user__username__exact')
+    search_help_text = "Exact Stripe invoice or subscription id, email or username."
+    date_hierarchy = 'created_at'
+    raw_id_fields = ('user',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(StripeWebhookEvent)
+class StripeWebhookEventAdmin(LargeTableAdmin):
+    list_display = ('stripe_event_id', 'event_type', 'ordering_key', 'status', 'attempts', 'created', 'processed_at')
+    list_filter = ('status',)
+    search_fields = ('stripe_event_id__exact', 'ordering_key__exact')
+    search_help_text = "Exact Stripe event id, or customer id to see all of a customer's events."
+    readonly_fields = [field.name for field in StripeWebhookEvent._meta.fields]
+    actions = ('retry_events',)
+
+    @admin.action(description="Retry selected failed events")
+    def retry_events(self, request, queryset):
+        updated = queryset.filter(status=StripeWebhookEvent.FAILED).update(
+            status=StripeWebhookEvent.PENDING, attempts=0, last_error='', next_attempt_at=Now())
+        self.message_user(request, f"Queued {updated} events for another attempt.", messages.SUCCESS)
+
+
+@admin.register(CreditReservation)
+class CreditReservationAdmin(LargeTableAdmin):
+    list_display = ('user_subscription', 'amount', 'committed_amount', 'status', 'expires_at', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('user_subscription__stripe_customer_id__exact', 'user_subscription__user__username__exact')
+    search_help_text = "Exact Stripe customer id or username."
+    readonly_fields = [field.name for field in CreditReservation._meta.fields]
+    actions = ('release_reservations',)
+
+    @admin.action(description="Release selected held reservations")
+    def release_reservations(self, request, queryset):
+        released = sum(
+            reservations.release(reservation)
+            for reservation in queryset.filter(status=CreditReservation.HELD).select_related('user_subscription')
+        )
+        self.message_user(request, f"Returned the credits of {released} reservations.", messages.SUCCESS)
+
+
+@admin.register(DailyPlanSummary)
+class DailyPlanSummaryAdmin(admin.ModelAdmin):
+    list_display = ('day', 'plan', 'currency', 'revenue', 'invoices_paid', 'invoices_failed', 'new_subscriptions',
+                    'churned_subscriptions', 'active_subscriptions', 'mrr', 'credits_used')
+    list_select_related = ('plan',)
+    list_filter = ('plan', 'currency')
+    date_hierarchy = 'day'
+    ordering = ('-day', 'plan')
+
+    # Maintained by subscriptions.summaries only.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
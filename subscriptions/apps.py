@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class SubscriptionsConfig(AppConfig):
+    name = 'subscriptions'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,147 @@
+# subscriptions/catalog.py
+"""
+The plan catalog: StripePlan rows, one per Stripe price offered.
+
+The rows are synced from Stripe by `python manage.py sync_stripe_prices` and
+kept current by the price.* and product.* webhooks, so price lookups during
+checkout and webhook handling read the local table only. A price's monthly
+credits come from a `credits` metadata entry on the price or its product;
+without one, the credits set on the plan by hand are kept.
+"""
+
+from datetime import datetime, timezone
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.db.models.functions import Now
+from django.utils import timezone as dj_timezone
+
+from .models import StripePlan
+from .stripe_client import stripe
+
+PLANS_LAST_MODIFIED_CACHE_KEY = 'subscriptions:plans:last_modified'
+
+CREDITS_METADATA_KEY = 'credits'
+PLAN_TYPES = {'month': 'monthly', 'year': 'yearly'}  # Recurring interval -> plan_type
+SYNCED_FIELDS = ['name', 'stripe_product_id', 'plan_type', 'price', 'currency', 'description', 'is_active', 'updated_at']
+
+
+def plans_last_modified():
+    """
+    Returns when the plan catalog last changed. It versions the cached plan list
+    fragment and the plans page's ETag/Last-Modified, so it is answered from the
+    cache and only falls back to MAX(updated_at) once per PLANS_CACHE_TIMEOUT.
+    """
+    last_modified = cache.get(PLANS_LAST_MODIFIED_CACHE_KEY)
+    if last_modified is None:
+        last_modified = (
+            StripePlan.objects.aggregate(last_modified=Max('updated_at'))['last_modified']
+            or datetime(1970, 1, 1, tzinfo=timezone.utc)
+        )
+        cache.set(PLANS_LAST_MODIFIED_CACHE_KEY, last_modified, settings.PLANS_CACHE_TIMEOUT)
+    return last_modified
+
+
+def plans_changed(last_modified=None):
+    """
+    Marks the catalog as changed. Called from the StripePlan signals; code that
+    bypasses them (queryset.update(), bulk_create()) must call it explicitly.
+    """
+    cache.set(PLANS_LAST_MODIFIED_CACHE_KEY, last_modified or dj_timezone.now(), settings.PLANS_CACHE_TIMEOUT)
+
+
+def plan_for_price(price_id):
+    """
+    The plan for a Stripe price id, or None. One indexed lookup; never calls Stripe.
+    """
+    return StripePlan.objects.filter(stripe_price_id=price_id).first()
+
+
+def plan_from_price(price):
+    """
+    An unsaved StripePlan for a Stripe price whose product is expanded, or None
+    for prices that cannot be a plan: tiered or metered prices, and intervals
+    other than one month or one year. One-time prices are lifetime plans.
+    """
+    product = price['product']
+    recurring = price.get('recurring')
+    if price.get('unit_amount') is None or not isinstance(product, dict):
+        return None
+    if recurring:
+        plan_type = PLAN_TYPES.get(recurring.get('interval')) if recurring.get('interval_count', 1) == 1 else None
+        if plan_type is None:
+            return None
+    else:
+        plan_type = 'lifetime'
+
+    plan = StripePlan(
+        name=(price.get('nickname') or product.get('name') or price['id'])[:100],
+        stripe_price_id=price['id'],
+        stripe_product_id=product['id'],
+        plan_type=plan_type,
+        price=price['unit_amount'] / Decimal(100),
+        currency=price.get('currency') or 'usd',
+        description=product.get('description') or '',
+        is_active=bool(price.get('active')) and bool(product.get('active')) and not product.get('deleted'),
+    )
+    credits = _credits(price)
+    if credits is None:
+        credits = _credits(product)
+    if credits is not None:
+        plan.monthly_credit_allotment = credits
+    plan.has_credits = credits is not None
+    return plan
+
+
+def _credits(stripe_object):
+    value = (stripe_object.get('metadata') or {}).get(CREDITS_METADATA_KEY)
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def sync_prices(prices, batch_size=500):
+    """
+    Creates or updates the plan of every plan-shaped price in `prices` (with
+    products expanded), one INSERT ... ON CONFLICT per batch. Returns the
+    number of prices synced and skipped.
+    """
+    prices = iter(prices)
+    synced = skipped = 0
+    while batch := list(islice(prices, batch_size)):
+        plans = [plan_from_price(price) for price in batch]
+        skipped += plans.count(None)
+        plans = [plan for plan in plans if plan is not None]
+        for has_credits in (True, False):
+            group = [plan for plan in plans if plan.has_credits == has_credits]
+            if group:
+                StripePlan.objects.bulk_create(
+                    group, update_conflicts=True, unique_fields=['stripe_price_id'],
+                    update_fields=SYNCED_FIELDS + (['monthly_credit_allotment'] if has_credits else []),
+                )
+        synced += len(plans)
+    if synced:
+        # bulk_create() skips the post_save signal that versions the cached catalog.
+        plans_changed()
+    return synced, skipped
+
+
+def fetch_prices(**params):
+    """
+    Every Stripe price matching `params`, products expanded, in pages of 100.
+    """
+    return stripe.Price.list(expand=['data.product'], limit=100, **params).auto_paging_iter()
+
+
+def deactivate_plans(**filters):
+    """
+    Stops offering the matching plans. Subscribers keep theirs.
+    """
+    deactivated = StripePlan.objects.filter(is_active=True, **filters).update(is_active=False, updated_at=Now())
+    if deactivated:
+        plans_changed()
+    return deactivated
@@ -0,0 +1,74 @@
+# subscriptions/customers.py
+"""
+One Stripe customer per user, recorded in StripeCustomer.
+
+The customer is created in the background right after signup, so checkout,
+payment-method updates and webhook reconciliation only ever read the stored id.
+get_stripe_customer_id() is the single entry point and is safe to call from
+several places at once: the Stripe call uses a per-user idempotency key and the
+one-to-one StripeCustomer row decides the winner.
+"""
+
+import logging
+import threading
+
+from django.db import connection
+
+from .models import StripeCustomer, UserSubscription
+from .stripe_client import stripe
+
+logger = logging.getLogger(__name__)
+
+
+def get_stripe_customer_id(user, create=True):
+    """
+    Returns the user's Stripe customer id. A customer already attached to one of
+    their subscriptions is adopted; otherwise one is created when `create` is set.
+    """
+    customer = StripeCustomer.objects.filter(user=user).only('stripe_customer_id').first()
+    if customer:
+        return customer.stripe_customer_id
+
+    customer_id = (
+        UserSubscription.objects.filter(user=user).exclude(stripe_customer_id='')
+        .values_list('stripe_customer_id', flat=True).first()
+    )
+    if not customer_id:
+        if not create:
+            return None
+        customer_id = stripe.Customer.create(
+            email=user.email,
+            name=user.get_full_name() or user.username,
+            metadata={'user_id': str(user.pk)},
+            idempotency_key=f"customer-create-{user.pk}",
+        ).id
+
+    return record_stripe_customer(user, customer_id)
+
+
+def record_stripe_customer(user, customer_id):
+    """
+    Stores the user's customer id unless one is already recorded, and returns the stored id.
+    """
+    customer, _ = StripeCustomer.objects.get_or_create(
+        user=user,
+        defaults={'stripe_customer_id': customer_id, 'is_active': True},
+    )
+    return customer.stripe_customer_id
+
+
+def provision_in_background(user):
+    """
+    Creates the user's Stripe customer off the request thread (signup must not
+    wait on Stripe). Failures are only logged: checkout creates the customer on
+    demand if it is still missing.
+    """
+    def provision():
+        try:
+            get_stripe_customer_id(user)
+        except Exception:
+            logger.warning("Could not provision a Stripe customer for user %s", user.pk, exc_info=True)
+        finally:
+            connection.close()
+
+    threading.Thread(target=provision, name=f"stripe-customer-{user.pk}", daemon=True).start()
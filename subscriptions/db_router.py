@@ -0,0 +1,153 @@
+# subscriptions/db_router.py
+"""
+Sends read-only queries to the read replicas in DB_REPLICA_HOSTS and
+everything else to the primary.
+
+Reads stay on the primary when:
+- the request is not a GET/HEAD/OPTIONS (webhooks, credit debits, checkout);
+- the request, or one from the same browser in the last DB_REPLICA_PIN_SECONDS,
+  wrote to the primary (ReplicaRoutingMiddleware tracks this in a cookie), so
+  users always see their own changes;
+- the query runs inside a transaction on the primary (select_for_update, reads
+  that must see the transaction's own writes);
+- the code runs inside `with use_primary():`;
+- every replica lags more than DB_REPLICA_MAX_LAG seconds, or cannot be reached.
+
+Without replicas configured the router is a no-op.
+"""
+
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+REPLICA_PREFIX = 'replica'
+
+_use_primary = contextvars.ContextVar('use_primary', default=False)
+_wrote = contextvars.ContextVar('wrote_to_primary', default=False)
+
+# alias -> (monotonic time of the check, healthy)
+_replica_health = {}
+_replica_health_lock = threading.Lock()
+
+_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith(REPLICA_PREFIX)]
+
+
+@contextmanager
+def use_primary():
+    """
+    Routes every read in the block to the primary.
+    """
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+@contextmanager
+def request_scope(pin):
+    """
+    Routing state for one request. Yields a dict whose 'wrote' key tells, after
+    the block, whether the request wrote to the primary.
+    """
+    primary_token = _use_primary.set(pin)
+    wrote_token = _wrote.set(False)
+    state = {'wrote': False}
+    try:
+        with connections[DEFAULT_DB_ALIAS].execute_wrapper(record_writes):
+            yield state
+        state['wrote'] = _wrote.get()
+    finally:
+        _wrote.reset(wrote_token)
+        _use_primary.reset(primary_token)
+
+
+def record_writes(execute, sql, params, many, context):
+    """
+    execute_wrapper for the primary: the first write pins the rest of the request.
+    """
+    if sql.lstrip()[:6].upper() in _WRITE_STATEMENTS:
+        _wrote.set(True)
+        _use_primary.set(True)
+    return execute(sql, params, many, context)
+
+
+def replica_lag(alias):
+    """
+    Seconds the replica is behind the primary. A replica that has replayed
+    everything it received counts as current, even if the primary has been idle.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE"
+            " WHEN NOT pg_is_in_recovery() THEN 0"
+            " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+            " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+            " END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+def is_healthy(alias):
+    """
+    Whether the replica is within DB_REPLICA_MAX_LAG. The answer is cached per
+    process for DB_REPLICA_LAG_CHECK_INTERVAL seconds, so routing costs no query.
+    """
+    now = time.monotonic()
+    with _replica_health_lock:
+        checked = _replica_health.get(alias)
+        if checked and now - checked[0] < settings.DB_REPLICA_LAG_CHECK_INTERVAL:
+            return checked[1]
+        # Other threads keep using the previous answer while this one checks.
+        _replica_health[alias] = (now, checked[1] if checked else False)
+
+    try:
+        lag = replica_lag(alias)
+        healthy = lag <= settings.DB_REPLICA_MAX_LAG
+        metrics.gauge(f"db.{alias}.lag_seconds", round(lag, 3))
+    except Exception:
+        logger.warning("Could not check lag of database %s", alias, exc_info=True)
+        healthy = False
+    if not healthy:
+        metrics.incr(f"db.{alias}.unhealthy")
+
+    with _replica_health_lock:
+        _replica_health[alias] = (time.monotonic(), healthy)
+    return healthy
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = [alias for alias in replica_aliases() if is_healthy(alias)]
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return not db.startswith(REPLICA_PREFIX)
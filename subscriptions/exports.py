@@ -0,0 +1,153 @@
+# subscriptions/exports.py
+"""
+Streaming CSV and JSON Lines exports of invoices and subscriptions, for the
+staff export endpoints and `python manage.py export_records`.
+
+Rows are read with iterator(chunk_size=...), which on PostgreSQL uses a
+server-side cursor, and written out as they arrive, so memory stays flat for
+any number of rows. The CSV header goes out before the query runs, so the
+first byte is sent at once.
+"""
+
+import csv
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Invoice, UserSubscription
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+CHUNK_SIZE = 2000  # Rows fetched per round trip to the database
+ROWS_PER_WRITE = 500
+
+
+class Export:
+    def __init__(self, model, columns, plan_path):
+        self.model = model
+        # (header, lookup) pairs
+        self.columns = columns
+        self.plan_path = plan_path
+
+    @property
+    def header(self):
+        return [header for header, _ in self.columns]
+
+
+EXPORTS = {
+    'invoices': Export(Invoice, [
+        ('stripe_invoice_id', 'stripe_invoice_id'),
+        ('stripe_subscription_id', 'user_subscription_id'),
+        ('username', 'user__username'),
+        ('email', 'user__email'),
+        ('amount_due', 'amount_due'),
+        ('currency', 'currency'),
+        ('status', 'status'),
+        ('is_successful_payment', 'is_successful_payment'),
+        ('period_start', 'period_start'),
+        ('period_end', 'period_end'),
+        ('created_at', 'created_at'),
+    ], plan_path='user__usersubscription__plan'),  # Invoices carry no plan; use the subscriber's
+    'subscriptions': Export(UserSubscription, [
+        ('stripe_subscription_id', 'stripe_subscription_id'),
+        ('stripe_customer_id', 'stripe_customer_id'),
+        ('username', 'user__username'),
+        ('email', 'user__email'),
+        ('plan', 'plan__name'),
+        ('stripe_price_id', 'plan__stripe_price_id'),
+        ('status', 'status'),
+        ('is_active', 'is_active'),
+        ('is_paused', 'is_paused'),
+        ('cancel_at_period_end', 'cancel_at_period_end_stripe'),
+        ('credits', 'credits'),
+        ('current_period_start', 'current_period_start'),
+        ('current_period_end', 'current_period_end'),
+        ('created_at', 'created_at'),
+    ], plan_path='plan'),
+}
+
+
+class ExportFilterError(ValueError):
+    pass
+
+
+def parse_filters(start=None, end=None, status=None, plan=None):
+    """
+    Validates export filters given as strings. `start` and `end` are dates
+    (inclusive) matched against created_at; `plan` is a plan id or Stripe price id.
+    """
+    filters = {'status': status or None, 'plan': plan or None}
+    for name, value in (('start', start), ('end', end)):
+        filters[name] = parse_date(value) if value else None
+        if value and filters[name] is None:
+            raise ExportFilterError(f"{name} must be a date like 2025-01-31, got {value!r}")
+    return filters
+
+
+def rows(kind, start=None, end=None, status=None, plan=None):
+    """
+    The export's rows as tuples, in primary key order, read in chunks.
+    """
+    export = EXPORTS[kind]
+    queryset = export.model.objects.all()
+    if start:
+        queryset = queryset.filter(created_at__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end:
+        queryset = queryset.filter(created_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+    if status:
+        queryset = queryset.filter(status=status)
+    if plan:
+        lookup = f"{export.plan_path}_id" if plan.isdigit() else f"{export.plan_path}__stripe_price_id"
+        queryset = queryset.filter(**{lookup: plan})
+    lookups = [lookup for _, lookup in export.columns]
+    return queryset.order_by('pk').values_list(*lookups).iterator(chunk_size=CHUNK_SIZE)
+
+
+def stream(kind, fmt, **filters):
+    """
+    Yields the export as text chunks of up to ROWS_PER_WRITE rows.
+    """
+    header = EXPORTS[kind].header
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(header)
+        lines = (writer.writerow([_csv_value(value) for value in row]) for row in rows(kind, **filters))
+    else:
+        encoder = DjangoJSONEncoder()
+        lines = (encoder.encode(dict(zip(header, row))) + '\n' for row in rows(kind, **filters))
+    while chunk := ''.join(islice(lines, ROWS_PER_WRITE)):
+        yield chunk
+
+
+async def astream(chunks):
+    """
+    Serves a stream() to an ASGI server one chunk at a time. Django would read a
+    synchronous iterator into memory whole; this keeps the cursor in the one
+    thread that runs synchronous code instead.
+    """
+    next_chunk = sync_to_async(lambda: next(chunks, None), thread_sensitive=True)
+    while (chunk := await next_chunk()) is not None:
+        yield chunk
+
+
+def filename(kind, fmt):
+    return f"{kind}-{timezone.localdate().isoformat()}.{fmt}"
+
+
+class _Echo:
+    # csv.writer needs a file; writerow() then returns the line instead of storing it.
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
@@ -0,0 +1,142 @@
+# subscriptions/live_updates.py
+"""
+Pub/sub channel that pushes a user's credit balance and subscription status to
+the server-sent events endpoint (views.subscription_events).
+
+Every UserSubscription save publishes a snapshot after the transaction commits.
+With REDIS_URL set, snapshots go through Redis pub/sub, so a debit handled by one
+worker reaches clients connected to any other worker; each ASGI worker runs a
+single listener that fans out to its local connections. Without Redis, only
+clients connected to the same process are notified (they still get a fresh
+snapshot whenever they reconnect).
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'subscriptions:live:'
+
+# user id -> {(event loop, asyncio.Queue)} of the connections open in this process
+_subscribers = defaultdict(set)
+_subscribers_lock = threading.Lock()
+
+_redis_client = None
+_listener_tasks = {}
+
+
+def subscription_snapshot(user_sub):
+    """
+    What connected clients receive. Only local columns, so building it from a
+    post_save signal never triggers extra queries.
+    """
+    return {
+        'credits': user_sub.credits,
+        'status': user_sub.status,
+        'status_display': user_sub.get_status_display(),
+        'is_active': user_sub.is_active,
+        'is_paused': user_sub.is_paused,
+        'cancel_at_period_end': user_sub.cancel_at_period_end_stripe,
+        'plan_id': user_sub.plan_id,
+        'current_period_end': user_sub.current_period_end.isoformat() if user_sub.current_period_end else None,
+    }
+
+
+def publish_subscription_update(user_sub):
+    """
+    Publishes the subscription's current state once the surrounding transaction
+    commits, so clients never see a balance that is later rolled back.
+    """
+    user_id = str(user_sub.user_id)
+    payload = json.dumps(subscription_snapshot(user_sub))
+    transaction.on_commit(lambda: _publish(user_id, payload))
+
+
+def _publish(user_id, payload):
+    if settings.REDIS_URL:
+        global _redis_client
+        try:
+            if _redis_client is None:
+                import redis
+                _redis_client = redis.Redis.from_url(settings.REDIS_URL)
+            _redis_client.publish(CHANNEL_PREFIX + user_id, payload)
+        except Exception:
+            # Live updates are best effort; the request that changed the balance must not fail.
+            logger.warning("Could not publish live update for user %s", user_id, exc_info=True)
+    else:
+        _dispatch(user_id, payload)
+
+
+def _dispatch(user_id, payload):
+    with _subscribers_lock:
+        targets = list(_subscribers.get(user_id, ()))
+    for loop, queue in targets:
+        loop.call_soon_threadsafe(_offer_latest, queue, payload)
+
+
+def _offer_latest(queue, payload):
+    """
+    Each connection only needs the latest snapshot: a slow client keeps one
+    pending message instead of an ever-growing backlog.
+    """
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(payload)
+
+
+async def _listen_redis():
+    import redis.asyncio
+
+    while True:
+        try:
+            client = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+            async with client.pubsub() as pubsub:
+                await pubsub.psubscribe(CHANNEL_PREFIX + '*')
+                async for message in pubsub.listen():
+                    if message['type'] == 'pmessage':
+                        user_id = message['channel'].decode()[len(CHANNEL_PREFIX):]
+                        _dispatch(user_id, message['data'].decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning("Live update listener lost its Redis connection, reconnecting", exc_info=True)
+            await asyncio.sleep(1)
+
+
+class subscribe:
+    """
+    Async context manager registering one connection for a user's updates:
+
+        async with live_updates.subscribe(user.pk) as queue:
+            payload = await queue.get()
+    """
+
+    def __init__(self, user_id):
+        self.user_id = str(user_id)
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        self.entry = (loop, asyncio.Queue(maxsize=1))
+        with _subscribers_lock:
+            _subscribers[self.user_id].add(self.entry)
+
+        if settings.REDIS_URL:
+            task = _listener_tasks.get(loop)
+            if task is None or task.done():
+                _listener_tasks[loop] = loop.create_task(_listen_redis())
+        return self.entry[1]
+
+    async def __aexit__(self, *exc_info):
+        with _subscribers_lock:
+            connections = _subscribers.get(self.user_id)
+            if connections is not None:
+                connections.discard(self.entry)
+                if not connections:
+                    del _subscribers[self.user_id]
@@ -0,0 +1,141 @@
+# subscriptions/locking.py
+"""
+How UserSubscription rows are written when several writers race for them.
+
+- Frequent per-request writers (credit debits, monthly refills, period-end
+  expiry from CreditRefillMiddleware) never hold locks. Each one is a single
+  UPDATE that only touches its own fields and carries its precondition in the
+  WHERE clause, so the database decides atomically and a concurrent writer's
+  fields are never overwritten.
+- Webhooks read-modify-write several fields at once. They take the row with
+  select_for_update() inside the webhook transaction, so the conditional
+  updates above wait for them and then re-check their WHERE clause against the
+  committed row.
+- User actions (pause, resume, cancel) use lock_for_user_action(), which does
+  not queue behind a webhook or another click: the lock is taken with NOWAIT
+  and the user is asked to retry.
+- Background sweeps use select_for_update(skip_locked=True) and leave rows
+  another writer holds for their next pass.
+
+Writers that lock more than one kind of row lock the UserSubscription row
+first and outbox entries or invoices after it, so lock waits never form a cycle.
+Credit reservations (subscriptions/reservations.py) are the exception: they
+write their own row first, and nothing locks a subscription and then a reservation.
+
+The conditional updates bypass save() and its post_save signal, so they set
+updated_at themselves and publish live updates and summary changes explicitly.
+"""
+
+from datetime import timedelta
+
+from django.db import DatabaseError, router, transaction
+from django.db.models import F
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from . import live_updates, summaries, usage
+from .models import UserSubscription
+
+REFILL_INTERVAL = timedelta(days=30)  # Simple approximation of a month
+
+
+class SubscriptionBusy(Exception):
+    """
+    Another request holds the subscription row; the user should retry.
+    """
+
+
+def lock_for_user_action(user):
+    """
+    Locks the user's subscription for a read-modify-write in the current
+    transaction, failing immediately instead of waiting if the row is busy.
+    """
+    try:
+        return UserSubscription.objects.select_for_update(nowait=True).get(user=user)
+    except DatabaseError as e:
+        raise SubscriptionBusy() from e
+
+
+def debit_credits(user_sub, amount):
+    """
+    Takes `amount` credits if the subscription is active and has enough, and
+    records the usage for export to Stripe. Returns True when the debit was
+    applied; `user_sub.credits` is refreshed either way.
+    """
+    with transaction.atomic():
+        debited = UserSubscription.objects.filter(
+            pk=user_sub.pk, is_active=True, credits__gte=amount,
+        ).update(credits=F('credits') - amount, updated_at=Now())
+        if debited:
+            usage.record(user_sub, amount)
+    refresh_fields(user_sub, 'credits', 'is_active')
+    if debited:
+        live_updates.publish_subscription_update(user_sub)
+    return bool(debited)
+
+
+def expire_if_period_ended(user_sub):
+    """
+    Deactivates the subscription and revokes its credits once the current
+    period has ended. Only one concurrent caller performs the expiry.
+    """
+    now = timezone.now()
+    if not (user_sub.is_active and user_sub.current_period_end and user_sub.current_period_end < now):
+        return False
+    expired = UserSubscription.objects.filter(
+        pk=user_sub.pk, is_active=True, current_period_end__lt=now,
+    ).update(is_active=False, status='ended', credits=0, updated_at=Now())
+    refresh_fields(user_sub, 'is_active', 'status', 'credits')
+    if expired:
+        live_updates.publish_subscription_update(user_sub)
+        summaries.record_subscription_change(
+            summaries.SubscriptionState(user_sub.plan_id, True, user_sub.is_paused),
+            summaries.subscription_state(user_sub),
+        )
+    return bool(expired)
+
+
+def refill_if_due(user_sub):
+    """
+    Refills the monthly credit allotment for every refill date that has passed
+    within the current period. The update is a compare-and-set on
+    last_credit_refill_date, so concurrent requests refill a period only once.
+    """
+    last_refill = user_sub.last_credit_refill_date
+    if not (user_sub.is_active and last_refill and user_sub.plan_id):
+        return False
+
+    now = timezone.now()
+    next_refill = last_refill + REFILL_INTERVAL
+    refilled_until = None
+    # Catch up on every missed refill, but never past the end of the Stripe billing period
+    while next_refill <= now and next_refill <= user_sub.current_period_end:
+        refilled_until = next_refill
+        next_refill += REFILL_INTERVAL
+    if refilled_until is None:
+        return False
+
+    refilled = UserSubscription.objects.filter(
+        pk=user_sub.pk, is_active=True, last_credit_refill_date=last_refill,
+    ).update(
+        credits=user_sub.plan.monthly_credit_allotment,
+        last_credit_refill_date=refilled_until,
+        updated_at=Now(),
+    )
+    refresh_fields(user_sub, 'credits', 'is_active', 'last_credit_refill_date')
+    if refilled:
+        live_updates.publish_subscription_update(user_sub)
+    return bool(refilled)
+
+
+def refresh_fields(user_sub, *fields):
+    """
+    Reloads `fields` of `user_sub` after a conditional UPDATE, and marks them
+    clean, so a later save() of the instance does not write them back.
+    """
+    # From the primary: a replica may not have the update yet
+    values = UserSubscription.objects.using(router.db_for_write(UserSubscription)).filter(
+        pk=user_sub.pk).values(*fields).first()
+    for field, value in (values or {}).items():
+        setattr(user_sub, field, value)
+    user_sub._snapshot(set(values or ()))
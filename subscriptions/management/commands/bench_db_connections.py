@@ -0,0 +1,73 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures per-request database connection latency: a fresh connection per "
+        "request (no reuse) against the configured persistent or pooled connections."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100,
+                            help="Number of simulated requests per mode.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        requests = options['requests']
+
+        if connection.settings_dict['OPTIONS'].get('pool'):
+            configured = 'pooled'
+        elif connection.settings_dict['CONN_MAX_AGE']:
+            configured = f"persistent ({connection.settings_dict['CONN_MAX_AGE']}s)"
+        else:
+            configured = 'no reuse'
+
+        self.stdout.write(f"{'mode':<24}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        self.report('fresh connection', self.time_requests(requests, lambda: self.fresh_request(connection)))
+        self.report(configured, self.time_requests(requests, lambda: self.configured_request(connection)))
+
+    def time_requests(self, requests, run_request):
+        run_request()  # Warm up (DNS, pool opening) outside of the measurements.
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            run_request()
+            timings.append((time.perf_counter() - start) * 1000)
+        return sorted(timings)
+
+    def fresh_request(self, connection):
+        """
+        Opens a brand new driver connection, as every request did before connections were reused.
+        """
+        conn = connection.Database.connect(**connection.get_connection_params())
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        finally:
+            conn.close()
+
+    def configured_request(self, connection):
+        """
+        Goes through the same signals Django's handlers send, so CONN_MAX_AGE,
+        CONN_HEALTH_CHECKS and the pool behave exactly as they do for real requests.
+        """
+        request_started.send(sender=self.__class__)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        finally:
+            request_finished.send(sender=self.__class__)
+
+    def report(self, mode, timings):
+        self.stdout.write(
+            f"{mode:<24}"
+            f"{statistics.fmean(timings):>10.2f}"
+            f"{timings[len(timings) // 2]:>10.2f}"
+            f"{timings[int(len(timings) * 0.95)]:>10.2f}"
+        )
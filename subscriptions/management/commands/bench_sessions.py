@@ -0,0 +1,56 @@
+import statistics
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the per-request cost of loading an authenticated session for each "
+        "session engine, so the 'db' baseline can be compared with 'cached_db' and "
+        "'signed_cookies'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000,
+                            help="Number of simulated requests per engine.")
+        parser.add_argument('--engine', action='append', choices=sorted(settings.SESSION_ENGINES),
+                            help="Engine to benchmark (repeatable). Defaults to all of them.")
+
+    def handle(self, *args, **options):
+        engines = options['engine'] or list(settings.SESSION_ENGINES)
+        self.stdout.write(f"{'engine':<16}{'mean us':>10}{'p50 us':>10}{'p95 us':>10}")
+        for name in engines:
+            timings = self.run_engine(settings.SESSION_ENGINES[name], options['requests'])
+            timings.sort()
+            self.stdout.write(
+                f"{name:<16}"
+                f"{statistics.fmean(timings):>10.1f}"
+                f"{timings[len(timings) // 2]:>10.1f}"
+                f"{timings[int(len(timings) * 0.95)]:>10.1f}"
+            )
+
+    def run_engine(self, engine_path, requests):
+        SessionStore = import_module(engine_path).SessionStore
+
+        # Same shape as what allauth/auth put in the session of a logged-in user.
+        session = SessionStore()
+        session[SESSION_KEY] = '1'
+        session[BACKEND_SESSION_KEY] = 'allauth.account.auth_backends.AuthenticationBackend'
+        session[HASH_SESSION_KEY] = 'x' * 64
+        session.save()
+        session_key = session.session_key
+
+        timings = []
+        try:
+            for _ in range(requests):
+                start = time.perf_counter()
+                # What SessionMiddleware + AuthenticationMiddleware do on every request.
+                SessionStore(session_key=session_key).get(SESSION_KEY)
+                timings.append((time.perf_counter() - start) * 1_000_000)
+        finally:
+            session.delete()
+        return timings
@@ -0,0 +1,73 @@
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# What a worker does before it can serve its first request: set up Django (apps,
+# models, middleware) and resolve the URLconf, which imports every view module.
+BOOT_SCRIPT = """
+import django
+django.setup()
+from django.core.handlers.wsgi import WSGIHandler
+WSGIHandler()
+from django.urls import get_resolver
+get_resolver().url_patterns
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Boots the application in a fresh interpreter with `python -X importtime` and "
+        "reports wall time plus import time per package, so boot-time regressions are visible."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20,
+                            help="Number of packages (or modules) to list.")
+        parser.add_argument('--modules', action='store_true',
+                            help="List individual modules by cumulative time instead of grouping by package.")
+        parser.add_argument('--runs', type=int, default=3,
+                            help="Boots to run; the fastest one is reported to reduce noise.")
+
+    def handle(self, *args, **options):
+        best = None
+        for _ in range(options['runs']):
+            run = self.boot()
+            if best is None or run[0] < best[0]:
+                best = run
+        wall_ms, imports = best
+
+        if options['modules']:
+            rows = sorted(((cumulative, name) for name, _, cumulative in imports), reverse=True)
+            label = 'module (cumulative)'
+        else:
+            per_package = defaultdict(int)
+            for name, self_us, _ in imports:
+                per_package[name.split('.')[0]] += self_us
+            rows = sorted(((total, name) for name, total in per_package.items()), reverse=True)
+            label = 'package (self time)'
+
+        self.stdout.write(f"Boot wall time: {wall_ms:.1f} ms, {len(imports)} modules imported")
+        self.stdout.write(f"{label:<50}{'ms':>10}")
+        for micros, name in rows[:options['top']]:
+            self.stdout.write(f"{name:<50}{micros / 1000:>10.1f}")
+
+    def boot(self):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        imports = []
+        for line in result.stderr.splitlines():
+            # "import time:       self [us] |  cumulative | imported package"
+            if not line.startswith('import time:') or 'imported package' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            imports.append((name.strip(), int(self_us), int(cumulative_us)))
+        return wall_ms, imports
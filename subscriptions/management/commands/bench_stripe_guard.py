@@ -0,0 +1,70 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from subscriptions.stripe_client import stripe
+from subscriptions.stripe_guard import StripeUnavailable
+from subscriptions.stripe_standin import StripeStandIn
+
+
+class Command(BaseCommand):
+    help = (
+        "Bursts Stripe calls at a local stand-in through the rate limiter and circuit "
+        "breaker: first a healthy Stripe, then one that answers slowly with errors, "
+        "and reports throughput, throttling and how fast callers fail."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--latency', type=float, default=0.5,
+                            help="Seconds the degraded stand-in takes per response.")
+
+    def handle(self, *args, **options):
+        with StripeStandIn() as standin:
+            stripe.api_base = standin.url
+            client = stripe.default_http_client
+            self.stdout.write(
+                f"limit {settings.STRIPE_RATE_LIMIT}/s (burst {settings.STRIPE_RATE_LIMIT_BURST}), "
+                f"breaker opens after {settings.STRIPE_BREAKER_FAILURE_THRESHOLD} failures"
+            )
+            self.stdout.write(
+                f"{'phase':<10}{'calls':>7}{'ok':>6}{'failed':>8}{'fast-fail':>11}"
+                f"{'stripe hits':>13}{'calls/s':>9}{'p95 ms':>9}{'breaker':>11}"
+            )
+
+            self.run_phase('healthy', standin, client, options)
+
+            standin.latency = options['latency']
+            standin.error_rate = 1.0
+            self.run_phase('degraded', standin, client, options)
+
+    def run_phase(self, name, standin, client, options):
+        standin.reset()
+
+        def call(_):
+            start = time.perf_counter()
+            try:
+                stripe.Customer.retrieve('cus_bench')
+                outcome = 'ok'
+            except StripeUnavailable:
+                outcome = 'fast-fail'
+            except stripe.error.StripeError:
+                outcome = 'failed'
+            return outcome, (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(call, range(options['calls'])))
+        elapsed = time.perf_counter() - start
+
+        outcomes = [outcome for outcome, _ in results]
+        timings = sorted(ms for _, ms in results)
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f"{name:<10}{len(results):>7}{outcomes.count('ok'):>6}{outcomes.count('failed'):>8}"
+            f"{outcomes.count('fast-fail'):>11}{len(standin.calls):>13}{len(results) / elapsed:>9.1f}"
+            f"{p95:>9.0f}{client.breaker.state:>11}"
+        )
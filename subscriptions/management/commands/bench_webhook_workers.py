@@ -0,0 +1,140 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from subscriptions.models import StripePlan, StripeWebhookEvent, UserSubscription
+from subscriptions.stripe_client import stripe
+from subscriptions.stripe_guard import install
+from subscriptions.stripe_standin import StripeStandIn
+from subscriptions.webhook_queue import WebhookWorker, enqueue
+
+
+class Command(BaseCommand):
+    help = (
+        "Queues payment-method webhook events (three Stripe calls each) for many customers "
+        "against a local Stripe stand-in and drains them with 1, 2, 4, ... partitioned "
+        "workers, reporting throughput per worker count and checking that every "
+        "customer's events were applied in order. Run it against PostgreSQL; SQLite "
+        "serializes the workers' writes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=64)
+        parser.add_argument('--events-per-customer', type=int, default=4)
+        parser.add_argument('--workers', default='1,2,4,8',
+                            help="Comma-separated worker counts to compare.")
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="Seconds the stand-in takes per Stripe call.")
+        parser.add_argument('--rate-limit', type=float, default=10000,
+                            help="Stripe calls/s allowed during the benchmark, so the limiter does not cap it.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(
+                f"Running on {connection.vendor}: writes are serialized, scaling is understated."
+            ))
+        worker_counts = [int(count) for count in options['workers'].split(',')]
+
+        plan = StripePlan.objects.create(
+            name='bench', stripe_price_id=f"price_bench_{time.time_ns()}", price=1, monthly_credit_allotment=100,
+        )
+        now = timezone.now()
+        users = []
+        for index in range(options['customers']):
+            user = User.objects.create_user(f"webhook-bench-{time.time_ns()}-{index}")
+            UserSubscription.objects.create(
+                user=user, plan=plan, stripe_customer_id=f"cus_bench{index}",
+                stripe_subscription_id=f"sub_bench{index}", status='active', is_active=True,
+                current_period_start=now, current_period_end=now + timedelta(days=30),
+            )
+            users.append(user)
+
+        rate = options['rate_limit']
+        try:
+            with StripeStandIn(latency=options['latency']) as standin, \
+                    override_settings(STRIPE_RATE_LIMIT=rate, STRIPE_RATE_LIMIT_BURST=rate):
+                stripe.api_base = standin.url
+                install(stripe)
+                self.stdout.write(f"{'workers':>8}{'events':>8}{'seconds':>9}{'events/s':>10}{'speedup':>9}{'stripe calls':>14}")
+                baseline = None
+                for workers in worker_counts:
+                    standin.reset()
+                    rate_per_second, elapsed, total = self.run_round(users, workers, options)
+                    baseline = baseline or rate_per_second
+                    self.stdout.write(
+                        f"{workers:>8}{total:>8}{elapsed:>9.2f}{rate_per_second:>10.1f}"
+                        f"{rate_per_second / baseline:>8.2f}x{len(standin.calls):>14}"
+                    )
+        finally:
+            install(stripe)
+            StripeWebhookEvent.objects.filter(stripe_event_id__startswith='evt_bench_').delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            plan.delete()
+
+    def run_round(self, users, workers, options):
+        StripeWebhookEvent.objects.filter(stripe_event_id__startswith='evt_bench_').delete()
+        created = int(time.time())
+        for sequence in range(options['events_per_customer']):
+            for index, user in enumerate(users):
+                enqueue(self.setup_completed_event(f"evt_bench_{workers}_{index}_{sequence}", created + sequence, user, index))
+        queued = StripeWebhookEvent.objects.filter(stripe_event_id__startswith='evt_bench_')
+        total = queued.count()
+
+        errors = []
+
+        def run(index):
+            worker = WebhookWorker(f"bench-{workers}-{index}")
+            try:
+                while queued.filter(status=StripeWebhookEvent.PENDING).exists():
+                    if not worker.run_once():
+                        time.sleep(0.01)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if errors:
+            raise CommandError(f"Worker failed: {errors[0]!r}")
+        self.check_order(queued)
+        return total / elapsed, elapsed, total
+
+    def check_order(self, queued):
+        failed = queued.exclude(status=StripeWebhookEvent.PROCESSED).count()
+        if failed:
+            raise CommandError(f"{failed} events were not processed.")
+        last_seen = {}
+        for ordering_key, created, processed_at in queued.order_by('processed_at', 'id').values_list(
+                'ordering_key', 'created', 'processed_at'):
+            if created < last_seen.get(ordering_key, created):
+                raise CommandError(f"Events for {ordering_key} were applied out of order.")
+            last_seen[ordering_key] = created
+
+    def setup_completed_event(self, event_id, created, user, index):
+        return {
+            'id': event_id,
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'created': created,
+            'data': {'object': {
+                'id': f"cs_{event_id}",
+                'object': 'checkout.session',
+                'mode': 'setup',
+                'customer': f"cus_bench{index}",
+                'setup_intent': f"seti_{event_id}",
+                'metadata': {'user_id': str(user.pk)},
+            }},
+        }
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from subscriptions.models import StripeOutboxEntry
+from subscriptions.outbox import dispatch_due
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends pending pause/resume/cancel changes from the outbox to Stripe, "
+        "retrying failed attempts with backoff. Run with --loop as a worker process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running and poll for due entries.")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds between polls when nothing was due.")
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        while True:
+            sent = dispatch_due(limit=options['batch_size'])
+            if sent or options['verbosity'] > 1:
+                pending = StripeOutboxEntry.objects.filter(status=StripeOutboxEntry.PENDING).count()
+                self.stdout.write(f"Sent {sent} outbox entries, {pending} pending.")
+            if not options['loop']:
+                return
+            close_old_connections()
+            if sent < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from subscriptions import exports
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes all invoices or subscriptions as CSV or JSON Lines, streaming rows "
+        "from a server-side cursor so memory stays flat for any table size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--start', help="First created_at date to include, e.g. 2025-01-01.")
+        parser.add_argument('--end', help="Last created_at date to include.")
+        parser.add_argument('--status')
+        parser.add_argument('--plan', help="Plan id or Stripe price id.")
+        parser.add_argument('--output', '-o', help="File to write; standard output by default.")
+
+    def handle(self, *args, **options):
+        try:
+            filters = exports.parse_filters(options['start'], options['end'], options['status'], options['plan'])
+        except exports.ExportFilterError as e:
+            raise CommandError(str(e))
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            for chunk in exports.stream(options['kind'], options['format'], **filters):
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,62 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from subscriptions import metrics, usage
+from subscriptions.models import UsageBucket, UsageReport
+
+
+class Command(BaseCommand):
+    help = (
+        "Sums credit usage of closed windows per Stripe customer and sends it to the "
+        "STRIPE_USAGE_METER_EVENT meter, retrying failed reports with backoff. "
+        "Without a meter it only prunes old usage. Run with --loop as a worker process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running and export usage as windows close.")
+        parser.add_argument('--interval', type=float, default=10.0,
+                            help="Seconds between passes when nothing was due.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Usage buckets closed per transaction.")
+        parser.add_argument('--keep-days', type=int, default=35,
+                            help="Delete reported buckets and sent reports older than this. "
+                                 "Stripe does not accept meter events older than 35 days.")
+
+    def handle(self, *args, **options):
+        reporting = bool(settings.STRIPE_USAGE_METER_EVENT)
+        if not reporting:
+            self.stderr.write(self.style.WARNING(
+                "STRIPE_USAGE_METER_EVENT is not set: usage is not reported to Stripe, only pruned."))
+
+        while True:
+            closed = sent = 0
+            if reporting:
+                closed = usage.close_windows(limit=options['batch_size'])
+                sent = usage.send_due()
+                lag = usage.unreported_lag()
+                metrics.gauge('stripe.usage.lag_seconds', round(lag))
+                if closed or sent or options['verbosity'] > 1:
+                    self.stdout.write(
+                        f"Created {closed} usage reports, sent {sent}; oldest unreported usage {lag:.0f}s old.")
+            self.prune(options['keep_days'], reporting)
+            if not options['loop']:
+                return
+            close_old_connections()
+            if closed < options['batch_size'] and not sent:
+                time.sleep(options['interval'])
+
+    def prune(self, keep_days, reporting=True):
+        cutoff = timezone.now() - timedelta(days=keep_days)
+        # Buckets of subscriptions without a Stripe customer are never reported.
+        done = Q(reported_quantity=F('quantity')) | Q(user_subscription__stripe_customer_id='')
+        if not reporting:
+            done = Q()
+        UsageBucket.objects.filter(done, window_start__lt=cutoff, summarized_quantity=F('quantity')).delete()
+        UsageReport.objects.filter(status=UsageReport.SENT, sent_at__lt=cutoff).delete()
@@ -0,0 +1,143 @@
+import hashlib
+import hmac
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Starts gunicorn once per worker model (sync, gthread, asgi) using gunicorn.conf.py "
+        "and load-tests the dashboard and webhook endpoints against each of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', nargs='+', default=['sync', 'gthread', 'asgi'])
+        parser.add_argument('--requests', type=int, default=500,
+                            help="Requests per endpoint and worker model.")
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Override WEB_CONCURRENCY for every model.")
+        parser.add_argument('--session-cookie', default=None,
+                            help="sessionid of a logged-in user, so the dashboard renders instead of redirecting.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'model':<10}{'endpoint':<12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}"
+        )
+        for model in options['models']:
+            port = self.free_port()
+            server = self.start_server(model, port, options['workers'])
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                endpoints = {
+                    'dashboard': lambda: self.dashboard_request(base_url, options['session_cookie']),
+                    'webhook': lambda: self.webhook_request(base_url),
+                }
+                for name, send in endpoints.items():
+                    self.report(model, name, *self.run_load(send, options['requests'], options['concurrency']))
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    def free_port(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
+
+    def start_server(self, model, port, workers):
+        env = dict(os.environ, WEB_WORKER_CLASS=model, PORT=str(port))
+        if workers:
+            env['WEB_CONCURRENCY'] = str(workers)
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', str(settings.BASE_DIR / 'gunicorn.conf.py'),
+             '--access-logfile', '/dev/null', '--bind', f"127.0.0.1:{port}"],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise RuntimeError(f"gunicorn ({model}) did not start listening on port {port}")
+
+    def dashboard_request(self, base_url, session_cookie):
+        request = urllib.request.Request(f"{base_url}/")
+        if session_cookie:
+            request.add_header('Cookie', f"{settings.SESSION_COOKIE_NAME}={session_cookie}")
+        return self.send(request)
+
+    def webhook_request(self, base_url):
+        # A correctly signed event for an unknown subscription: exercises signature
+        # verification and one lookup without touching any real data.
+        payload = json.dumps({
+            'id': 'evt_loadtest',
+            'object': 'event',
+            'type': 'customer.subscription.updated',
+            'data': {'object': {'id': 'sub_loadtest', 'customer': 'cus_loadtest'}},
+        }).encode()
+        timestamp = int(time.time())
+        signature = hmac.new(
+            settings.STRIPE_WEBHOOK_SECRET.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256
+        ).hexdigest()
+        request = urllib.request.Request(f"{base_url}/webhook/", data=payload, method='POST')
+        request.add_header('Content-Type', 'application/json')
+        request.add_header('Stripe-Signature', f"t={timestamp},v1={signature}")
+        return self.send(request)
+
+    def send(self, request):
+        """
+        Returns True when the server answered without a 5xx. Redirects are not followed.
+        """
+        opener = urllib.request.build_opener(NoRedirect)
+        try:
+            with opener.open(request, timeout=60) as response:
+                response.read()
+                return True
+        except urllib.error.HTTPError as e:
+            return e.code < 500
+        except OSError:
+            return False
+
+    def run_load(self, send, requests, concurrency):
+        def timed(_):
+            start = time.perf_counter()
+            ok = send()
+            return (time.perf_counter() - start) * 1000, ok
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(timed, range(concurrency)))  # Warm up every worker.
+            start = time.perf_counter()
+            results = list(pool.map(timed, range(requests)))
+            elapsed = time.perf_counter() - start
+
+        timings = sorted(t for t, _ in results)
+        errors = sum(1 for _, ok in results if not ok)
+        return requests / elapsed, timings, errors
+
+    def report(self, model, endpoint, throughput, timings, errors):
+        self.stdout.write(
+            f"{model:<10}{endpoint:<12}"
+            f"{throughput:>10.1f}"
+            f"{statistics.median(timings):>10.1f}"
+            f"{timings[int(len(timings) * 0.95)]:>10.1f}"
+            f"{errors:>8}"
+        )
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
@@ -0,0 +1,50 @@
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from subscriptions.models import StripeWebhookEvent
+from subscriptions.webhook_queue import WebhookWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Applies queued Stripe webhook events. Any number of these workers can run "
+        "on any number of nodes: each leases free partitions, so one customer's "
+        "events are applied in order while different customers run in parallel. "
+        "Run with --loop as a worker process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running and poll for due events.")
+        parser.add_argument('--interval', type=float, default=0.5,
+                            help="Seconds between polls when nothing was due.")
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Events processed per partition lease.")
+        parser.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}",
+                            help="Lease owner name; must be unique among running workers.")
+        parser.add_argument('--keep-days', type=int, default=30,
+                            help="Delete handled events older than this. Stripe lists events of the "
+                                 "last 30 days, so replay_webhooks only re-applies pruned events older than that.")
+
+    def handle(self, *args, **options):
+        worker = WebhookWorker(options['worker_id'], batch_size=options['batch_size'])
+        while True:
+            handled = worker.run_once()
+            if handled or options['verbosity'] > 1:
+                self.stdout.write(f"Handled {handled} webhook events.")
+            self.prune(options['keep_days'])
+            if not options['loop']:
+                return
+            close_old_connections()
+            if not handled:
+                time.sleep(options['interval'])
+
+    def prune(self, keep_days):
+        StripeWebhookEvent.objects.exclude(status=StripeWebhookEvent.PENDING).filter(
+            processed_at__lt=timezone.now() - timedelta(days=keep_days)).delete()
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from subscriptions import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        "Prints a token that makes requests carrying it in an X-Profile header get "
+        "profiled (see subscriptions/profiling.py). Tokens are signed with SECRET_KEY "
+        "and expire after PROFILE_TOKEN_MAX_AGE seconds."
+    )
+
+    def handle(self, *args, **options):
+        token = profiling.make_token()
+        self.stdout.write(token)
+        if options['verbosity'] > 1:
+            self.stdout.write(
+                f"Valid for {settings.PROFILE_TOKEN_MAX_AGE}s. Example:\n"
+                f"  curl -H 'X-Profile: {token}' -i https://<host>/\n"
+                f"Reports are written to {settings.PROFILE_DIR}; the response's "
+                f"X-Profile-Report header names them."
+            )
@@ -0,0 +1,30 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from subscriptions.customers import get_stripe_customer_id
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfills StripeCustomer for users that signed up before customers were "
+        "provisioned at signup, adopting existing subscription customers where possible."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Provision at most this many users.")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(stripecustomer__isnull=True).order_by('pk')
+        if options['limit']:
+            users = users[:options['limit']]
+
+        provisioned = failed = 0
+        for user in users.iterator(chunk_size=500):
+            try:
+                get_stripe_customer_id(user)
+                provisioned += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"User {user.pk}: {e}")
+        self.stdout.write(f"Provisioned {provisioned} Stripe customers, {failed} failed.")
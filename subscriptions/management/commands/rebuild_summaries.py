@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from subscriptions import summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the daily plan summaries from invoices, subscriptions and credit "
+        "usage, for backfills. Stop the webhook workers and update_summaries first."
+    )
+
+    def handle(self, *args, **options):
+        written = summaries.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} daily plan summary rows."))
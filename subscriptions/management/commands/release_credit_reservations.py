@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from subscriptions import reservations
+from subscriptions.models import CreditReservation
+
+
+class Command(BaseCommand):
+    help = (
+        "Returns the credits of reservations that were neither committed nor released "
+        "before they expired. Run with --loop as a worker process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running and release reservations as they expire.")
+        parser.add_argument('--interval', type=float, default=10.0,
+                            help="Seconds between passes when nothing had expired.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Reservations expired per transaction.")
+        parser.add_argument('--keep-days', type=int, default=30,
+                            help="Delete settled reservations older than this.")
+
+    def handle(self, *args, **options):
+        while True:
+            expired = reservations.release_expired(limit=options['batch_size'])
+            if expired or options['verbosity'] > 1:
+                self.stdout.write(f"Released {expired} expired credit reservations.")
+            self.prune(options['keep_days'])
+            if not options['loop']:
+                return
+            close_old_connections()
+            if expired < options['batch_size']:
+                time.sleep(options['interval'])
+
+    def prune(self, keep_days):
+        CreditReservation.objects.exclude(status=CreditReservation.HELD).filter(
+            settled_at__lt=timezone.now() - timedelta(days=keep_days)).delete()
@@ -0,0 +1,192 @@
+import fnmatch
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from subscriptions.models import StripeWebhookEvent
+from subscriptions.stripe_client import stripe
+from subscriptions.webhook_queue import WebhookWorker, enqueue_many
+
+REPLAY_HOLD = timedelta(hours=1)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays Stripe events after an outage, from Stripe's events list (the last "
+        "30 days) or from a JSON Lines archive. Events are queued like webhook "
+        "deliveries, skipping event ids already stored, and applied by parallel "
+        "webhook workers through the same handlers, in order per customer. Events "
+        "still waiting for a retry at the end are left to the process_webhooks workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Replay events created at or after this time (ISO 8601 or Unix time).")
+        parser.add_argument('--until', help="Replay events created at or before this time.")
+        parser.add_argument('--type', action='append', dest='types', default=[],
+                            help="Only events of this type (repeatable, wildcards like invoice.* allowed).")
+        parser.add_argument('--undelivered', action='store_true',
+                            help="Only events Stripe could not deliver to a webhook endpoint.")
+        parser.add_argument('--archive',
+                            help="Read events from this JSON Lines file ('-' for stdin) instead of Stripe.")
+        parser.add_argument('--workers', type=int, default=8,
+                            help="Webhook workers applying the replayed events in parallel.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Events stored per insert.")
+        parser.add_argument('--queue-only', action='store_true',
+                            help="Only queue the events and leave them to the running process_webhooks workers.")
+        parser.add_argument('--progress-interval', type=float, default=5,
+                            help="Seconds between progress lines.")
+
+    def handle(self, *args, **options):
+        if not (options['archive'] or options['since']):
+            raise CommandError("Pass --since to replay from Stripe, or --archive.")
+        if options['archive'] and options['undelivered']:
+            raise CommandError("--undelivered needs Stripe's delivery records; it cannot filter an --archive.")
+        since, until = self.parse_time(options['since']), self.parse_time(options['until'])
+        self.started = timezone.now()
+        self.start = time.perf_counter()
+
+        # Stripe lists newest events first, so events are held until all of them
+        # are stored: no worker, including running process_webhooks workers, may
+        # apply a customer's newer event before the older ones arrive. Should
+        # the replay die, they are released after the hold anyway.
+        hold = self.started + REPLAY_HOLD
+        read = queued = 0
+        events = self.from_archive(options['archive']) if options['archive'] else self.from_stripe(since, until, options)
+        events = (
+            event for event in events
+            if self.in_range(event, since, until) and self.is_wanted_type(event, options['types'])
+        )
+        last_report = time.perf_counter()
+        while batch := list(islice(events, options['batch_size'])):
+            read += len(batch)
+            queued += enqueue_many(batch, available_at=hold)
+            if time.perf_counter() - last_report >= options['progress_interval']:
+                self.stdout.write(f"Read {read} events, queued {queued}")
+                last_report = time.perf_counter()
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(
+            f"Read {read} events in {elapsed:.1f}s ({read / max(elapsed, 1e-6):.0f} events/s): "
+            f"queued {queued}, skipped {read - queued} already stored."
+        )
+
+        self.replayed().filter(status=StripeWebhookEvent.PENDING, next_attempt_at=hold).update(
+            next_attempt_at=timezone.now())
+        if options['queue_only'] or not queued:
+            return
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING("SQLite serializes the workers' writes; expect lock retries."))
+
+        # The workers stop once nothing received since the start is due any more.
+        self.start = time.perf_counter()
+        workers = self.start_workers(options['workers'])
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(options['progress_interval'])
+                if worker.is_alive():
+                    done = self.replayed().exclude(status=StripeWebhookEvent.PENDING).count()
+                    elapsed = time.perf_counter() - self.start
+                    self.stdout.write(f"Applied {done}/{queued} events ({done / elapsed:.1f} events/s)")
+        self.summarize()
+
+    def parse_time(self, value):
+        if not value:
+            return None
+        if value.isdigit():
+            return int(value)
+        moment = parse_datetime(value)
+        if moment is None:
+            raise CommandError(f"Cannot parse time {value!r}; use ISO 8601 or Unix time.")
+        if timezone.is_naive(moment):
+            moment = moment.replace(tzinfo=dt_timezone.utc)
+        return int(moment.timestamp())
+
+    def in_range(self, event, since, until):
+        return (since is None or event['created'] >= since) and (until is None or event['created'] <= until)
+
+    def is_wanted_type(self, event, types):
+        # Stripe filters its events list the same way; archives are filtered here.
+        return not types or any(fnmatch.fnmatchcase(event['type'], pattern) for pattern in types)
+
+    def from_stripe(self, since, until, options):
+        created = {'gte': since}
+        if until:
+            created['lte'] = until
+        params = {'created': created, 'limit': 100}
+        if options['types']:
+            params['types'] = options['types']
+        if options['undelivered']:
+            params['delivery_success'] = False
+        return stripe.Event.list(**params).auto_paging_iter()
+
+    def from_archive(self, path):
+        archive = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            for number, line in enumerate(archive, 1):
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError as e:
+                    raise CommandError(f"{path}:{number}: not JSON: {e}")
+                if event.get('object') != 'event':
+                    raise CommandError(f"{path}:{number}: not a Stripe event.")
+                yield event
+        finally:
+            if archive is not sys.stdin:
+                archive.close()
+
+    def start_workers(self, count):
+        owner = f"replay-{socket.gethostname()}-{os.getpid()}"
+        threads = [
+            threading.Thread(target=self.run_worker, args=(WebhookWorker(f"{owner}-{index}"),), daemon=True)
+            for index in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run_worker(self, worker):
+        try:
+            while True:
+                if worker.run_once():
+                    continue
+                due = self.replayed().filter(status=StripeWebhookEvent.PENDING, next_attempt_at__lte=timezone.now())
+                if not due.exists():
+                    return
+                time.sleep(0.2)
+        except Exception as e:
+            self.stderr.write(f"Worker {worker.owner} stopped: {e!r}")
+        finally:
+            connection.close()
+
+    def replayed(self):
+        # Includes live deliveries received during the replay.
+        return StripeWebhookEvent.objects.filter(received_at__gte=self.started)
+
+    def summarize(self):
+        elapsed = time.perf_counter() - self.start
+        counts = dict(
+            self.replayed().values('status').order_by().annotate(count=Count('pk')).values_list('status', 'count')
+        )
+        done = sum(count for status, count in counts.items() if status != StripeWebhookEvent.PENDING)
+        self.stdout.write(
+            f"Applied {done} events in {elapsed:.1f}s ({done / elapsed:.1f} events/s): "
+            + ', '.join(f"{counts.get(status, 0)} {status}" for status, _ in StripeWebhookEvent.STATUS_CHOICES)
+        )
+        if counts.get(StripeWebhookEvent.PENDING):
+            self.stdout.write("Pending events are waiting for a retry by the process_webhooks workers.")
+        if counts.get(StripeWebhookEvent.FAILED):
+            self.stdout.write(self.style.WARNING(
+                "Failed events can be retried from the admin once the cause is fixed."))
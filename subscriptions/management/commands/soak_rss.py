@@ -0,0 +1,91 @@
+import io
+import os
+import resource
+import sys
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+def current_rss_mb():
+    """
+    Resident set size of this process. /proc gives the current value on Linux;
+    elsewhere fall back to the peak, which is still flat when memory is.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends many requests through the full middleware stack in this process and "
+        "samples RSS, to show whether a long-lived worker's memory stays flat. "
+        "Run it with DJANGO_ENV=production to check the production profile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100_000)
+        parser.add_argument('--path', action='append',
+                            help="Path to request (repeatable, requests rotate). Defaults to /login/.")
+        parser.add_argument('--session-cookie', default=None,
+                            help="sessionid of a logged-in user, to soak authenticated pages.")
+        parser.add_argument('--samples', type=int, default=20,
+                            help="Number of RSS samples taken over the run.")
+        parser.add_argument('--warmup', type=int, default=1000,
+                            help="Requests sent before the baseline sample (template and URL caches fill up).")
+        parser.add_argument('--max-growth-mb', type=float, default=5.0,
+                            help="Fail when RSS grows more than this after warm-up.")
+
+    def handle(self, *args, **options):
+        paths = options['path'] or ['/login/']
+        cookie = f"{settings.SESSION_COOKIE_NAME}={options['session_cookie']}" if options['session_cookie'] else ''
+        # The real WSGI handler, as gunicorn calls it; django.test.Client reconnects
+        # signal receivers on every request and would show up as a leak of its own.
+        handler = WSGIHandler()
+
+        self.stdout.write(f"DEBUG={settings.DEBUG}, paths={paths}")
+
+        def send(count, offset=0):
+            for i in range(count):
+                environ = {
+                    'REQUEST_METHOD': 'GET',
+                    'PATH_INFO': paths[(offset + i) % len(paths)],
+                    'QUERY_STRING': '',
+                    'SCRIPT_NAME': '',
+                    'SERVER_NAME': 'localhost',
+                    'SERVER_PORT': '80',
+                    'HTTP_HOST': 'localhost',
+                    'HTTP_COOKIE': cookie,
+                    'wsgi.url_scheme': 'http',
+                    'wsgi.input': io.BytesIO(),
+                    'wsgi.errors': sys.stderr,
+                }
+                response = handler(environ, lambda status, headers: None)
+                b''.join(response)
+                response.close()
+
+        send(options['warmup'])
+        baseline = current_rss_mb()
+        self.stdout.write(f"{'requests':>10}{'rss MB':>10}{'growth MB':>12}{'queries kept':>14}")
+        self.stdout.write(f"{0:>10}{baseline:>10.1f}{0:>12.1f}{len(connection.queries_log):>14}")
+
+        step = max(1, options['requests'] // options['samples'])
+        sent = 0
+        while sent < options['requests']:
+            batch = min(step, options['requests'] - sent)
+            send(batch, offset=sent)
+            sent += batch
+            rss = current_rss_mb()
+            self.stdout.write(
+                f"{sent:>10}{rss:>10.1f}{rss - baseline:>12.1f}{len(connection.queries_log):>14}"
+            )
+
+        growth = current_rss_mb() - baseline
+        if growth > options['max_growth_mb']:
+            raise CommandError(f"RSS grew by {growth:.1f} MB over {sent} requests.")
+        self.stdout.write(self.style.SUCCESS(f"RSS stayed flat: {growth:+.1f} MB over {sent} requests."))
@@ -0,0 +1,155 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from subscriptions.locking import debit_credits, refill_if_due
+from subscriptions.models import StripePlan, UserSubscription
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammers one subscription row from many threads with credit debits, webhook-style "
+        "locked saves and racing monthly refills, then checks that no update was lost, "
+        "credits never went negative, a period was refilled only once and nothing deadlocked. "
+        "Run it against PostgreSQL; SQLite serializes all writers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--ops', type=int, default=50,
+                            help="Operations per thread.")
+        parser.add_argument('--timeout', type=float, default=60,
+                            help="Seconds after which a thread still running counts as hung.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING(
+                f"Running on {connection.vendor}: row locks are not exercised, results only show the bookkeeping."
+            ))
+
+        plan = StripePlan.objects.create(
+            name='stress', stripe_price_id=f"price_stress_{time.time_ns()}", price=1, monthly_credit_allotment=100,
+        )
+        user = User.objects.create_user(f"stress-{time.time_ns()}")
+        now = timezone.now()
+        user_sub = UserSubscription.objects.create(
+            user=user, plan=plan, stripe_customer_id='cus_stress', stripe_subscription_id='sub_stress',
+            current_period_start=now, current_period_end=now + timedelta(days=30), status='active',
+        )
+        try:
+            failures = self.debits_against_webhooks(user_sub, options) + self.racing_refills(user_sub, options)
+        finally:
+            user.delete()
+            plan.delete()
+
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("No lost updates, no overdraft, no double refill, no deadlocks."))
+
+    def run_threads(self, count, target, timeout):
+        barrier = threading.Barrier(count)
+        errors = []
+
+        def run(index):
+            try:
+                barrier.wait()
+                target(index)
+            except DatabaseError as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in range(count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(max(0.0, timeout - (time.perf_counter() - start)))
+        hung = sum(thread.is_alive() for thread in threads)
+        return errors, hung, time.perf_counter() - start
+
+    def debits_against_webhooks(self, user_sub, options):
+        threads, ops = options['threads'], options['ops']
+        debit_threads = max(1, threads // 2)
+        # Demand exceeds supply, so the last debits must be refused rather than overdraw.
+        initial = debit_threads * ops // 2
+        UserSubscription.objects.filter(pk=user_sub.pk).update(credits=initial, is_active=True)
+
+        debited = []
+        webhook_writes = []
+        lock = threading.Lock()
+
+        def work(index):
+            if index < debit_threads:
+                sub = UserSubscription.objects.get(pk=user_sub.pk)
+                count = sum(debit_credits(sub, 1) for _ in range(ops))
+                with lock:
+                    debited.append(count)
+            else:
+                # What the webhook handlers do: lock the row, change several fields, full save().
+                for i in range(ops):
+                    with transaction.atomic():
+                        sub = UserSubscription.objects.select_for_update().get(pk=user_sub.pk)
+                        sub.status = 'active'
+                        sub.current_period_end = timezone.now() + timedelta(days=30, seconds=i)
+                        sub.save()
+                    with lock:
+                        webhook_writes.append(i)
+
+        errors, hung, elapsed = self.run_threads(threads, work, options['timeout'])
+        final = UserSubscription.objects.get(pk=user_sub.pk)
+        total = sum(debited)
+        self.stdout.write(
+            f"debits vs webhooks: {threads} threads, {total} debits and {len(webhook_writes)} webhook saves "
+            f"in {elapsed:.2f}s; credits {initial} -> {final.credits}"
+        )
+
+        failures = self.common_failures('debits vs webhooks', errors, hung)
+        if final.credits != initial - total:
+            failures.append(f"lost update: expected {initial - total} credits, found {final.credits}")
+        if final.credits < 0 or total > initial:
+            failures.append(f"overdraft: {total} debits from {initial} credits")
+        return failures
+
+    def racing_refills(self, user_sub, options):
+        threads = options['threads']
+        now = timezone.now()
+        UserSubscription.objects.filter(pk=user_sub.pk).update(
+            credits=0, is_active=True, current_period_end=now + timedelta(days=30),
+            last_credit_refill_date=now - timedelta(days=31),
+        )
+        refills = []
+        lock = threading.Lock()
+
+        def work(index):
+            sub = UserSubscription.objects.select_related('plan').get(pk=user_sub.pk)
+            if refill_if_due(sub):
+                with lock:
+                    refills.append(index)
+
+        errors, hung, elapsed = self.run_threads(threads, work, options['timeout'])
+        final = UserSubscription.objects.get(pk=user_sub.pk)
+        self.stdout.write(
+            f"racing refills: {threads} threads, {len(refills)} refill applied in {elapsed:.2f}s; credits {final.credits}"
+        )
+
+        failures = self.common_failures('racing refills', errors, hung)
+        if len(refills) != 1:
+            failures.append(f"period refilled {len(refills)} times")
+        return failures
+
+    def common_failures(self, phase, errors, hung):
+        failures = []
+        deadlocks = [e for e in errors if 'deadlock' in str(e).lower()]
+        if deadlocks:
+            failures.append(f"{phase}: {len(deadlocks)} deadlocks")
+        if len(errors) > len(deadlocks):
+            failures.append(f"{phase}: {len(errors) - len(deadlocks)} database errors, first: {errors[0]}")
+        if hung:
+            failures.append(f"{phase}: {hung} threads still waiting after the timeout")
+        return failures
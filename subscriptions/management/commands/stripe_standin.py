@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from subscriptions.stripe_standin import StripeStandIn
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a local Stripe stand-in. Point the app at it with "
+        "STRIPE_API_BASE=http://127.0.0.1:<port> to load test without reaching Stripe."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help="Seconds added to every response.")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Fraction of requests answered with a 500.")
+
+    def handle(self, *args, **options):
+        standin = StripeStandIn(port=options['port'], latency=options['latency'], error_rate=options['error_rate'])
+        with standin:
+            self.stdout.write(f"Stripe stand-in listening on {standin.url} (Ctrl+C to stop)")
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(f"Served {len(standin.calls)} requests.")
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from subscriptions.locking import REFILL_INTERVAL, expire_if_period_ended, refill_if_due
+from subscriptions.models import UserSubscription
+
+
+class Command(BaseCommand):
+    help = (
+        "Expires subscriptions whose period has ended and refills monthly credits that "
+        "are due, for users who have not visited since. Rows locked by a webhook or "
+        "request are skipped and picked up on the next run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        due = UserSubscription.objects.filter(
+            Q(current_period_end__lt=now) | Q(last_credit_refill_date__lte=now - REFILL_INTERVAL),
+            is_active=True,
+            plan__plan_type__in=('monthly', 'yearly'),
+        ).order_by('pk')
+
+        expired = refilled = skipped = 0
+        last_pk = 0
+        while True:
+            pks = list(due.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            last_pk = pks[-1]
+            with transaction.atomic():
+                batch = list(
+                    UserSubscription.objects.select_for_update(skip_locked=True, of=('self',))
+                    .select_related('plan').filter(pk__in=pks)
+                )
+                skipped += len(pks) - len(batch)
+                for user_sub in batch:
+                    if expire_if_period_ended(user_sub):
+                        expired += 1
+                    elif refill_if_due(user_sub):
+                        refilled += 1
+
+        self.stdout.write(f"Expired {expired}, refilled {refilled}, skipped {skipped} locked subscriptions.")
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from subscriptions import catalog
+from subscriptions.models import StripePlan
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates or updates a StripePlan for every monthly, yearly and one-time price "
+        "in Stripe, in bulk. The price.* and product.* webhooks keep the plans current "
+        "afterwards. Monthly credits come from a `credits` metadata entry on the price "
+        "or its product."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--active-only', action='store_true',
+                            help="Skip archived prices; plans for them are left as they are.")
+        parser.add_argument('--deactivate-missing', action='store_true',
+                            help="Stop offering plans whose price was not returned by Stripe.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Plans written per statement.")
+
+    def handle(self, *args, **options):
+        params = {'active': True} if options['active_only'] else {}
+        seen = []
+
+        def prices():
+            for price in catalog.fetch_prices(**params):
+                seen.append(price['id'])
+                yield price
+
+        synced, skipped = catalog.sync_prices(prices(), batch_size=options['batch_size'])
+        deactivated = 0
+        if options['deactivate_missing']:
+            missing = StripePlan.objects.exclude(stripe_price_id__in=seen).values_list('pk', flat=True)
+            deactivated = catalog.deactivate_plans(pk__in=list(missing))
+
+        self.stdout.write(
+            f"Synced {synced} plans from {len(seen)} Stripe prices; skipped {skipped} that are "
+            f"tiered, metered or billed other than monthly or yearly."
+            + (f" Deactivated {deactivated} plans missing from Stripe." if options['deactivate_missing'] else "")
+        )
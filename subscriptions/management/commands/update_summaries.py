@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from subscriptions import summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds recorded invoice and subscription changes, and new credit usage, to the "
+        "daily plan summaries. Run with --loop as a worker process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running and fold changes as they are recorded.")
+        parser.add_argument('--interval', type=float, default=30.0,
+                            help="Seconds between passes when nothing was recorded.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        while True:
+            folded = summaries.fold(limit=options['batch_size'])
+            if folded or options['verbosity'] > 1:
+                self.stdout.write(f"Folded {folded} changes into the daily summaries.")
+            if not options['loop']:
+                return
+            close_old_connections()
+            if folded < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,71 @@
+# subscriptions/metrics.py
+
+import socket
+import time
+
+from django.conf import settings
+
+RESOLVE_RETRY = 60  # Seconds before an unresolvable STATSD_HOST is looked up again
+
+_socket = None
+_address = None
+_resolve_failed_at = None
+
+
+def statsd_address(value, default_port):
+    """
+    Splits STATSD_HOST, given as host[:port] like gunicorn.conf.py accepts it.
+    """
+    if ':' in value:
+        host, port = value.rsplit(':', 1)
+        return host, int(port)
+    return value, default_port
+
+
+def _connect():
+    """
+    Resolves the collector once and opens a socket of the matching family.
+    A failed lookup is retried after RESOLVE_RETRY seconds, not on every send.
+    """
+    global _socket, _address, _resolve_failed_at
+    if _resolve_failed_at is not None and time.monotonic() - _resolve_failed_at < RESOLVE_RETRY:
+        return False
+    host, port = statsd_address(settings.STATSD_HOST, settings.STATSD_PORT)
+    try:
+        family, _, _, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+    except (OSError, UnicodeError):
+        _resolve_failed_at = time.monotonic()
+        return False
+    _socket = socket.socket(family, socket.SOCK_DGRAM)
+    _socket.setblocking(False)
+    _address = address
+    _resolve_failed_at = None
+    return True
+
+
+def _send(stat, value, kind):
+    """
+    Sends one StatsD datagram. UDP is fire-and-forget, so a missing or slow
+    collector never adds latency to the request path. No-op when STATSD_HOST is unset.
+    """
+    if not settings.STATSD_HOST:
+        return
+    if _address is None and not _connect():
+        return
+    payload = f"{settings.STATSD_PREFIX}.{stat}:{value}|{kind}".encode()
+    try:
+        _socket.sendto(payload, _address)
+    except OSError:
+        pass
+
+
+def incr(stat, count=1):
+    _send(stat, count, 'c')
+
+
+def gauge(stat, value):
+    _send(stat, value, 'g')
+
+
+def timing(stat, milliseconds):
+    _send(stat, f"{milliseconds:.3f}", 'ms')
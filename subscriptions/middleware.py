@@ -1,7 +1,10 @@
 # subscriptions/middleware.py
 
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
+from . import db_router, profiling
 from .models import UserSubscription, StripePlan
 from .utils import (
     handle_subscription_period_end,
@@ -29,6 +32,9 @@ class CreditRefillMiddleware:
                 # or rely on your post_save signal for User→lifetime-plan.
                 sub = None
 
+            # Views reuse this instead of querying the subscription a second time.
+            request.user_subscription = sub
+
             if sub and sub.plan.plan_type in ('monthly', 'yearly'):
                 # 1) Expire & cleanup if period ended:
                 handle_subscription_period_end(sub)
@@ -52,3 +58,60 @@ class CreditRefillMiddleware:
 
         response = self.get_response(request)
         return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests that carry a valid X-Profile token, and a random
+    PROFILE_SAMPLE_RATE share of the rest (see subscriptions/profiling.py).
+    The response names the report in X-Profile-Report. Comes first, so the
+    profile covers every other middleware. The response body of streaming
+    views is produced after the profile ends.
+    """
+
+    HEADER = 'HTTP_X_PROFILE'
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = request.META.get(self.HEADER)
+        if not ((token and profiling.valid_token(token)) or profiling.sampled()):
+            return self.get_response(request)
+
+        with profiling.profile(f"{request.method} {request.path}") as current:
+            response = self.get_response(request)
+        if current is not None:
+            current.extra['status'] = response.status_code
+            response['X-Profile-Report'] = profiling.write(current)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Keeps reads on the primary for unsafe requests and for a short while after a
+    browser's request wrote to the primary (see subscriptions/db_router.py).
+    Must come before SessionMiddleware so session writes count as writes.
+    """
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+    PIN_COOKIE = 'db_primary'
+
+    def __init__(self, get_response):
+        if not db_router.replica_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = request.method not in self.SAFE_METHODS or self.PIN_COOKIE in request.COOKIES
+        with db_router.request_scope(pinned) as routing:
+            response = self.get_response(request)
+
+        if routing['wrote']:
+            response.set_cookie(
+                self.PIN_COOKIE, '1', max_age=settings.DB_REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax', secure=request.is_secure(),
+            )
+        return response
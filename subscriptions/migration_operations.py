@@ -0,0 +1,26 @@
+# subscriptions/migration_operations.py
+"""
+Migration operations that keep production tables writable while they run.
+
+PostgreSQL builds these indexes with CREATE INDEX CONCURRENTLY, which takes no
+lock that blocks writes but cannot run inside a transaction: migrations using
+them set `atomic = False`. Other databases (SQLite in the tests) get a plain
+CREATE INDEX.
+"""
+
+from django.contrib.postgres.operations import AddIndexConcurrently as PostgresAddIndexConcurrently
+from django.db.migrations.operations import AddIndex
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0005_usersubscription_cancel_at_period_end_stripe'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenCheckoutSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_price_id', models.CharField(help_text='The Stripe Price ID the session subscribes to.', max_length=255)),
+                ('stripe_session_id', models.CharField(help_text='The ID of the Checkout Session in Stripe.', max_length=255, unique=True)),
+                ('old_subscription_id', models.CharField(blank=True, default='', help_text='Subscription the session replaces; a session is only reused while this still matches.', max_length=255)),
+                ('url', models.TextField(help_text='Hosted Checkout page URL.')),
+                ('expires_at', models.DateTimeField(help_text='When Stripe expires the session.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='open_checkout_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'stripe_price_id'), name='unique_open_checkout_session_per_price')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0006_opencheckoutsession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeOutboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_subscription_id', models.CharField(max_length=255)),
+                ('action', models.CharField(choices=[('pause', 'Pause'), ('resume', 'Resume'), ('cancel_at_period_end', 'Cancel at period end')], max_length=30)),
+                ('params', models.JSONField(help_text='Arguments for stripe.Subscription.modify.')),
+                ('revert', models.JSONField(default=dict, help_text='Local fields restored if Stripe rejects the change.')),
+                ('idempotency_key', models.CharField(help_text='Sent with every attempt, so retries never apply the change twice.', max_length=255, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('confirmed', 'Confirmed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('confirmed_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripe_outbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_attempt'), models.Index(fields=['stripe_subscription_id', 'status'], name='outbox_subscription_status')],
+            },
+        ),
+    ]
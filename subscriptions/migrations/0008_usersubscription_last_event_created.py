@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0007_stripeoutboxentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersubscription',
+            name='last_event_created',
+            field=models.DateTimeField(blank=True, help_text='Creation time of the newest Stripe subscription event applied; older events are discarded.', null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0008_usersubscription_last_event_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookPartition',
+            fields=[
+                ('number', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('lease_owner', models.CharField(blank=True, default='', max_length=255)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StripeWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_event_id', models.CharField(max_length=255, unique=True)),
+                ('event_type', models.CharField(max_length=100)),
+                ('ordering_key', models.CharField(help_text='Stripe customer id (or object id): events sharing it apply in order.', max_length=255)),
+                ('object_id', models.CharField(blank=True, default='', max_length=255)),
+                ('partition', models.PositiveSmallIntegerField()),
+                ('created', models.DateTimeField(help_text='When Stripe created the event.')),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('superseded', 'Superseded'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['partition', 'status', 'created', 'id'], name='webhook_partition_queue'), models.Index(fields=['ordering_key', 'status', 'created'], name='webhook_key_status')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0009_stripewebhookevent_webhookpartition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_customer_id', models.CharField(max_length=255)),
+                ('event_name', models.CharField(max_length=100)),
+                ('quantity', models.PositiveIntegerField()),
+                ('timestamp', models.DateTimeField(help_text='End of the last usage window included.')),
+                ('identifier', models.CharField(help_text='Meter event identifier; Stripe drops events it has already seen.', max_length=100, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='usage_report_status_next')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UsageBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateTimeField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('reported_quantity', models.PositiveIntegerField(default=0, help_text='Watermark: how much of quantity is in a UsageReport.')),
+                ('user_subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_buckets', to='subscriptions.usersubscription')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['window_start'], name='usage_bucket_window')],
+                'constraints': [models.UniqueConstraint(fields=('user_subscription', 'window_start'), name='unique_usage_bucket_window')],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+from subscriptions.migration_operations import AddIndexConcurrently
+
+# The admin searches emails with iexact, which PostgreSQL runs as
+# UPPER("email"::text) = UPPER(%s); only an index on that expression serves it.
+EMAIL_INDEX = 'subscriptions_auth_user_email_upper'
+
+
+def create_email_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {EMAIL_INDEX} ON auth_user (UPPER(email::text))')
+
+
+def drop_email_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {EMAIL_INDEX}')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('subscriptions', '0010_usagebucket_usagereport'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='invoice',
+            index=models.Index(fields=['created_at', 'id'], name='invoice_created'),
+        ),
+        AddIndexConcurrently(
+            model_name='invoice',
+            index=models.Index(fields=['user_subscription_id'], name='invoice_subscription'),
+        ),
+        AddIndexConcurrently(
+            model_name='usersubscription',
+            index=models.Index(fields=['stripe_subscription_id'], name='usersub_stripe_subscription'),
+        ),
+        AddIndexConcurrently(
+            model_name='usersubscription',
+            index=models.Index(fields=['stripe_customer_id'], name='usersub_stripe_customer'),
+        ),
+        AddIndexConcurrently(
+            model_name='usersubscription',
+            index=models.Index(fields=['created_at', 'id'], name='usersub_created'),
+        ),
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0011_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagebucket',
+            name='summarized_quantity',
+            field=models.PositiveIntegerField(default=0, help_text='Watermark: how much of quantity is in DailyPlanSummary.'),
+        ),
+        migrations.CreateModel(
+            name='SummaryChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('invoices_paid', models.IntegerField(default=0)),
+                ('invoices_failed', models.IntegerField(default=0)),
+                ('new_subscriptions', models.IntegerField(default=0)),
+                ('churned_subscriptions', models.IntegerField(default=0)),
+                ('active_subscriptions', models.IntegerField(default=0, help_text='Change in active subscriptions.')),
+                ('mrr', models.DecimalField(decimal_places=2, default=0, help_text='Change in MRR.', max_digits=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('plan', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='subscriptions.stripeplan')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyPlanSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text="Successfully paid invoice amounts, in the plan's currency.", max_digits=14)),
+                ('invoices_paid', models.IntegerField(default=0)),
+                ('invoices_failed', models.IntegerField(default=0)),
+                ('new_subscriptions', models.IntegerField(default=0)),
+                ('churned_subscriptions', models.IntegerField(default=0)),
+                ('credits_used', models.BigIntegerField(default=0)),
+                ('active_subscriptions', models.IntegerField(default=0)),
+                ('mrr', models.DecimalField(decimal_places=2, default=0, help_text='Monthly recurring revenue of active, unpaused subscriptions.', max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('plan', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='subscriptions.stripeplan')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily plan summaries',
+                'indexes': [models.Index(fields=['day'], name='daily_summary_day')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('plan__isnull', False)), fields=('plan', 'day'), name='unique_daily_plan_summary'), models.UniqueConstraint(condition=models.Q(('plan__isnull', True)), fields=('day',), name='unique_daily_summary_without_plan')],
+            },
+        ),
+    ]
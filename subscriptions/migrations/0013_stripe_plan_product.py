@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:53
+
+from django.db import migrations, models
+
+# Credits per price that subscriptions/utils.py used to hard-code. Plans without
+# an allotment of their own keep getting them.
+LEGACY_CREDITS = {
+    'price_1RS9OPSEv1tl6ISPdv59qBYR': 50,
+    'price_1RS9PpSEv1tl6ISPgkliHHER': 100,
+    'price_1RS9Q6SEv1tl6ISP6u6RFTWx': 9999,
+}
+
+
+def carry_over_credits(apps, schema_editor):
+    StripePlan = apps.get_model('subscriptions', 'StripePlan')
+    for price_id, credits in LEGACY_CREDITS.items():
+        StripePlan.objects.filter(stripe_price_id=price_id, monthly_credit_allotment=0).update(
+            monthly_credit_allotment=credits)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0012_daily_plan_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripeplan',
+            name='stripe_product_id',
+            field=models.CharField(blank=True, default='', help_text='The Stripe Product the price belongs to; set by the catalog sync.', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='stripeplan',
+            index=models.Index(fields=['stripe_product_id'], name='stripeplan_product'),
+        ),
+        migrations.RunPython(carry_over_credits, migrations.RunPython.noop),
+    ]
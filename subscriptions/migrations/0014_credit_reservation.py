@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0013_stripe_plan_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreditReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField()),
+                ('committed_amount', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('held', 'Held'), ('committed', 'Committed'), ('released', 'Released'), ('expired', 'Expired')], default='held', max_length=20)),
+                ('expires_at', models.DateTimeField(help_text='Held credits return to the balance after this.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('settled_at', models.DateTimeField(blank=True, null=True)),
+                ('user_subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credit_reservations', to='subscriptions.usersubscription')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='reservation_status_expires')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:12
+
+from django.db import migrations, models
+
+from subscriptions.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction.
+    atomic = False
+
+    dependencies = [
+        ('subscriptions', '0014_credit_reservation'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='stripewebhookevent',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at', 'partition'], name='webhook_pending_due'),
+        ),
+        AddIndexConcurrently(
+            model_name='stripewebhookevent',
+            index=models.Index(fields=['processed_at'], name='webhook_processed_at'),
+        ),
+    ]
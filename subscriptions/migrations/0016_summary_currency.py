@@ -0,0 +1,56 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:16
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Lower
+
+
+def use_plan_currency(apps, schema_editor):
+    # Existing rows were kept in the plan's currency, whatever the invoices' were.
+    StripePlan = apps.get_model('subscriptions', 'StripePlan')
+    currency = Subquery(StripePlan.objects.filter(pk=OuterRef('plan_id')).values(lower=Lower('currency'))[:1])
+    for model_name in ('DailyPlanSummary', 'SummaryChange'):
+        model = apps.get_model('subscriptions', model_name)
+        model.objects.filter(plan_id__in=StripePlan.objects.values('pk')).update(currency=currency)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriptions', '0015_webhook_poll_and_prune_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='dailyplansummary',
+            name='unique_daily_plan_summary',
+        ),
+        migrations.RemoveConstraint(
+            model_name='dailyplansummary',
+            name='unique_daily_summary_without_plan',
+        ),
+        migrations.AddField(
+            model_name='dailyplansummary',
+            name='currency',
+            field=models.CharField(default='usd', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='summarychange',
+            name='currency',
+            field=models.CharField(default='usd', help_text="The invoice's currency, or the plan's for subscription changes.", max_length=3),
+        ),
+        migrations.RunPython(use_plan_currency, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='dailyplansummary',
+            name='revenue',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Successfully paid invoice amounts in this currency.', max_digits=14),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyplansummary',
+            constraint=models.UniqueConstraint(condition=models.Q(('plan__isnull', False)), fields=('plan', 'day', 'currency'), name='unique_daily_plan_currency_summary'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyplansummary',
+            constraint=models.UniqueConstraint(condition=models.Q(('plan__isnull', True)), fields=('day', 'currency'), name='unique_daily_currency_summary_without_plan'),
+        ),
+    ]
@@ -1,6 +1,73 @@
 from django.contrib.auth.models import User
 from django.db import models
-import stripe
+from django.utils import timezone
+
+
+class DirtyFieldsMixin(models.Model):
+    """
+    Remembers the column values an instance was loaded with, so save() on an
+    existing row writes only the columns that changed (plus auto_now columns)
+    and skips the query, and the post_save signal, when nothing changed.
+    An explicit update_fields is respected as given.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._snapshot(fields)
+
+    def _snapshot(self, fields=None):
+        loaded = getattr(self, '_loaded_values', {})
+        deferred = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if field.attname in deferred or (fields is not None and field.attname not in fields):
+                continue
+            loaded[field.attname] = getattr(self, field.attname)
+        self._loaded_values = loaded
+
+    def get_dirty_fields(self):
+        """
+        Names of the fields changed since the instance was loaded or last saved.
+        """
+        loaded = getattr(self, '_loaded_values', {})
+        deferred = self.get_deferred_fields()
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname not in deferred
+            and (field.attname not in loaded or getattr(self, field.attname) != loaded[field.attname])
+        ]
+
+    def save(self, *args, **kwargs):
+        tracked = (
+            not self._state.adding
+            and hasattr(self, '_loaded_values')
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+            and not args  # Positional force_insert/force_update/using/update_fields
+        )
+        if tracked:
+            dirty = self.get_dirty_fields()
+            if not dirty:
+                return
+            kwargs['update_fields'] = dirty + [
+                field.name for field in self._meta.concrete_fields
+                if getattr(field, 'auto_now', False) and field.name not in dirty
+            ]
+        super().save(*args, **kwargs)
+        self._snapshot(self._saved_attnames(kwargs.get('update_fields')))
+
+    def _saved_attnames(self, update_fields):
+        if update_fields is None:
+            return None
+        return {self._meta.get_field(name).attname for name in update_fields}
 
 class StripeCustomer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -21,13 +88,15 @@ SUBSCRIPTION_STATUS_CHOICES = (
     ('ended', 'Ended'), # Custom status for truly ended subscriptions
 )
 
-class StripePlan(models.Model):
+class StripePlan(DirtyFieldsMixin, models.Model):
     """
     Represents a subscription plan offered by the application,
     mapping to a Stripe Price ID and defining credit allocations.
     """
     name = models.CharField(max_length=100, help_text="e.g., 'Basic Plan', 'Pro Yearly'")
     stripe_price_id = models.CharField(max_length=255, unique=True, help_text="The Stripe Price ID for this plan.")
+    stripe_product_id = models.CharField(max_length=255, blank=True, default='',
+                                         help_text="The Stripe Product the price belongs to; set by the catalog sync.")
     plan_type = models.CharField(max_length=50, choices=[
         ('monthly', 'Monthly'),
         ('yearly', 'Yearly'),
@@ -42,12 +111,17 @@ class StripePlan(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['stripe_product_id'], name='stripeplan_product'),
+        ]
+
     def __str__(self):
         return f"{self.name} (Stripe Price ID: {self.stripe_price_id})"
     
 
 
-class UserSubscription(models.Model):
+class UserSubscription(DirtyFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     stripe_customer_id = models.CharField(max_length=255)
     stripe_subscription_id = models.CharField(max_length=255)
@@ -67,9 +141,18 @@ class UserSubscription(models.Model):
     
     last_credit_refill_date = models.DateTimeField(null=True, blank=True,
                                                     help_text="The last date credits were refilled for the user.")
+    last_event_created = models.DateTimeField(null=True, blank=True,
+                                              help_text="Creation time of the newest Stripe subscription event applied; older events are discarded.")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['stripe_subscription_id'], name='usersub_stripe_subscription'),
+            models.Index(fields=['stripe_customer_id'], name='usersub_stripe_customer'),
+            models.Index(fields=['created_at', 'id'], name='usersub_created'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.plan} - Active: {self.is_active}"
     
@@ -83,7 +166,7 @@ class UserSubscription(models.Model):
 
 
 
-class Invoice(models.Model):
+class Invoice(DirtyFieldsMixin, models.Model):
     """
     Records historical invoice data from Stripe for auditing and user display.
     """
@@ -109,6 +192,308 @@ class Invoice(models.Model):
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = "Invoices"
+        indexes = [
+            # Serves the default ordering (plus the admin's pk tie-breaker) and date ranges.
+            models.Index(fields=['created_at', 'id'], name='invoice_created'),
+            models.Index(fields=['user_subscription_id'], name='invoice_subscription'),
+        ]
 
     def __str__(self):
         return f"Invoice {self.stripe_invoice_id} for {self.user.username} - Amount: {self.amount_due} {self.currency}"
+
+
+
+class OpenCheckoutSession(models.Model):
+    """
+    A Stripe Checkout Session that was created but not yet completed or expired.
+    Repeat clicks on the same plan redirect to it instead of creating a new session.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='open_checkout_sessions')
+    stripe_price_id = models.CharField(max_length=255, help_text="The Stripe Price ID the session subscribes to.")
+    stripe_session_id = models.CharField(max_length=255, unique=True, help_text="The ID of the Checkout Session in Stripe.")
+    old_subscription_id = models.CharField(max_length=255, blank=True, default='',
+                                           help_text="Subscription the session replaces; a session is only reused while this still matches.")
+    url = models.TextField(help_text="Hosted Checkout page URL.")
+    expires_at = models.DateTimeField(help_text="When Stripe expires the session.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'stripe_price_id'], name='unique_open_checkout_session_per_price'),
+        ]
+
+    def __str__(self):
+        return f"Checkout {self.stripe_session_id} for {self.user.username} ({self.stripe_price_id})"
+
+
+
+class StripeOutboxEntry(models.Model):
+    """
+    A Stripe subscription change the user asked for, written in the same
+    transaction as the optimistic local change and sent to Stripe afterwards
+    by subscriptions.outbox.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    CONFIRMED = 'confirmed'
+    FAILED = 'failed'
+
+    ACTION_CHOICES = (
+        ('pause', 'Pause'),
+        ('resume', 'Resume'),
+        ('cancel_at_period_end', 'Cancel at period end'),
+    )
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),     # Not yet accepted by Stripe
+        (SENT, 'Sent'),           # Accepted by Stripe, webhook not seen yet
+        (CONFIRMED, 'Confirmed'), # Webhook shows the change applied
+        (FAILED, 'Failed'),       # Rejected by Stripe; the local change was reverted
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stripe_outbox_entries')
+    stripe_subscription_id = models.CharField(max_length=255)
+    action = models.CharField(max_length=30, choices=ACTION_CHOICES)
+    params = models.JSONField(help_text="Arguments for stripe.Subscription.modify.")
+    revert = models.JSONField(default=dict, help_text="Local fields restored if Stripe rejects the change.")
+    idempotency_key = models.CharField(max_length=255, unique=True,
+                                       help_text="Sent with every attempt, so retries never apply the change twice.")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    confirmed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_attempt'),
+            models.Index(fields=['stripe_subscription_id', 'status'], name='outbox_subscription_status'),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.stripe_subscription_id} ({self.status})"
+
+
+class StripeWebhookEvent(models.Model):
+    """
+    A verified Stripe webhook event waiting for, or done with, processing by the
+    partitioned webhook workers (subscriptions.webhook_queue).
+    """
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    SUPERSEDED = 'superseded'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (PROCESSED, 'Processed'),
+        (SUPERSEDED, 'Superseded'),  # A newer event for the same object was applied instead
+        (FAILED, 'Failed'),          # Gave up after repeated errors
+    )
+
+    stripe_event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    ordering_key = models.CharField(max_length=255,
+                                    help_text="Stripe customer id (or object id): events sharing it apply in order.")
+    object_id = models.CharField(max_length=255, blank=True, default='')
+    partition = models.PositiveSmallIntegerField()
+    created = models.DateTimeField(help_text="When Stripe created the event.")
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['partition', 'status', 'created', 'id'], name='webhook_partition_queue'),
+            models.Index(fields=['ordering_key', 'status', 'created'], name='webhook_key_status'),
+            # Polling for partitions with due events reads only the pending rows.
+            models.Index(fields=['next_attempt_at', 'partition'], condition=models.Q(status='pending'),
+                         name='webhook_pending_due'),
+            models.Index(fields=['processed_at'], name='webhook_processed_at'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.stripe_event_id} ({self.status})"
+
+
+class WebhookPartition(models.Model):
+    """
+    Lease on one webhook partition. Only the worker holding an unexpired lease
+    processes the partition's events, which keeps them in order.
+    """
+    number = models.PositiveSmallIntegerField(primary_key=True)
+    lease_owner = models.CharField(max_length=255, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Partition {self.number} ({self.lease_owner or 'free'})"
+
+
+class UsageBucket(models.Model):
+    """
+    Credits a subscription used in one STRIPE_USAGE_WINDOW_SECONDS window.
+    Debits add to it locally; subscriptions.usage reports the part above
+    reported_quantity to Stripe.
+    """
+    user_subscription = models.ForeignKey(UserSubscription, on_delete=models.CASCADE, related_name='usage_buckets')
+    window_start = models.DateTimeField()
+    quantity = models.PositiveIntegerField(default=0)
+    reported_quantity = models.PositiveIntegerField(default=0,
+                                                    help_text="Watermark: how much of quantity is in a UsageReport.")
+    summarized_quantity = models.PositiveIntegerField(default=0,
+                                                      help_text="Watermark: how much of quantity is in DailyPlanSummary.")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_subscription', 'window_start'], name='unique_usage_bucket_window'),
+        ]
+        indexes = [
+            models.Index(fields=['window_start'], name='usage_bucket_window'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} credits for {self.user_subscription_id} from {self.window_start}"
+
+
+class CreditReservation(models.Model):
+    """
+    Credits held for a long-running job (see subscriptions/reservations.py).
+    Reserving takes them from the subscription's balance; committing records
+    the part the job used as usage and returns the rest; releasing, or expiry,
+    returns all of them.
+    """
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+    EXPIRED = 'expired'
+
+    STATUS_CHOICES = (
+        (HELD, 'Held'),
+        (COMMITTED, 'Committed'),
+        (RELEASED, 'Released'),
+        (EXPIRED, 'Expired'),  # Released by the sweeper
+    )
+
+    user_subscription = models.ForeignKey(UserSubscription, on_delete=models.CASCADE,
+                                          related_name='credit_reservations')
+    amount = models.PositiveIntegerField()
+    committed_amount = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField(help_text="Held credits return to the balance after this.")
+    created_at = models.DateTimeField(auto_now_add=True)
+    settled_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_expires'),
+        ]
+
+    def __str__(self):
+        return f"{self.amount} credits for {self.user_subscription_id} ({self.status})"
+
+
+class UsageReport(models.Model):
+    """
+    Aggregated usage of one Stripe customer, recorded before it is sent as a
+    meter event, so every retry sends the same identifier and Stripe counts it once.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),  # Rejected by Stripe
+    )
+
+    stripe_customer_id = models.CharField(max_length=255)
+    event_name = models.CharField(max_length=100)
+    quantity = models.PositiveIntegerField()
+    timestamp = models.DateTimeField(help_text="End of the last usage window included.")
+    identifier = models.CharField(max_length=100, unique=True,
+                                  help_text="Meter event identifier; Stripe drops events it has already seen.")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='usage_report_status_next'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} {self.event_name} for {self.stripe_customer_id} ({self.status})"
+
+
+class SummaryChange(models.Model):
+    """
+    A change to the daily plan summaries, written in the same transaction as the
+    invoice or status change that caused it and folded into DailyPlanSummary by
+    subscriptions.summaries. Inserting here instead of updating the summary row
+    keeps concurrent webhooks for one plan from queueing on that row.
+    """
+    day = models.DateField()
+    # Summaries outlive deleted plans, so no foreign key constraint.
+    plan = models.ForeignKey(StripePlan, on_delete=models.DO_NOTHING, db_constraint=False,
+                             null=True, blank=True, related_name='+')
+    currency = models.CharField(max_length=3, default='usd',
+                                help_text="The invoice's currency, or the plan's for subscription changes.")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    invoices_paid = models.IntegerField(default=0)
+    invoices_failed = models.IntegerField(default=0)
+    new_subscriptions = models.IntegerField(default=0)
+    churned_subscriptions = models.IntegerField(default=0)
+    active_subscriptions = models.IntegerField(default=0, help_text="Change in active subscriptions.")
+    mrr = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Change in MRR.")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Summary change for plan {self.plan_id} on {self.day}"
+
+
+class DailyPlanSummary(models.Model):
+    """
+    Revenue, churn and credit consumption of one plan on one day in one
+    currency, maintained incrementally by subscriptions.summaries.
+    active_subscriptions and mrr are the totals at the end of the day; a day
+    without changes has no row, so the latest earlier row holds its totals.
+    """
+    day = models.DateField()
+    plan = models.ForeignKey(StripePlan, on_delete=models.DO_NOTHING, db_constraint=False,
+                             null=True, blank=True, related_name='+')
+    currency = models.CharField(max_length=3, default='usd')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0,
+                                  help_text="Successfully paid invoice amounts in this currency.")
+    invoices_paid = models.IntegerField(default=0)
+    invoices_failed = models.IntegerField(default=0)
+    new_subscriptions = models.IntegerField(default=0)
+    churned_subscriptions = models.IntegerField(default=0)
+    credits_used = models.BigIntegerField(default=0)
+    active_subscriptions = models.IntegerField(default=0)
+    mrr = models.DecimalField(max_digits=14, decimal_places=2, default=0,
+                              help_text="Monthly recurring revenue of active, unpaused subscriptions.")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['plan', 'day', 'currency'], condition=models.Q(plan__isnull=False),
+                                    name='unique_daily_plan_currency_summary'),
+            models.UniqueConstraint(fields=['day', 'currency'], condition=models.Q(plan__isnull=True),
+                                    name='unique_daily_currency_summary_without_plan'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='daily_summary_day'),
+        ]
+        verbose_name_plural = "Daily plan summaries"
+
+    def __str__(self):
+        return f"Plan {self.plan_id} on {self.day} ({self.currency})"
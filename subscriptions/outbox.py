@@ -0,0 +1,282 @@
+# subscriptions/outbox.py
+"""
+Transactional outbox for the pause, resume and cancel-at-period-end buttons.
+
+The views apply the change locally and call enqueue() in one transaction, so
+the user never waits on Stripe and a crash can no longer leave a local change
+without its Stripe counterpart (or the reverse). Entries are then sent to
+Stripe:
+
+- right after the request commits, on a small per-process pool of background
+  threads;
+- by `python manage.py dispatch_stripe_outbox --loop`, which retries failures
+  with exponential backoff and picks up anything a crashed worker left behind.
+
+A dispatcher claims an entry in a short transaction, by counting the attempt
+and moving its next attempt past the longest a Stripe call can take, and calls
+Stripe after that transaction has committed: no row lock or transaction is
+held while waiting on Stripe. The outcome is recorded in a second short
+transaction, only if the entry is still in the state the claim left it in.
+
+Every attempt for an entry reuses its idempotency key. Entries for the same
+subscription are sent in the order they were created. When Stripe rejects a
+change for good, the local fields recorded in `revert` are restored. The
+customer.subscription.updated webhook confirms sent entries (confirm()) and
+keeps still-open changes applied on top of Stripe's state (apply_open()).
+"""
+
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import metrics, stripe_guard
+from .models import StripeOutboxEntry, UserSubscription
+from .stripe_client import stripe
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+MAX_BACKOFF = timedelta(minutes=30)
+BACKGROUND_THREADS = 2  # Per process, for the dispatch right after a click
+
+# Arguments for stripe.Subscription.modify per action.
+STRIPE_PARAMS = {
+    'pause': {'pause_collection': {'behavior': 'mark_uncollectible'}},
+    'resume': {'pause_collection': ''},  # An empty string clears the pause
+    'cancel_at_period_end': {'cancel_at_period_end': True},
+}
+
+# The optimistic local state per action.
+LOCAL_CHANGES = {
+    'pause': {'status': 'paused', 'is_paused': True},
+    'resume': {'status': 'active', 'is_paused': False},
+    'cancel_at_period_end': {'cancel_at_period_end_stripe': True},
+}
+
+OPEN_STATUSES = (StripeOutboxEntry.PENDING, StripeOutboxEntry.SENT)
+
+_executor = None
+_queued = set()  # Subscriptions waiting for a background dispatch
+_queued_lock = threading.Lock()
+
+
+def apply_change(user_sub, action):
+    """
+    Applies an action's local change to `user_sub` (unsaved) and returns the
+    previous values of the fields it touched.
+    """
+    previous = {}
+    for field, value in LOCAL_CHANGES[action].items():
+        previous[field] = getattr(user_sub, field)
+        setattr(user_sub, field, value)
+    return previous
+
+
+def enqueue(user_sub, action, revert):
+    """
+    Records the Stripe side of a local change. Must run inside the transaction
+    that saves the change; the entry is dispatched once it commits.
+    """
+    entry = StripeOutboxEntry.objects.create(
+        user_id=user_sub.user_id,
+        stripe_subscription_id=user_sub.stripe_subscription_id,
+        action=action,
+        params=STRIPE_PARAMS[action],
+        revert=revert,
+        idempotency_key=f"outbox-{action}-{uuid.uuid4()}",
+    )
+    transaction.on_commit(lambda: dispatch_in_background(entry.stripe_subscription_id))
+    return entry
+
+
+def dispatch_in_background(stripe_subscription_id):
+    """
+    Sends a subscription's pending entries off the request thread. A
+    subscription already waiting for a background thread is not queued again,
+    and failures are left for the dispatcher command to retry.
+    """
+    global _executor
+    with _queued_lock:
+        if stripe_subscription_id in _queued:
+            return
+        _queued.add(stripe_subscription_id)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=BACKGROUND_THREADS, thread_name_prefix='stripe-outbox')
+    _executor.submit(_dispatch_queued, stripe_subscription_id)
+
+
+def _dispatch_queued(stripe_subscription_id):
+    # Before dispatching: an entry committed from now on needs another pass.
+    with _queued_lock:
+        _queued.discard(stripe_subscription_id)
+    try:
+        dispatch_due(stripe_subscription_id=stripe_subscription_id)
+    except Exception:
+        logger.warning("Could not dispatch outbox for %s", stripe_subscription_id, exc_info=True)
+    finally:
+        connection.close()
+
+
+def dispatch_due(limit=100, stripe_subscription_id=None):
+    """
+    Sends pending entries whose next attempt is due, oldest first. Returns the
+    number of entries sent.
+    """
+    due = StripeOutboxEntry.objects.filter(status=StripeOutboxEntry.PENDING, next_attempt_at__lte=timezone.now())
+    if stripe_subscription_id:
+        due = due.filter(stripe_subscription_id=stripe_subscription_id)
+
+    sent = 0
+    blocked = set()
+    for pk in due.order_by('pk').values_list('pk', flat=True)[:limit]:
+        entry = _claim(pk, blocked)
+        if entry is None:
+            continue
+        if _send(entry):
+            sent += 1
+        else:
+            blocked.add(entry.stripe_subscription_id)
+        if entry.status == StripeOutboxEntry.FAILED:
+            with transaction.atomic():
+                _revert(entry)
+    return sent
+
+
+def _claim(pk, blocked):
+    """
+    Takes a due entry for one attempt and commits, or returns None. Until the
+    claim runs out, other dispatchers consider the entry not due; they only
+    retry it if this dispatcher dies during the call.
+    """
+    with transaction.atomic():
+        # The row lock keeps concurrent dispatchers from claiming the same entry.
+        entry = (
+            StripeOutboxEntry.objects.select_for_update(skip_locked=True)
+            .filter(pk=pk, status=StripeOutboxEntry.PENDING, next_attempt_at__lte=timezone.now()).first()
+        )
+        if entry is None or entry.stripe_subscription_id in blocked:
+            return None
+        if _has_earlier_pending(entry):
+            # Keep per-subscription order: wait until the earlier change went through.
+            blocked.add(entry.stripe_subscription_id)
+            return None
+        entry.attempts += 1
+        entry.next_attempt_at = timezone.now() + timedelta(seconds=stripe_guard.max_call_seconds() + 30)
+        entry.save(update_fields=['attempts', 'next_attempt_at'])
+    return entry
+
+
+def _has_earlier_pending(entry):
+    return StripeOutboxEntry.objects.filter(
+        stripe_subscription_id=entry.stripe_subscription_id,
+        status=StripeOutboxEntry.PENDING,
+        pk__lt=entry.pk,
+    ).exists()
+
+
+def _send(entry):
+    try:
+        stripe.Subscription.modify(
+            entry.stripe_subscription_id,
+            idempotency_key=entry.idempotency_key,
+            **entry.params,
+        )
+    except stripe.error.StripeError as e:
+        permanent = isinstance(e, (stripe.error.InvalidRequestError, stripe.error.AuthenticationError,
+                                   stripe.error.PermissionError, stripe.error.IdempotencyError))
+        if permanent or entry.attempts >= MAX_ATTEMPTS:
+            if _record(entry, status=StripeOutboxEntry.FAILED, last_error=str(e)):
+                metrics.incr('stripe.outbox.failed')
+                logger.error("Outbox entry %s (%s) failed for good: %s", entry.pk, entry.action, e)
+        else:
+            backoff = min(MAX_BACKOFF, timedelta(seconds=2 ** entry.attempts))
+            if _record(entry, last_error=str(e), next_attempt_at=timezone.now() + backoff):
+                metrics.incr('stripe.outbox.retried')
+        return False
+
+    if _record(entry, status=StripeOutboxEntry.SENT, sent_at=timezone.now(), last_error=''):
+        metrics.incr('stripe.outbox.sent')
+        metrics.timing('stripe.outbox.delay', (entry.sent_at - entry.created_at).total_seconds() * 1000)
+    return True
+
+
+def _record(entry, **fields):
+    """
+    Records the outcome of the attempt `entry` was claimed for. Changes nothing
+    when the webhook confirmed the entry meanwhile, or when the claim ran out and
+    another dispatcher has claimed it again.
+    """
+    recorded = StripeOutboxEntry.objects.filter(
+        pk=entry.pk, status=StripeOutboxEntry.PENDING, attempts=entry.attempts,
+    ).update(**fields)
+    if recorded:
+        for field, value in fields.items():
+            setattr(entry, field, value)
+    return bool(recorded)
+
+
+def _revert(entry):
+    """
+    Undoes the optimistic local change of an entry Stripe rejected, unless a
+    later change for the subscription has superseded it.
+    """
+    user_sub = UserSubscription.objects.select_for_update().filter(
+        stripe_subscription_id=entry.stripe_subscription_id).first()
+    if user_sub is None:
+        return
+    if StripeOutboxEntry.objects.filter(
+        stripe_subscription_id=entry.stripe_subscription_id, pk__gt=entry.pk, status__in=OPEN_STATUSES,
+    ).exists():
+        return
+    for field, value in entry.revert.items():
+        setattr(user_sub, field, value)
+    user_sub.save()
+
+
+def _is_applied(action, sub_data):
+    paused = bool(sub_data.get('pause_collection'))
+    if action == 'pause':
+        return paused
+    if action == 'resume':
+        return not paused
+    return bool(sub_data.get('cancel_at_period_end'))
+
+
+def confirm(stripe_subscription_id, sub_data, event_created):
+    """
+    Marks open entries whose change shows in a customer.subscription.updated
+    payload as confirmed. Pending entries are included: the worker may have
+    crashed after Stripe accepted the change but before recording it. Entries
+    created after the event (Stripe timestamps are whole seconds) cannot be
+    confirmed by it.
+    """
+    confirmed = []
+    for entry in StripeOutboxEntry.objects.filter(
+        stripe_subscription_id=stripe_subscription_id,
+        status__in=OPEN_STATUSES,
+        created_at__lt=event_created + timedelta(seconds=1),
+    ).order_by('pk'):
+        if not _is_applied(entry.action, sub_data):
+            # Later entries were requested after this one; the event cannot confirm them either.
+            break
+        confirmed.append(entry.pk)
+    if confirmed:
+        StripeOutboxEntry.objects.filter(pk__in=confirmed).update(
+            status=StripeOutboxEntry.CONFIRMED, confirmed_at=timezone.now())
+        metrics.incr('stripe.outbox.confirmed', len(confirmed))
+
+
+def apply_open(user_sub):
+    """
+    Re-applies changes still on their way to Stripe, so a webhook describing an
+    older state does not flip the dashboard back.
+    """
+    for action in StripeOutboxEntry.objects.filter(
+        stripe_subscription_id=user_sub.stripe_subscription_id, status__in=OPEN_STATUSES,
+    ).order_by('pk').values_list('action', flat=True):
+        apply_change(user_sub, action)
@@ -0,0 +1,202 @@
+# subscriptions/profiling.py
+"""
+On-demand profiling of single requests and webhook events.
+
+A request is profiled when it carries an X-Profile header with a token from
+`python manage.py profile_token`, or when it is picked at random with
+probability PROFILE_SAMPLE_RATE. Webhook events applied by the workers are
+sampled at the same rate. A profile records:
+
+- wall and CPU time;
+- a cProfile of every function call;
+- every SQL query on every database alias, with its duration;
+- every Stripe API call, with its duration and time spent waiting on the rate limiter;
+- call stacks sampled every PROFILE_STACK_INTERVAL seconds.
+
+It is written to PROFILE_DIR as <name>.json (report), <name>.prof (pstats,
+e.g. for snakeviz) and <name>.folded (collapsed stacks for flamegraph.pl or
+speedscope). Requests that are not profiled only pay for a header lookup.
+"""
+
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.utils import timezone
+
+TOKEN_SALT = 'subscriptions.profiling'
+TOP_FUNCTIONS = 30
+
+_active = contextvars.ContextVar('active_profile', default=None)
+
+
+def make_token():
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def valid_token(token):
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def sampled():
+    rate = settings.PROFILE_SAMPLE_RATE
+    return bool(rate) and random.random() < rate
+
+
+def record_stripe_call(method, url, status_code, duration, waited):
+    """
+    Called by the Stripe HTTP client (stripe_guard) for every attempt.
+    """
+    profile = _active.get()
+    if profile is not None:
+        profile.stripe_calls.append({
+            'method': method.upper(), 'url': url, 'status': status_code,
+            'ms': round(duration * 1000, 3), 'rate_limit_wait_ms': round(waited * 1000, 3),
+        })
+
+
+class Profile:
+    def __init__(self, label):
+        self.label = label
+        self.started_at = timezone.now()
+        self.extra = {}
+        self.queries = []
+        self.stripe_calls = []
+        self.stacks = Counter()
+        self.wall_ms = self.cpu_ms = 0.0
+        self.profiler = cProfile.Profile()
+        self.report_name = None
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias, 'sql': sql, 'many': many,
+                'ms': round((time.perf_counter() - start) * 1000, 3),
+            })
+
+    def report(self):
+        statements = Counter(query['sql'] for query in self.queries)
+        return {
+            'label': self.label,
+            'started_at': self.started_at.isoformat(),
+            'wall_ms': round(self.wall_ms, 3),
+            'cpu_ms': round(self.cpu_ms, 3),
+            **self.extra,
+            'sql': {
+                'count': len(self.queries),
+                'ms': round(sum(query['ms'] for query in self.queries), 3),
+                'repeated': [{'sql': sql, 'count': count} for sql, count in statements.most_common(10) if count > 1],
+                'queries': self.queries,
+            },
+            'stripe': {
+                'count': len(self.stripe_calls),
+                'ms': round(sum(call['ms'] for call in self.stripe_calls), 3),
+                'calls': self.stripe_calls,
+            },
+            'top_functions': self.top_functions(),
+        }
+
+    def top_functions(self):
+        stats = pstats.Stats(self.profiler).stats
+        ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        return [
+            {
+                'function': pstats.func_std_string(function),
+                'calls': calls,
+                'own_ms': round(own * 1000, 3),
+                'cumulative_ms': round(cumulative * 1000, 3),
+            }
+            for function, (_, calls, own, cumulative, _) in ranked
+        ]
+
+
+class _StackSampler(threading.Thread):
+    """
+    Records the profiled thread's call stack at a fixed interval, as the
+    collapsed stacks flame graph tools read.
+    """
+
+    def __init__(self, thread_id, stacks, interval):
+        super().__init__(daemon=True, name='profile-sampler')
+        self.thread_id = thread_id
+        self.stacks = stacks
+        self.interval = interval
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+
+@contextmanager
+def profile(label):
+    """
+    Profiles the block and yields the Profile. Nested calls profile nothing
+    and yield None.
+    """
+    if _active.get() is not None:
+        yield None
+        return
+    current = Profile(label)
+    token = _active.set(current)
+    sampler = _StackSampler(threading.get_ident(), current.stacks, settings.PROFILE_STACK_INTERVAL)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(current.record_query))
+        wall, cpu = time.perf_counter(), time.thread_time()
+        sampler.start()
+        current.profiler.enable()
+        try:
+            yield current
+        finally:
+            current.profiler.disable()
+            sampler.done.set()
+            sampler.join()
+            current.wall_ms = (time.perf_counter() - wall) * 1000
+            current.cpu_ms = (time.thread_time() - cpu) * 1000
+            _active.reset(token)
+
+
+def write(current):
+    """
+    Writes the profile's files to PROFILE_DIR and returns their common name.
+    """
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', current.label).strip('-')[:80]
+    name = f"{current.started_at:%Y%m%dT%H%M%S}-{slug}-{uuid.uuid4().hex[:8]}"
+    base = os.path.join(settings.PROFILE_DIR, name)
+    with open(f"{base}.json", 'w') as report:
+        json.dump(current.report(), report, indent=2, default=str)
+    current.profiler.dump_stats(f"{base}.prof")
+    with open(f"{base}.folded", 'w') as folded:
+        for stack, count in current.stacks.items():
+            folded.write(f"{stack} {count}\n")
+    current.report_name = name
+    return name
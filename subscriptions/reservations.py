@@ -0,0 +1,159 @@
+# subscriptions/reservations.py
+"""
+Two-phase credit debits for long-running jobs.
+
+- reserve() takes the credits from the balance before the job starts, with
+  the same single conditional UPDATE as locking.debit_credits(), and stores a
+  CreditReservation that expires after CREDIT_RESERVATION_TTL seconds.
+- commit() settles the reservation with the amount the job actually used:
+  that part is recorded as usage for export to Stripe, the rest goes back to
+  the balance.
+- release() settles it without using any credits, returning all of them.
+- release_expired() returns the credits of reservations that were neither
+  committed nor released in time; `python manage.py release_credit_reservations
+  --loop` runs it continuously.
+
+Neither phase takes a lock before writing. Reserving is one conditional UPDATE
+of the subscription row, as short as a debit; settling is one conditional
+UPDATE of the reservation row, so it happens exactly once however many workers
+race for it, and a customer's jobs only meet on the subscription row again
+when unused credits go back. Every writer here writes the reservation row
+before the subscription row, and nothing locks them the other way round, so
+lock waits never form a cycle.
+Credits are only returned to active subscriptions: an ended subscription's
+balance was revoked with the rest of it.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from . import live_updates, metrics, usage
+from .locking import refresh_fields
+from .models import CreditReservation, UserSubscription
+
+
+def reserve(user_sub, amount, ttl=None):
+    """
+    Holds `amount` credits, a positive number, for `ttl` seconds
+    (CREDIT_RESERVATION_TTL by default) if the subscription is active and has
+    enough. Returns the CreditReservation, or None when there were not enough
+    credits; `user_sub.credits` is refreshed either way.
+    """
+    if amount <= 0:
+        raise ValueError(f"Cannot reserve {amount} credits.")
+    ttl = settings.CREDIT_RESERVATION_TTL if ttl is None else ttl
+    with transaction.atomic():
+        # Inserted first, so the subscription row stays locked only until the commit
+        reservation = CreditReservation.objects.create(
+            user_subscription=user_sub, amount=amount, expires_at=timezone.now() + timedelta(seconds=ttl))
+        held = UserSubscription.objects.filter(
+            pk=user_sub.pk, is_active=True, credits__gte=amount,
+        ).update(credits=F('credits') - amount, updated_at=Now())
+        if not held:
+            transaction.set_rollback(True)
+    refresh_fields(user_sub, 'credits', 'is_active')
+    if not held:
+        return None
+    live_updates.publish_subscription_update(user_sub)
+    metrics.incr('credits.reservations.held')
+    return reservation
+
+
+def commit(reservation, amount=None):
+    """
+    Settles a held, unexpired reservation, using `amount` of its credits (all
+    of them by default) and returning the rest to the balance. Returns False
+    when the reservation was already settled or has expired.
+    """
+    used = reservation.amount if amount is None else amount
+    if not 0 <= used <= reservation.amount:
+        raise ValueError(f"Cannot commit {used} of {reservation.amount} reserved credits.")
+    refunded = False
+    with transaction.atomic():
+        committed = CreditReservation.objects.filter(
+            pk=reservation.pk, status=CreditReservation.HELD, expires_at__gt=Now(),
+        ).update(status=CreditReservation.COMMITTED, committed_amount=used, settled_at=Now())
+        if committed:
+            if used:
+                usage.record(reservation.user_subscription, used)
+            refunded = _refund(reservation, reservation.amount - used)
+    if committed:
+        reservation.status, reservation.committed_amount = CreditReservation.COMMITTED, used
+        metrics.incr('credits.reservations.committed')
+    if refunded:
+        _publish(reservation)
+    return bool(committed)
+
+
+def release(reservation):
+    """
+    Settles a held reservation without using any credits, returning all of
+    them to the balance. Returns False when it was already settled or the
+    sweeper expired it first.
+    """
+    with transaction.atomic():
+        released = CreditReservation.objects.filter(
+            pk=reservation.pk, status=CreditReservation.HELD,
+        ).update(status=CreditReservation.RELEASED, settled_at=Now())
+        refunded = bool(released) and _refund(reservation, reservation.amount)
+    if released:
+        reservation.status = CreditReservation.RELEASED
+        metrics.incr('credits.reservations.released')
+    if refunded:
+        _publish(reservation)
+    return bool(released)
+
+
+def release_expired(limit=1000):
+    """
+    Expires up to `limit` held reservations past their expiry and returns
+    their credits with one UPDATE of all their subscriptions. Returns the
+    number of reservations expired.
+    """
+    with transaction.atomic():
+        # Skipped rows are being committed or released right now.
+        expired = list(
+            CreditReservation.objects.select_for_update(skip_locked=True)
+            .filter(status=CreditReservation.HELD, expires_at__lte=Now())
+            .order_by('expires_at')
+            .values_list('pk', 'user_subscription_id', 'amount')[:limit]
+        )
+        if not expired:
+            return 0
+        CreditReservation.objects.filter(pk__in=[pk for pk, _, _ in expired]).update(
+            status=CreditReservation.EXPIRED, settled_at=Now())
+
+        refunds = defaultdict(int)
+        for _, user_sub_id, amount in expired:
+            refunds[user_sub_id] += amount
+        UserSubscription.objects.filter(pk__in=refunds, is_active=True).update(
+            credits=F('credits') + Case(
+                *(When(pk=pk, then=Value(amount)) for pk, amount in refunds.items()), default=Value(0)),
+            updated_at=Now(),
+        )
+
+    for user_sub in UserSubscription.objects.using(router.db_for_write(UserSubscription)).filter(
+            pk__in=refunds, is_active=True):
+        live_updates.publish_subscription_update(user_sub)
+    metrics.incr('credits.reservations.expired', len(expired))
+    return len(expired)
+
+
+def _refund(reservation, amount):
+    if not amount:
+        return False
+    return bool(UserSubscription.objects.filter(
+        pk=reservation.user_subscription_id, is_active=True,
+    ).update(credits=F('credits') + amount, updated_at=Now()))
+
+
+def _publish(reservation):
+    user_sub = reservation.user_subscription
+    refresh_fields(user_sub, 'credits', 'is_active')
+    live_updates.publish_subscription_update(user_sub)
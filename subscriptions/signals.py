@@ -0,0 +1,38 @@
+# subscriptions/signals.py
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import plans_changed
+from .customers import provision_in_background
+from .live_updates import publish_subscription_update
+from .models import StripePlan, UserSubscription
+from .summaries import record_subscription_change, subscription_state
+
+
+@receiver(post_save, sender=StripePlan)
+def stripe_plan_saved(sender, instance, **kwargs):
+    plans_changed(instance.updated_at)
+
+
+@receiver(post_delete, sender=StripePlan)
+def stripe_plan_deleted(sender, instance, **kwargs):
+    plans_changed()
+
+
+@receiver(post_save, sender=UserSubscription)
+def user_subscription_saved(sender, instance, created, **kwargs):
+    publish_subscription_update(instance)
+    # DirtyFieldsMixin still holds the values from before this save.
+    before = None if created else subscription_state(instance, loaded=True)
+    if created or before is not None:
+        record_subscription_change(before, subscription_state(instance))
+
+
+@receiver(post_save, sender=User)
+def user_signed_up(sender, instance, created, **kwargs):
+    if created and settings.PROVISION_STRIPE_CUSTOMERS_ON_SIGNUP:
+        transaction.on_commit(lambda: provision_in_background(instance))
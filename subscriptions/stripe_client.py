@@ -0,0 +1,25 @@
+# subscriptions/stripe_client.py
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+
+def _load_stripe():
+    """
+    Imports and configures the Stripe SDK on first use. The SDK is large and most
+    requests (dashboard, plans page) never touch it, so workers boot without it.
+    """
+    import stripe
+
+    from .stripe_guard import install
+
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.api_base = settings.STRIPE_API_BASE
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    install(stripe)
+    return stripe
+
+
+# Drop-in replacement for the `stripe` module: `stripe.checkout.Session.create(...)`
+# and `except stripe.error.StripeError` work unchanged and trigger the import lazily.
+stripe = SimpleLazyObject(_load_stripe)
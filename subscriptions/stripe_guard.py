@@ -0,0 +1,285 @@
+# subscriptions/stripe_guard.py
+"""
+Rate limiting and circuit breaking for every outbound Stripe call.
+
+GuardedRequestsClient is installed as stripe.default_http_client (see
+stripe_client.py), so checkout, pause/resume/cancel, webhook-driven cancels and
+invoice voids all pass through it without any change at the call sites:
+
+- a token bucket keeps the whole deployment under STRIPE_RATE_LIMIT requests per
+  second. With REDIS_URL the bucket is shared by all workers, otherwise each
+  process gets its share of the budget;
+- a circuit breaker opens after STRIPE_BREAKER_FAILURE_THRESHOLD consecutive
+  timeouts, connection errors or 5xx responses. While it is open, calls fail
+  immediately with StripeUnavailable instead of waiting for the timeout. The open
+  state is shared through the cache so every worker fails fast at once.
+
+StripeUnavailable is a stripe.error.StripeError, so the views' existing error
+handling shows its message to the user.
+"""
+
+import logging
+import threading
+import time
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+
+class StripeUnavailable(stripe.error.APIConnectionError):
+    """
+    Raised without contacting Stripe when the breaker is open or the rate limit
+    would make the caller wait too long. Never retried by the SDK.
+    """
+
+    def __init__(self, message):
+        super().__init__(message, should_retry=False)
+
+
+class TokenBucket:
+    """
+    Process-wide token bucket.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """
+        Takes one token. Returns (seconds to wait before retrying, tokens left);
+        a wait of 0 means the token was granted.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0, self.tokens
+            return (1 - self.tokens) / self.rate, self.tokens
+
+
+# Refill and take atomically inside Redis, using the Redis clock so workers on
+# different hosts agree on elapsed time.
+_REDIS_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], 60)
+return {tostring(wait), tostring(tokens)}
+"""
+
+
+class RedisTokenBucket:
+    """
+    Token bucket shared by every worker through Redis. Falls back to a local
+    bucket (with this process's share of the rate) if Redis is unreachable.
+    """
+
+    key = 'subscriptions:stripe:rate_limiter'
+
+    def __init__(self, url, rate, burst, fallback):
+        import redis
+
+        self.rate = rate
+        self.burst = burst
+        self.fallback = fallback
+        self._script = redis.Redis.from_url(url, socket_timeout=0.5).register_script(_REDIS_TAKE_SCRIPT)
+
+    def take(self):
+        try:
+            wait, tokens = self._script(keys=[self.key], args=[self.rate, self.burst])
+            return float(wait), float(tokens)
+        except Exception:
+            logger.warning("Stripe rate limiter cannot reach Redis, using the local bucket", exc_info=True)
+            return self.fallback.take()
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    cache_key = 'subscriptions:stripe:breaker_open_until'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self._reject()
+                # Let exactly one trial request through to probe Stripe.
+                self._set_state(self.HALF_OPEN)
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self.trial_in_flight:
+                    self._reject()
+                self.trial_in_flight = True
+                return
+
+        # Another worker may already have seen Stripe fail.
+        open_until = cache.get(self.cache_key)
+        if open_until and open_until > time.time():
+            self._reject()
+
+    def cancel_trial(self):
+        """
+        The trial request never reached Stripe (e.g. it was rate limited); let another one try.
+        """
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+                cache.delete(self.cache_key)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+                cache.set(self.cache_key, time.time() + self.reset_timeout, self.reset_timeout)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning("Stripe circuit breaker %s -> %s", self.state, state)
+            self.state = state
+        metrics.gauge('stripe.breaker.open', int(state != self.CLOSED))
+
+    def _reject(self):
+        metrics.incr('stripe.breaker.rejected')
+        raise StripeUnavailable(
+            "Our payment provider is not responding right now. "
+            "Please try again in a few minutes."
+        )
+
+
+class RateLimiter:
+    def __init__(self, bucket, max_wait):
+        self.bucket = bucket
+        self.max_wait = max_wait
+
+    def acquire(self):
+        """
+        Blocks until a token is available, for at most max_wait seconds in total.
+        """
+        deadline = time.monotonic() + self.max_wait
+        throttled = False
+        while True:
+            wait, tokens = self.bucket.take()
+            metrics.gauge('stripe.rate_limiter.tokens', round(tokens, 2))
+            if not wait:
+                return
+            if not throttled:
+                throttled = True
+                metrics.incr('stripe.rate_limiter.throttled')
+            if time.monotonic() + wait > deadline:
+                metrics.incr('stripe.rate_limiter.rejected')
+                raise StripeUnavailable(
+                    "We're handling a lot of payment requests right now. "
+                    "Please try again in a moment."
+                )
+            time.sleep(wait)
+
+
+def build_rate_limiter():
+    local_share = settings.STRIPE_RATE_LIMIT / max(1, settings.STRIPE_RATE_LIMIT_PROCESSES)
+    local = TokenBucket(local_share, max(1, settings.STRIPE_RATE_LIMIT_BURST / max(1, settings.STRIPE_RATE_LIMIT_PROCESSES)))
+    if settings.REDIS_URL:
+        bucket = RedisTokenBucket(settings.REDIS_URL, settings.STRIPE_RATE_LIMIT, settings.STRIPE_RATE_LIMIT_BURST, local)
+    else:
+        bucket = local
+    return RateLimiter(bucket, settings.STRIPE_RATE_LIMIT_MAX_WAIT)
+
+
+class GuardedRequestsClient(stripe.RequestsClient):
+    """
+    The SDK's requests-based client with the rate limiter and circuit breaker in
+    front of every attempt, including the SDK's own retries.
+    """
+
+    def __init__(self, rate_limiter, breaker, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker
+
+    def request(self, method, url, headers, post_data=None):
+        self.breaker.before_call()
+        queued = time.perf_counter()
+        try:
+            self.rate_limiter.acquire()
+        except StripeUnavailable:
+            self.breaker.cancel_trial()
+            raise
+
+        start = time.perf_counter()
+        status_code = None
+        try:
+            content, status_code, response_headers = super().request(method, url, headers, post_data)
+        except stripe.error.APIConnectionError:
+            self.breaker.record_failure()
+            metrics.incr('stripe.response.connection_error')
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            metrics.timing('stripe.request', duration * 1000)
+            profiling.record_stripe_call(method, url, status_code, duration, start - queued)
+
+        metrics.incr(f"stripe.response.{status_code}")
+        if status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            # 4xx (including 429) means Stripe is up and answering.
+            self.breaker.record_success()
+        return content, status_code, response_headers
+
+
+def max_call_seconds():
+    """
+    The longest one Stripe call can block its caller: every network attempt
+    waiting the full rate limiter wait and then timing out, plus the SDK's
+    retry sleeps (at most 2 seconds each).
+    """
+    attempts = settings.STRIPE_MAX_NETWORK_RETRIES + 1
+    return attempts * (settings.STRIPE_RATE_LIMIT_MAX_WAIT + settings.STRIPE_TIMEOUT) + 2 * (attempts - 1)
+
+
+def install(stripe_module):
+    stripe_module.default_http_client = GuardedRequestsClient(
+        rate_limiter=build_rate_limiter(),
+        breaker=CircuitBreaker(settings.STRIPE_BREAKER_FAILURE_THRESHOLD, settings.STRIPE_BREAKER_RESET_TIMEOUT),
+        timeout=settings.STRIPE_TIMEOUT,
+    )
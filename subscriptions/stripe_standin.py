@@ -0,0 +1,267 @@
+# subscriptions/stripe_standin.py
+"""
+A local stand-in for the parts of the Stripe API this project uses, for load
+tests, benchmarks and tests that must not reach the real Stripe.
+
+It speaks Stripe's wire format (form-encoded requests, JSON responses) so the
+real SDK is exercised end to end. Objects are kept in memory. Objects that were
+never created (e.g. a subscription id from a fixture) are synthesized on first
+read. Latency and errors can be injected to simulate Stripe degrading.
+
+    with StripeStandIn(latency=0.3) as standin:   # 300 ms per request
+        standin.error_rate = 1.0                  # every request answers 500
+        ...
+        standin.calls                             # [(method, path), ...]
+
+Run it standalone with `python manage.py stripe_standin` and point the app at
+it with STRIPE_API_BASE.
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Id prefixes per collection, as Stripe uses them.
+ID_PREFIXES = {
+    'customers': 'cus',
+    'checkout/sessions': 'cs',
+    'subscriptions': 'sub',
+    'invoices': 'in',
+    'setup_intents': 'seti',
+    'events': 'evt',
+    'prices': 'price',
+    'products': 'prod',
+    'billing/meter_events': 'mevt',
+}
+
+OBJECT_NAMES = {
+    'customers': 'customer',
+    'checkout/sessions': 'checkout.session',
+    'subscriptions': 'subscription',
+    'invoices': 'invoice',
+    'setup_intents': 'setup_intent',
+    'events': 'event',
+    'prices': 'price',
+    'products': 'product',
+    'billing/meter_events': 'billing.meter_event',
+}
+
+
+def decode_form(body):
+    """
+    Turns Stripe's bracketed form encoding (`metadata[user_id]=1`,
+    `line_items[0][price]=...`) back into nested dicts and lists.
+    """
+    result = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        parts = key.replace(']', '').split('[')
+        target = result
+        for part, next_part in zip(parts, parts[1:]):
+            default = [] if next_part.isdigit() else {}
+            if isinstance(target, list):
+                index = int(part)
+                while len(target) <= index:
+                    target.append(default)
+                target = target[index]
+            else:
+                target = target.setdefault(part, default)
+        last = parts[-1]
+        if isinstance(target, list):
+            target.append(value)
+        else:
+            target[last] = value
+    return result
+
+
+class StripeStandIn:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.objects = {}
+        self.calls = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stripe-standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, method=None, path_prefix=''):
+        return sum(
+            1 for call_method, path in list(self.calls)
+            if (method is None or call_method == method) and path.startswith(path_prefix)
+        )
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    # --- request handling -------------------------------------------------
+
+    def handle(self, method, path, query, params):
+        """
+        Returns (status, body) for one API request.
+        """
+        resource = path[len('/v1/'):] if path.startswith('/v1/') else path.lstrip('/')
+        collection, object_id, action = self._split(resource)
+        if collection is None:
+            return 404, self._error(f"Unrecognized request URL ({method}: {path})")
+
+        if object_id is None:
+            if method == 'GET':
+                return 200, self.list(collection, dict(parse_qsl(query)))
+            return 200, self.create(collection, params)
+
+        if method == 'DELETE':
+            return 200, self.update(collection, object_id, {'status': 'canceled'})
+        if action == 'void':
+            return 200, self.update(collection, object_id, {'status': 'void'})
+        if action == 'cancel':
+            return 200, self.update(collection, object_id, {'status': 'canceled'})
+        if method == 'POST':
+            return 200, self.update(collection, object_id, params)
+        return 200, self.get(collection, object_id)
+
+    def _split(self, resource):
+        for collection in sorted(ID_PREFIXES, key=len, reverse=True):
+            if resource == collection:
+                return collection, None, None
+            if resource.startswith(collection + '/'):
+                rest = resource[len(collection) + 1:].split('/')
+                return collection, rest[0], rest[1] if len(rest) > 1 else None
+        return None, None, None
+
+    def _new_id(self, collection):
+        return f"{ID_PREFIXES[collection]}_{uuid.uuid4().hex[:24]}"
+
+    def _default(self, collection, object_id):
+        now = int(time.time())
+        obj = {'id': object_id, 'object': OBJECT_NAMES[collection], 'created': now, 'livemode': False, 'metadata': {}}
+        if collection == 'subscriptions':
+            obj.update({
+                'status': 'active',
+                'customer': 'cus_standin',
+                'cancel_at_period_end': False,
+                'pause_collection': None,
+                'items': {'object': 'list', 'data': [{
+                    'id': f"si_{object_id}",
+                    'object': 'subscription_item',
+                    'current_period_start': now,
+                    'current_period_end': now + 30 * 86400,
+                    'price': {'id': 'price_standin', 'object': 'price'},
+                }]},
+            })
+        elif collection == 'checkout/sessions':
+            obj.update({
+                'url': f"{self.url}/checkout/{object_id}",
+                'expires_at': now + 86400,
+                'status': 'open',
+            })
+        elif collection == 'setup_intents':
+            obj.update({'payment_method': 'pm_standin', 'status': 'succeeded'})
+        elif collection == 'invoices':
+            obj.update({'status': 'open'})
+        return obj
+
+    def _merge(self, target, params):
+        for key, value in params.items():
+            if key in ('expand', 'idempotency_key'):
+                continue
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                self._merge(target[key], value)
+            else:
+                target[key] = None if value == '' else value
+
+    def create(self, collection, params):
+        with self._lock:
+            object_id = self._new_id(collection)
+            obj = self._default(collection, object_id)
+            self._merge(obj, params)
+            self.objects[(collection, object_id)] = obj
+            return obj
+
+    def get(self, collection, object_id):
+        with self._lock:
+            return self.objects.setdefault((collection, object_id), self._default(collection, object_id))
+
+    def update(self, collection, object_id, params):
+        with self._lock:
+            obj = self.objects.setdefault((collection, object_id), self._default(collection, object_id))
+            self._merge(obj, params)
+            return obj
+
+    def list(self, collection, query):
+        limit = int(query.get('limit', 10))
+        starting_after = query.get('starting_after')
+        with self._lock:
+            objects = [obj for (name, _), obj in self.objects.items() if name == collection]
+        objects.sort(key=lambda obj: obj['created'], reverse=True)
+        if starting_after:
+            ids = [obj['id'] for obj in objects]
+            objects = objects[ids.index(starting_after) + 1:] if starting_after in ids else []
+        return {
+            'object': 'list',
+            'url': f"/v1/{collection}",
+            'data': objects[:limit],
+            'has_more': len(objects) > limit,
+        }
+
+    def _error(self, message, status_type='invalid_request_error'):
+        return {'error': {'type': status_type, 'message': message}}
+
+    def _handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                params = decode_form(self.rfile.read(length).decode()) if length else {}
+                with standin._lock:
+                    standin.calls.append((self.command, url.path))
+
+                if standin.latency:
+                    time.sleep(standin.latency)
+                if standin.error_rate and random.random() < standin.error_rate:
+                    status, body = 500, standin._error("Injected failure", 'api_error')
+                else:
+                    status, body = standin.handle(self.command, url.path, url.query, params)
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('Request-Id', f"req_{uuid.uuid4().hex[:14]}")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_DELETE = _respond
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
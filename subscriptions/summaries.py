@@ -0,0 +1,284 @@
+# subscriptions/summaries.py
+"""
+Daily revenue, churn and credit consumption per plan (DailyPlanSummary), kept
+up to date incrementally so finance dashboards read a few precomputed rows
+instead of aggregating every invoice and subscription.
+
+- The webhook handlers and the other writers of invoices and subscription
+  states record what changed as SummaryChange rows, in their own transaction
+  (record_invoice(), record_subscription_change()). Inserts never wait on
+  each other.
+- fold() adds the recorded changes, and the credit usage in UsageBucket that
+  has not been counted yet, to the summary rows, then deletes the changes.
+  `python manage.py update_summaries --loop` runs it continuously.
+- `python manage.py rebuild_summaries` recomputes everything from the source
+  tables, for backfills.
+
+active_subscriptions and mrr are running totals: each row holds the totals at
+the end of its day. A change that is folded after later days already have rows
+is added to those rows as well.
+
+Rows are kept per plan, day and currency, so amounts in different currencies
+are never added up: invoices count in their own currency, subscription changes
+and credit usage in the plan's. Folds and rebuilds hold a PostgreSQL advisory
+lock for their transaction, so running totals are only written by one of them
+at a time.
+"""
+
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import metrics
+from .models import DailyPlanSummary, Invoice, StripePlan, SummaryChange, UsageBucket, UserSubscription
+
+# Per-day counters, and running totals carried from one day to the next.
+COUNTERS = ('revenue', 'invoices_paid', 'invoices_failed', 'new_subscriptions', 'churned_subscriptions', 'credits_used')
+TOTALS = ('active_subscriptions', 'mrr')
+CHANGE_FIELDS = tuple(field for field in COUNTERS if field != 'credits_used') + TOTALS
+
+# StripePlan.currency's default, for usage of subscriptions without a plan.
+DEFAULT_CURRENCY = 'usd'
+# Key of the advisory lock serializing writes to DailyPlanSummary.
+SUMMARY_LOCK_ID = 0x5355_4d4d
+
+SubscriptionState = namedtuple('SubscriptionState', ['plan_id', 'is_active', 'is_paused'])
+
+
+def subscription_state(user_sub, loaded=False):
+    """
+    The fields of `user_sub` the summaries depend on: as loaded from the
+    database with loaded=True (None if unknown), otherwise as currently set.
+    """
+    if loaded:
+        values = getattr(user_sub, '_loaded_values', None)
+        if not values or user_sub._state.adding:
+            return None
+        return SubscriptionState(values.get('plan_id'), values.get('is_active'), values.get('is_paused'))
+    return SubscriptionState(user_sub.plan_id, user_sub.is_active, user_sub.is_paused)
+
+
+def plan_pricing(plan_id):
+    """
+    What one subscription to the plan adds to MRR, and the plan's currency.
+    """
+    plan = StripePlan.objects.filter(pk=plan_id).values('price', 'plan_type', 'currency').first()
+    if not plan:
+        return Decimal('0'), DEFAULT_CURRENCY
+    currency = plan['currency'].lower()
+    if plan['plan_type'] == 'lifetime':
+        return Decimal('0'), currency
+    if plan['plan_type'] == 'yearly':
+        return (plan['price'] / 12).quantize(Decimal('0.01')), currency
+    return plan['price'], currency
+
+
+def record_subscription_change(before, after):
+    """
+    Records a subscription moving from state `before` to `after` (None for a
+    subscription that did not exist). Subscriptions without a plan are not counted.
+    """
+    if before == after:
+        return
+    was_active = bool(before and before.is_active and before.plan_id)
+    is_active = bool(after and after.is_active and after.plan_id)
+    pricing = {}
+    changes = defaultdict(lambda: defaultdict(int))
+    if was_active:
+        pricing[before.plan_id] = plan_pricing(before.plan_id)
+        change = changes[before.plan_id]
+        change['active_subscriptions'] -= 1
+        if not before.is_paused:
+            change['mrr'] -= pricing[before.plan_id][0]
+        if not is_active:
+            change['churned_subscriptions'] += 1
+    if is_active:
+        if after.plan_id not in pricing:
+            pricing[after.plan_id] = plan_pricing(after.plan_id)
+        change = changes[after.plan_id]
+        change['active_subscriptions'] += 1
+        if not after.is_paused:
+            change['mrr'] += pricing[after.plan_id][0]
+        if not was_active:
+            change['new_subscriptions'] += 1
+
+    today = timezone.localdate()
+    SummaryChange.objects.bulk_create([
+        SummaryChange(day=today, plan_id=plan_id, currency=pricing[plan_id][1], **change)
+        for plan_id, change in changes.items() if any(change.values())
+    ])
+
+
+def record_invoice(invoice, plan_id):
+    """
+    Records a newly stored invoice. Call it only when the invoice row was created.
+    """
+    if invoice.is_successful_payment:
+        change = {'revenue': Decimal(str(invoice.amount_due)), 'invoices_paid': 1}
+    else:
+        change = {'invoices_failed': 1}
+    SummaryChange.objects.create(day=timezone.localdate(), plan_id=plan_id, currency=invoice.currency.lower(), **change)
+
+
+def fold(limit=5000):
+    """
+    Adds recorded changes and uncounted credit usage to the summary rows.
+    Returns the number of changes and usage buckets folded.
+    """
+    with transaction.atomic():
+        _lock_summaries()
+        # Skipped rows belong to a debit in progress.
+        changes = list(
+            SummaryChange.objects.select_for_update(skip_locked=True).order_by('pk')[:limit]
+        )
+        buckets = list(
+            UsageBucket.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('user_subscription__plan')
+            .filter(quantity__gt=F('summarized_quantity'))
+            .order_by('pk')[:limit]
+        )
+        if not (changes or buckets):
+            return 0
+
+        deltas = defaultdict(lambda: defaultdict(int))
+        for change in changes:
+            delta = deltas[(change.day, change.plan_id, change.currency)]
+            for field in CHANGE_FIELDS:
+                delta[field] += getattr(change, field)
+        for bucket in buckets:
+            day = timezone.localdate(bucket.window_start)
+            plan = bucket.user_subscription.plan
+            currency = plan.currency.lower() if plan else DEFAULT_CURRENCY
+            deltas[(day, bucket.user_subscription.plan_id, currency)]['credits_used'] += bucket.quantity - bucket.summarized_quantity
+            bucket.summarized_quantity = bucket.quantity
+
+        for (day, plan_id, currency), delta in sorted(deltas.items(), key=lambda item: item[0][0]):
+            _apply(day, plan_id, currency, delta)
+        SummaryChange.objects.filter(pk__in=[change.pk for change in changes]).delete()
+        UsageBucket.objects.bulk_update(buckets, ['summarized_quantity'])
+    metrics.incr('summaries.folded', len(changes) + len(buckets))
+    return len(changes) + len(buckets)
+
+
+def _lock_summaries():
+    """
+    Waits for other folds and rebuilds to commit; _apply() reads running totals
+    and creates missing rows, which only one of them may do at a time. Other
+    databases serialize write transactions anyway.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [SUMMARY_LOCK_ID])
+
+
+def _apply(day, plan_id, currency, delta):
+    rows = DailyPlanSummary.objects.filter(plan_id=plan_id, currency=currency)
+    updated = rows.filter(day=day).update(
+        updated_at=timezone.now(), **{field: F(field) + value for field, value in delta.items()})
+    if not updated:
+        previous = rows.filter(day__lt=day).order_by('-day').values(*TOTALS).first() or {}
+        DailyPlanSummary.objects.create(
+            day=day, plan_id=plan_id, currency=currency,
+            **{field: delta.get(field, 0) for field in COUNTERS},
+            **{field: previous.get(field, 0) + delta.get(field, 0) for field in TOTALS},
+        )
+    totals = {field: F(field) + delta[field] for field in TOTALS if delta.get(field)}
+    if totals:
+        # Days after this one already carry the old totals forward.
+        rows.filter(day__gt=day).update(**totals)
+
+
+def totals_on(day):
+    """
+    Active subscriptions and MRR per (plan id, currency) at the end of `day`.
+    Reads only the summary table, which grows by at most one row per plan,
+    currency and day.
+    """
+    latest = (
+        DailyPlanSummary.objects.filter(day__lte=day).values('plan_id', 'currency')
+        .annotate(latest=Max('day')).values_list('plan_id', 'currency', 'latest')
+    )
+    totals = {}
+    for plan_id, currency, latest_day in latest:
+        totals[(plan_id, currency)] = DailyPlanSummary.objects.filter(
+            plan_id=plan_id, currency=currency, day=latest_day).values(*TOTALS).get()
+    return totals
+
+
+def rebuild():
+    """
+    Recomputes every summary row from invoices, subscriptions and the usage
+    buckets still kept. Past status changes are not stored, so a subscription
+    counts as new on the day it was created and, if inactive now, as churned on
+    the day it was last updated; MRR uses current plan prices. Changes recorded
+    while the rebuild runs can be counted twice, so stop the webhook workers
+    first. Returns the number of summary rows written.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    pricing = {plan_id: plan_pricing(plan_id) for plan_id in StripePlan.objects.values_list('pk', flat=True)}
+
+    def currency_of(plan_id):
+        return pricing[plan_id][1] if plan_id in pricing else DEFAULT_CURRENCY
+
+    with transaction.atomic():
+        _lock_summaries()
+        SummaryChange.objects.all().delete()
+
+        invoices = (
+            Invoice.objects.annotate(day=TruncDate('created_at'), plan=F('user__usersubscription__plan_id'))
+            .values('day', 'plan', 'currency').order_by()
+            .annotate(revenue=Sum('amount_due', filter=Q(is_successful_payment=True)),
+                      paid=Count('pk', filter=Q(is_successful_payment=True)),
+                      failed=Count('pk', filter=Q(is_successful_payment=False)))
+        )
+        for row in invoices:
+            delta = deltas[(row['day'], row['plan'], row['currency'].lower())]
+            delta['revenue'] += row['revenue'] or 0
+            delta['invoices_paid'] += row['paid']
+            delta['invoices_failed'] += row['failed']
+
+        subscriptions = UserSubscription.objects.exclude(plan=None).order_by()
+        started = subscriptions.annotate(day=TruncDate('created_at')).values('day', 'plan_id').annotate(count=Count('pk'))
+        for row in started:
+            delta = deltas[(row['day'], row['plan_id'], currency_of(row['plan_id']))]
+            delta['new_subscriptions'] += row['count']
+            delta['active_subscriptions'] += row['count']
+            delta['mrr'] += row['count'] * pricing.get(row['plan_id'], (0,))[0]
+        stopped = (
+            subscriptions.filter(Q(is_active=False) | Q(is_paused=True))
+            .annotate(day=TruncDate('updated_at')).values('day', 'plan_id')
+            .annotate(churned=Count('pk', filter=Q(is_active=False)))
+            .annotate(count=Count('pk'))
+        )
+        for row in stopped:
+            delta = deltas[(row['day'], row['plan_id'], currency_of(row['plan_id']))]
+            delta['churned_subscriptions'] += row['churned']
+            delta['active_subscriptions'] -= row['churned']
+            delta['mrr'] -= row['count'] * pricing.get(row['plan_id'], (0,))[0]
+
+        usage = (
+            UsageBucket.objects.annotate(day=TruncDate('window_start'), plan=F('user_subscription__plan_id'))
+            .values('day', 'plan').order_by().annotate(quantity=Sum('quantity'))
+        )
+        for row in usage:
+            deltas[(row['day'], row['plan'], currency_of(row['plan']))]['credits_used'] += row['quantity']
+        UsageBucket.objects.filter(summarized_quantity__lt=F('quantity')).update(summarized_quantity=F('quantity'))
+
+        rows = []
+        running = defaultdict(lambda: defaultdict(int))
+        for (day, plan_id, currency), delta in sorted(deltas.items(), key=lambda item: item[0][0]):
+            totals = running[(plan_id, currency)]
+            for field in TOTALS:
+                totals[field] += delta.get(field, 0)
+            rows.append(DailyPlanSummary(
+                day=day, plan_id=plan_id, currency=currency,
+                **{field: delta.get(field, 0) for field in COUNTERS},
+                **{field: totals[field] for field in TOTALS},
+            ))
+        DailyPlanSummary.objects.all().delete()
+        DailyPlanSummary.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,126 @@
+"""
+Fixtures shared by the test modules: the local Stripe stand-in, a subscribed
+user, and signed webhook deliveries.
+"""
+
+import hashlib
+import hmac
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from subscriptions.models import StripeCustomer, StripePlan, UserSubscription
+from subscriptions.stripe_client import stripe
+from subscriptions.stripe_standin import StripeStandIn
+
+
+def stripe_event(event_type, data_object, created=None, event_id=None):
+    return {
+        'id': event_id or f"evt_{time.monotonic_ns()}",
+        'object': 'event',
+        'type': event_type,
+        'created': int(time.time()) if created is None else created,
+        'data': {'object': data_object},
+    }
+
+
+def post_event(client, event):
+    """
+    Delivers `event` to the webhook endpoint, signed like Stripe signs it.
+    """
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(
+        settings.STRIPE_WEBHOOK_SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256,
+    ).hexdigest()
+    return client.generic(
+        'POST', '/webhook/', payload, content_type='application/json',
+        HTTP_STRIPE_SIGNATURE=f"t={timestamp},v1={signature}",
+    )
+
+
+def subscription_object(subscription_id='sub_test', customer='cus_test', price_id='price_max', **extra):
+    now = int(time.time())
+    return {
+        'id': subscription_id,
+        'object': 'subscription',
+        'customer': customer,
+        'status': 'active',
+        'cancel_at_period_end': False,
+        'pause_collection': None,
+        'items': {'data': [{
+            'current_period_start': now,
+            'current_period_end': now + 30 * 86400,
+            'price': {'id': price_id},
+        }]},
+        **extra,
+    }
+
+
+def invoice_object(invoice_id, subscription_id='sub_test', customer='cus_test', **extra):
+    now = int(time.time())
+    return {
+        'id': invoice_id,
+        'object': 'invoice',
+        'customer': customer,
+        'amount_due': 1000,
+        'currency': 'usd',
+        'status': 'paid',
+        'billing_reason': 'subscription_cycle',
+        'parent': {'subscription_details': {'subscription': subscription_id}},
+        'lines': {'data': [{'period': {'start': now, 'end': now + 30 * 86400}}]},
+        **extra,
+    }
+
+
+class StripeTestCase(TestCase):
+    """
+    Points the Stripe SDK at a StripeStandIn for the class, and creates two
+    plans and a user subscribed to the first with 50 credits.
+    """
+    username = 'test'
+    customer_id = 'cus_test'
+    subscription_id = 'sub_test'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.standin = StripeStandIn().start()
+        cls.addClassCleanup(cls.standin.stop)
+        cls.previous_api_base = stripe.api_base
+        stripe.api_base = cls.standin.url
+        cls.addClassCleanup(setattr, stripe, 'api_base', cls.previous_api_base)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.plan = StripePlan.objects.create(
+            name='Pro', stripe_price_id='price_pro', plan_type='monthly', price='10.00', monthly_credit_allotment=100)
+        cls.other_plan = StripePlan.objects.create(
+            name='Max', stripe_price_id='price_max', plan_type='monthly', price='20.00', monthly_credit_allotment=9999)
+        cls.user = User.objects.create_user(cls.username, f"{cls.username}@example.com", 'password')
+        now = timezone.now()
+        cls.user_sub = UserSubscription.objects.create(
+            user=cls.user, plan=cls.plan, stripe_customer_id=cls.customer_id,
+            stripe_subscription_id=cls.subscription_id, status='active', is_active=True, credits=50,
+            current_period_start=now, current_period_end=now + timedelta(days=30), last_credit_refill_date=now,
+        )
+        StripeCustomer.objects.create(user=cls.user, stripe_customer_id=cls.customer_id, is_active=True)
+
+    def setUp(self):
+        cache.clear()
+        self.standin.reset()
+
+    def post_event(self, event_type, data_object, **event):
+        return post_event(self.client, stripe_event(event_type, data_object, **event))
+
+    def subscription(self, **extra):
+        return subscription_object(self.subscription_id, self.customer_id, **extra)
+
+    def invoice(self, invoice_id, **extra):
+        return invoice_object(invoice_id, self.subscription_id, self.customer_id, **extra)
@@ -0,0 +1,292 @@
+"""
+Query, write and Stripe call budgets per endpoint and webhook event.
+
+Each test drives one endpoint through the full middleware stack against the
+local Stripe stand-in and fails when it runs more SQL statements, more writes
+(INSERT, UPDATE, DELETE) or more Stripe requests than its budget. An N+1 query,
+an extra refresh_from_db() or a Stripe call on the request path then fails here
+instead of in production. When a change makes an endpoint cheaper, lower its
+budget in the same commit. Budgets only guard cost: what each mechanism does
+is tested in its own module next to this one, on the fixtures in base.py.
+
+    DJANGO_ENV=test python manage.py test subscriptions
+"""
+
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from subscriptions import outbox, reservations
+from subscriptions.models import (
+    CreditReservation, Invoice, OpenCheckoutSession, StripeOutboxEntry, StripePlan, UserSubscription,
+)
+
+from .base import StripeTestCase
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class BudgetTestCase(StripeTestCase):
+    username = 'budget'
+    customer_id = 'cus_budget'
+    subscription_id = 'sub_budget'
+
+    @contextmanager
+    def assertBudget(self, queries, writes=0, stripe_calls=0):
+        """
+        Fails if the block runs more than `queries` SQL statements, of which
+        more than `writes` modify rows, or makes more than `stripe_calls`
+        requests to Stripe.
+        """
+        calls_before = len(self.standin.calls)
+        with CaptureQueriesContext(connection) as captured:
+            yield
+        statements = [query['sql'] for query in captured.captured_queries]
+        written = [sql for sql in statements if sql.lstrip().split(None, 1)[0].upper() in WRITE_STATEMENTS]
+        calls = self.standin.calls[calls_before:]
+
+        listing = '\n'.join(f"  {number}. {sql}" for number, sql in enumerate(statements, 1))
+        self.assertLessEqual(len(statements), queries, f"{len(statements)} queries, budget {queries}:\n{listing}")
+        self.assertLessEqual(len(written), writes, f"{len(written)} writes, budget {writes}:\n{listing}")
+        self.assertLessEqual(len(calls), stripe_calls, f"{len(calls)} Stripe calls, budget {stripe_calls}: {calls}")
+
+
+class SignedInBudgetTestCase(BudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+
+class DashboardBudgetTests(SignedInBudgetTestCase):
+    def test_get(self):
+        with self.assertBudget(queries=6):
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_use_credits(self):
+        with self.assertBudget(queries=13, writes=3):
+            response = self.client.post('/', {'credits': '5'})
+        self.assertEqual(response.status_code, 302)
+        self.user_sub.refresh_from_db()
+        self.assertEqual(self.user_sub.credits, 45)
+
+
+class SubscribePageBudgetTests(SignedInBudgetTestCase):
+    def test_first_visit(self):
+        with self.assertBudget(queries=5):
+            response = self.client.get('/subscribe/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_plan_list(self):
+        self.client.get('/subscribe/')
+        with self.assertBudget(queries=3):
+            response = self.client.get('/subscribe/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_repeat_visit_not_modified(self):
+        self.client.get('/subscribe/')  # Sets the CSRF cookie, which is part of the ETag
+        etag = self.client.get('/subscribe/')['ETag']
+        with self.assertBudget(queries=3):
+            response = self.client.get('/subscribe/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class CheckoutBudgetTests(SignedInBudgetTestCase):
+    def test_new_session(self):
+        with self.assertBudget(queries=13, writes=1, stripe_calls=1):
+            response = self.client.post('/create-checkout-session/', {'price_id': 'price_max'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(OpenCheckoutSession.objects.filter(user=self.user).exists())
+
+    def test_repeat_click_reuses_session(self):
+        self.client.post('/create-checkout-session/', {'price_id': 'price_max'})
+        with self.assertBudget(queries=6, stripe_calls=0):
+            response = self.client.post('/create-checkout-session/', {'price_id': 'price_max'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_unknown_plan(self):
+        with self.assertBudget(queries=4, stripe_calls=0):
+            response = self.client.post('/create-checkout-session/', {'price_id': 'price_unknown'})
+        self.assertRedirects(response, '/subscribe/', fetch_redirect_response=False)
+
+
+class UserActionBudgetTests(SignedInBudgetTestCase):
+    """
+    Pause, resume and cancel never call Stripe on the request path; the outbox
+    sends the change after the response.
+    """
+
+    def test_pause(self):
+        with self.assertBudget(queries=10, writes=3, stripe_calls=0):
+            response = self.client.post('/pause-subscription/')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(StripeOutboxEntry.objects.filter(action='pause').exists())
+
+    def test_resume(self):
+        UserSubscription.objects.filter(pk=self.user_sub.pk).update(is_paused=True, status='paused')
+        with self.assertBudget(queries=10, writes=3, stripe_calls=0):
+            response = self.client.post('/resume-subscription/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_cancel_at_period_end(self):
+        with self.assertBudget(queries=8, writes=2, stripe_calls=0):
+            response = self.client.post('/cancel-at-period-end/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_outbox_dispatch(self):
+        self.client.post('/pause-subscription/')
+        # Claim and outcome are two short transactions around the Stripe call.
+        with self.assertBudget(queries=7, writes=2, stripe_calls=1):
+            sent = outbox.dispatch_due()
+        self.assertEqual(sent, 1)
+
+
+class ReservationBudgetTests(BudgetTestCase):
+    """
+    Reserving and settling each write the contended row with one conditional
+    UPDATE and never read it with a lock.
+    """
+
+    def test_reserve(self):
+        with self.assertBudget(queries=5, writes=2):
+            reservation = reservations.reserve(self.user_sub, 30)
+        self.assertEqual(reservation.status, CreditReservation.HELD)
+        self.assertEqual(self.user_sub.credits, 20)
+
+    def test_reserve_more_than_balance(self):
+        with self.assertBudget(queries=6, writes=2):
+            reservation = reservations.reserve(self.user_sub, 80)
+        self.assertIsNone(reservation)
+        self.assertEqual(self.user_sub.credits, 50)
+        self.assertFalse(CreditReservation.objects.exists())
+
+    def test_commit(self):
+        reservation = reservations.reserve(self.user_sub, 30)
+        with self.assertBudget(queries=7, writes=3):
+            self.assertTrue(reservations.commit(reservation))
+        self.assertFalse(reservations.commit(reservation))
+        self.user_sub.refresh_from_db()
+        self.assertEqual(self.user_sub.credits, 20)
+
+    def test_commit_part(self):
+        reservation = reservations.reserve(self.user_sub, 30)
+        with self.assertBudget(queries=9, writes=4):
+            self.assertTrue(reservations.commit(reservation, 10))
+        self.user_sub.refresh_from_db()
+        self.assertEqual(self.user_sub.credits, 40)
+        self.assertEqual(self.user_sub.usage_buckets.get().quantity, 10)
+
+    def test_release(self):
+        reservation = reservations.reserve(self.user_sub, 30)
+        with self.assertBudget(queries=5, writes=2):
+            self.assertTrue(reservations.release(reservation))
+        self.assertFalse(reservations.commit(reservation))
+        self.user_sub.refresh_from_db()
+        self.assertEqual(self.user_sub.credits, 50)
+
+    def test_release_expired(self):
+        held = [reservations.reserve(self.user_sub, 10) for _ in range(3)]
+        CreditReservation.objects.filter(pk__in=[reservation.pk for reservation in held[:2]]).update(
+            expires_at=timezone.now() - timedelta(seconds=1))
+        # One UPDATE for the reservations and one for the balances, however many expired.
+        with self.assertBudget(queries=6, writes=2):
+            self.assertEqual(reservations.release_expired(), 2)
+        self.assertFalse(reservations.commit(held[0]))
+        self.assertTrue(reservations.commit(held[2]))
+        self.user_sub.refresh_from_db()
+        self.assertEqual(self.user_sub.credits, 40)
+
+
+class WebhookBudgetTests(BudgetTestCase):
+    def test_checkout_completed_subscription(self):
+        session = {
+            'id': 'cs_budget', 'object': 'checkout.session', 'mode': 'subscription',
+            'customer': 'cus_budget', 'subscription': 'sub_new',
+            'metadata': {'user_id': str(self.user.pk), 'plan_id': str(self.other_plan.pk),
+                         'old_subscription_id': 'sub_budget'},
+        }
+        with self.assertBudget(queries=15, writes=4, stripe_calls=2):
+            response = self.post_event('checkout.session.completed', session)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UserSubscription.objects.get(user=self.user).stripe_subscription_id, 'sub_new')
+
+    def test_checkout_completed_setup(self):
+        session = {
+            'id': 'cs_setup', 'object': 'checkout.session', 'mode': 'setup',
+            'customer': 'cus_budget', 'setup_intent': 'seti_budget',
+            'metadata': {'user_id': str(self.user.pk)},
+        }
+        with self.assertBudget(queries=5, writes=1, stripe_calls=3):
+            response = self.post_event('checkout.session.completed', session)
+        self.assertEqual(response.status_code, 200)
+
+    def test_checkout_expired(self):
+        with self.assertBudget(queries=3, writes=1):
+            response = self.post_event('checkout.session.expired', {'id': 'cs_expired', 'object': 'checkout.session'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_invoice_payment_succeeded(self):
+        with self.assertBudget(queries=8, writes=3):
+            response = self.post_event('invoice.payment_succeeded', self.invoice('in_paid'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Invoice.objects.filter(stripe_invoice_id='in_paid', is_successful_payment=True).exists())
+
+    def test_invoice_payment_succeeded_duplicate(self):
+        self.post_event('invoice.payment_succeeded', self.invoice('in_paid'))
+        with self.assertBudget(queries=3):
+            response = self.post_event('invoice.payment_succeeded', self.invoice('in_paid'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_invoice_payment_failed(self):
+        with self.assertBudget(queries=10, writes=4):
+            response = self.post_event('invoice.payment_failed', self.invoice('in_failed', status='open'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Invoice.objects.filter(stripe_invoice_id='in_failed', is_successful_payment=False).exists())
+
+    def test_subscription_updated(self):
+        with self.assertBudget(queries=10, writes=2):
+            response = self.post_event('customer.subscription.updated', self.subscription())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UserSubscription.objects.get(pk=self.user_sub.pk).plan, self.other_plan)
+
+    def test_subscription_deleted(self):
+        now = timezone.now()
+        for number in range(3):
+            Invoice.objects.create(
+                user=self.user, user_subscription_id='sub_budget', stripe_invoice_id=f"in_open_{number}",
+                amount_due=10, status='open', period_start=now, period_end=now + timedelta(days=30),
+            )
+        # Each open invoice is voided in Stripe and updated locally.
+        with self.assertBudget(queries=10, writes=5, stripe_calls=3):
+            response = self.post_event('customer.subscription.deleted', self.subscription(status='canceled'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Invoice.objects.filter(status='open').exists())
+
+    def test_price_updated(self):
+        self.standin.objects[('prices', 'price_max')] = {
+            'id': 'price_max', 'object': 'price', 'active': True, 'currency': 'usd', 'unit_amount': 2500,
+            'nickname': None, 'metadata': {}, 'recurring': {'interval': 'month', 'interval_count': 1},
+            'product': {'id': 'prod_max', 'object': 'product', 'name': 'Max', 'active': True,
+                        'metadata': {'credits': '9999'}},
+        }
+        # One upsert, however many plans the catalog has.
+        with self.assertBudget(queries=3, writes=1, stripe_calls=1):
+            response = self.post_event('price.updated', {'id': 'price_max', 'object': 'price', 'product': 'prod_max'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StripePlan.objects.get(stripe_price_id='price_max').price, 25)
+
+    @override_settings(STRIPE_WEBHOOK_QUEUE=True)
+    def test_queued_event(self):
+        # The request only stores the event; the webhook workers apply it.
+        with self.assertBudget(queries=4, writes=1):
+            response = self.post_event('customer.subscription.updated', self.subscription())
+        self.assertEqual(response.status_code, 200)
+
+    def test_unhandled_event(self):
+        with self.assertBudget(queries=2):
+            response = self.post_event('customer.created', {'id': 'cus_other', 'object': 'customer'})
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,135 @@
+"""
+Syncing the plan catalog from Stripe prices: conflicts with existing plans,
+credits from metadata, and the price.* webhooks.
+"""
+
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+
+from subscriptions import catalog
+from subscriptions.models import StripePlan, StripeWebhookEvent, UserSubscription
+from subscriptions.stripe_client import stripe
+from subscriptions.webhook_queue import WebhookWorker
+
+from .base import StripeTestCase
+
+
+def price_object(price_id, unit_amount=1000, interval='month', product_metadata=None, **extra):
+    return {
+        'id': price_id,
+        'object': 'price',
+        'created': int(time.time()),
+        'active': True,
+        'currency': 'usd',
+        'unit_amount': unit_amount,
+        'recurring': {'interval': interval, 'interval_count': 1} if interval else None,
+        'metadata': {},
+        'product': {'id': f"prod_{price_id}", 'object': 'product', 'name': f"Product {price_id}",
+                    'active': True, 'metadata': product_metadata or {}},
+        **extra,
+    }
+
+
+class CatalogSyncTests(StripeTestCase):
+    def in_stripe(self, *prices):
+        for price in prices:
+            self.standin.objects[('prices', price['id'])] = price
+            self.addCleanup(self.standin.objects.pop, ('prices', price['id']), None)
+
+    def test_existing_plan_is_updated_in_place(self):
+        self.assertEqual(catalog.sync_prices([price_object('price_pro', 1500, nickname='Pro 2')]), (1, 0))
+        plan = StripePlan.objects.get(stripe_price_id='price_pro')
+        self.assertEqual((plan.pk, plan.name, plan.price), (self.plan.pk, 'Pro 2', Decimal('15.00')))
+        # No credits metadata: the allotment set by hand stays.
+        self.assertEqual(plan.monthly_credit_allotment, 100)
+
+    def test_credits_metadata_of_price_wins_over_product(self):
+        catalog.sync_prices([
+            price_object('price_pro', product_metadata={'credits': '250'}),
+            price_object('price_max', product_metadata={'credits': '250'}, metadata={'credits': '500'}),
+            price_object('price_new'),
+        ])
+        allotments = dict(StripePlan.objects.values_list('stripe_price_id', 'monthly_credit_allotment'))
+        self.assertEqual((allotments['price_pro'], allotments['price_max'], allotments['price_new']), (250, 500, 0))
+
+    def test_prices_that_are_not_plans_are_skipped(self):
+        synced = catalog.sync_prices([
+            price_object('price_tiered', unit_amount=None),
+            price_object('price_weekly', interval='week'),
+            price_object('price_lifetime', interval=None),
+        ])
+        self.assertEqual(synced, (1, 2))
+        self.assertEqual(StripePlan.objects.get(stripe_price_id='price_lifetime').plan_type, 'lifetime')
+
+    def test_sync_moves_catalog_version(self):
+        before = catalog.plans_last_modified()
+        catalog.sync_prices([price_object('price_pro', 1500)])
+        self.assertGreater(catalog.plans_last_modified(), before)
+
+    def test_out_of_order_price_event_reads_current_price(self):
+        self.in_stripe(price_object('price_pro', 2500))
+        # The event carries an older state of the price than Stripe's.
+        stale = price_object('price_pro', 1200)
+        stale['product'] = stale['product']['id']
+        self.post_event('price.updated', stale)
+        self.assertEqual(StripePlan.objects.get(stripe_price_id='price_pro').price, Decimal('25.00'))
+        self.assertEqual(self.standin.count('GET', '/v1/prices/price_pro'), 1)
+
+    def retrieve_outside_transactions(self):
+        """
+        Patches Price.retrieve to record how many transactions were open around each call.
+        """
+        depth = len(connection.atomic_blocks)
+        retrieve = stripe.Price.retrieve
+        self.open_transactions = []
+
+        def recording(*args, **kwargs):
+            self.open_transactions.append(len(connection.atomic_blocks) - depth)
+            return retrieve(*args, **kwargs)
+
+        return mock.patch.object(stripe.Price, 'retrieve', side_effect=recording)
+
+    def test_price_is_read_before_the_handler_transaction(self):
+        self.in_stripe(price_object('price_pro', 2500))
+        with self.retrieve_outside_transactions():
+            self.post_event('price.updated', {'id': 'price_pro', 'object': 'price'})
+        self.assertEqual(self.open_transactions, [0])
+        self.assertEqual(StripePlan.objects.get(stripe_price_id='price_pro').price, Decimal('25.00'))
+
+    @override_settings(STRIPE_WEBHOOK_QUEUE=True)
+    def test_queued_price_is_read_before_the_worker_transaction(self):
+        self.in_stripe(price_object('price_pro', 2500))
+        self.post_event('price.updated', {'id': 'price_pro', 'object': 'price'})
+        with self.retrieve_outside_transactions():
+            WebhookWorker('test').run_once()
+        self.assertEqual(self.open_transactions, [0])
+        self.assertEqual(StripePlan.objects.get(stripe_price_id='price_pro').price, Decimal('25.00'))
+
+    @override_settings(STRIPE_WEBHOOK_QUEUE=True)
+    def test_failed_read_is_retried(self):
+        self.post_event('price.updated', {'id': 'price_pro', 'object': 'price'})
+        with mock.patch.object(stripe.Price, 'retrieve', side_effect=stripe.error.APIConnectionError("Timeout")):
+            WebhookWorker('test').run_once()
+        queued = StripeWebhookEvent.objects.get()
+        self.assertEqual((queued.status, queued.attempts), (StripeWebhookEvent.PENDING, 1))
+        self.assertIn("Timeout", queued.last_error)
+        self.assertEqual(StripePlan.objects.get(stripe_price_id='price_pro').price, Decimal('10.00'))
+
+    def test_deleted_price_stops_being_offered(self):
+        self.post_event('price.deleted', {'id': 'price_pro', 'object': 'price'})
+        self.assertFalse(StripePlan.objects.get(stripe_price_id='price_pro').is_active)
+        self.assertEqual(UserSubscription.objects.get(pk=self.user_sub.pk).plan, self.plan)
+
+    def test_command_deactivates_plans_missing_from_stripe(self):
+        self.in_stripe(price_object('price_max', 2000))
+        stdout = StringIO()
+        call_command('sync_stripe_prices', deactivate_missing=True, stdout=stdout)
+        self.assertIn("Deactivated 1 plans missing from Stripe", stdout.getvalue())
+        active = dict(StripePlan.objects.values_list('stripe_price_id', 'is_active'))
+        self.assertEqual(active, {'price_pro': False, 'price_max': True})
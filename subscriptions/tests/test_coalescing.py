@@ -0,0 +1,62 @@
+"""
+Bursts of customer.subscription.updated events are merged by the webhook
+queue: only the newest queued update for a subscription is written.
+"""
+
+import time
+
+from django.test import override_settings
+
+from subscriptions.models import StripeWebhookEvent, UserSubscription
+from subscriptions.webhook_queue import WebhookWorker
+
+from .base import StripeTestCase
+
+
+@override_settings(STRIPE_WEBHOOK_QUEUE=True)
+class SubscriptionUpdateCoalescingTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = int(time.time())
+
+    def update(self, seconds, event_id, **extra):
+        self.post_event('customer.subscription.updated', self.subscription(**extra),
+                        created=self.now + seconds, event_id=event_id)
+
+    def statuses(self):
+        return dict(StripeWebhookEvent.objects.values_list('stripe_event_id', 'status'))
+
+    def test_burst_is_written_once(self):
+        self.update(0, 'evt_1', price_id='price_pro', cancel_at_period_end=True)
+        self.update(1, 'evt_2', price_id='price_pro', status='past_due')
+        self.update(2, 'evt_3', price_id='price_max')
+        WebhookWorker('test').run_once()
+
+        self.assertEqual(self.statuses(), {
+            'evt_1': StripeWebhookEvent.SUPERSEDED,
+            'evt_2': StripeWebhookEvent.SUPERSEDED,
+            'evt_3': StripeWebhookEvent.PROCESSED,
+        })
+        user_sub = UserSubscription.objects.get(pk=self.user_sub.pk)
+        self.assertEqual((user_sub.plan, user_sub.status), (self.other_plan, 'active'))
+        self.assertFalse(user_sub.cancel_at_period_end_stripe)
+
+    def test_other_subscriptions_are_not_merged(self):
+        self.update(0, 'evt_mine', price_id='price_max')
+        self.post_event('customer.subscription.updated',
+                        self.subscription(id='sub_other', price_id='price_pro'),
+                        created=self.now + 1, event_id='evt_other')
+        WebhookWorker('test').run_once()
+
+        self.assertEqual(self.statuses()['evt_mine'], StripeWebhookEvent.PROCESSED)
+        self.assertEqual(UserSubscription.objects.get(pk=self.user_sub.pk).plan, self.other_plan)
+
+    def test_late_older_update_is_discarded(self):
+        self.update(5, 'evt_new', price_id='price_max')
+        WebhookWorker('test').run_once()
+        self.update(0, 'evt_old', price_id='price_pro', status='past_due')
+        WebhookWorker('test').run_once()
+
+        self.assertEqual(self.statuses()['evt_old'], StripeWebhookEvent.PROCESSED)
+        user_sub = UserSubscription.objects.get(pk=self.user_sub.pk)
+        self.assertEqual((user_sub.plan, user_sub.status), (self.other_plan, 'active'))
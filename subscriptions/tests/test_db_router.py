@@ -0,0 +1,104 @@
+"""
+Read replica routing: which reads may go to a replica, and how a request's
+writes pin the browser to the primary.
+"""
+
+import time
+from unittest import mock
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.test import SimpleTestCase, TransactionTestCase
+
+from subscriptions import db_router
+from subscriptions.middleware import ReplicaRoutingMiddleware
+from subscriptions.models import StripePlan
+
+from .base import StripeTestCase
+
+
+class ReplicaMixin:
+    """
+    Pretends a replica1 database is configured, with the given health. No query
+    ever reaches it: reads routed there are only inspected, never run.
+    """
+
+    def use_replica(self, healthy):
+        patcher = mock.patch.object(db_router, 'replica_aliases', return_value=['replica1'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db_router._replica_health['replica1'] = (time.monotonic(), healthy)
+        self.addCleanup(db_router._replica_health.pop, 'replica1', None)
+
+
+class ReplicaRouterTests(ReplicaMixin, TransactionTestCase):
+    def setUp(self):
+        self.router = db_router.ReplicaRouter()
+        self.use_replica(healthy=True)
+
+    def read_alias(self):
+        return self.router.db_for_read(StripePlan)
+
+    def test_reads_go_to_healthy_replica(self):
+        self.assertEqual(self.read_alias(), 'replica1')
+        self.assertEqual(self.router.db_for_write(StripePlan), DEFAULT_DB_ALIAS)
+
+    def test_lagging_replica_gets_no_reads(self):
+        db_router._replica_health['replica1'] = (time.monotonic(), False)
+        self.assertEqual(self.read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_unreachable_replica_is_unhealthy(self):
+        del db_router._replica_health['replica1']
+        # replica1 is not a real connection, so the lag check fails.
+        with self.assertLogs('subscriptions.db_router', 'WARNING'):
+            self.assertEqual(self.read_alias(), DEFAULT_DB_ALIAS)
+        # The answer is cached, without another check.
+        self.assertEqual(self.read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_use_primary(self):
+        with db_router.use_primary():
+            self.assertEqual(self.read_alias(), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.read_alias(), 'replica1')
+
+    def test_reads_in_transaction_stay_on_primary(self):
+        with transaction.atomic():
+            self.assertEqual(self.read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_pinned_request(self):
+        with db_router.request_scope(pin=True):
+            self.assertEqual(self.read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_write_pins_rest_of_request(self):
+        with db_router.request_scope(pin=False) as routing:
+            self.assertEqual(self.read_alias(), 'replica1')
+            StripePlan.objects.create(name='Pro', stripe_price_id='price_pro', plan_type='monthly', price='10.00')
+            self.assertEqual(self.read_alias(), DEFAULT_DB_ALIAS)
+        self.assertTrue(routing['wrote'])
+        self.assertEqual(self.read_alias(), 'replica1')
+
+    def test_migrations_skip_replicas(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'subscriptions'))
+        self.assertTrue(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'subscriptions'))
+
+
+class ReplicaRoutingMiddlewareTests(ReplicaMixin, StripeTestCase):
+    def setUp(self):
+        super().setUp()
+        # Reads stay on the primary, which the test runs on; only the pinning is under test.
+        self.use_replica(healthy=False)
+        self.client.force_login(self.user)
+
+    def test_write_sets_pin_cookie(self):
+        response = self.client.post('/pause-subscription/')
+        self.assertIn(ReplicaRoutingMiddleware.PIN_COOKIE, response.cookies)
+
+    def test_read_only_request_sets_no_cookie(self):
+        response = self.client.get('/subscribe/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(ReplicaRoutingMiddleware.PIN_COOKIE, response.cookies)
+
+
+class ReplicaRoutingDisabledTests(SimpleTestCase):
+    def test_middleware_unused_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(lambda request: None)
@@ -0,0 +1,85 @@
+"""
+DirtyFieldsMixin: save() writes only the changed columns, and instances
+refreshed by the conditional updates in subscriptions.locking stay clean.
+"""
+
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from subscriptions import locking
+from subscriptions.models import SummaryChange, UserSubscription
+
+from .base import StripeTestCase
+
+
+class DirtyFieldsTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sub = UserSubscription.objects.get(pk=self.user_sub.pk)
+
+    def save(self, **kwargs):
+        with CaptureQueriesContext(connection) as captured:
+            self.sub.save(**kwargs)
+        return [query['sql'] for query in captured.captured_queries]
+
+    def test_only_changed_columns_are_written(self):
+        self.sub.credits = 40
+        self.assertEqual(self.sub.get_dirty_fields(), ['credits'])
+        [update] = self.save()
+        self.assertIn('"credits"', update)
+        self.assertIn('"updated_at"', update)
+        self.assertNotIn('"status"', update)
+
+    def test_clean_save_is_skipped(self):
+        receiver = mock.Mock()
+        post_save.connect(receiver, sender=UserSubscription)
+        self.addCleanup(post_save.disconnect, receiver, sender=UserSubscription)
+        self.assertEqual(self.save(), [])
+        receiver.assert_not_called()
+
+    def test_snapshot_follows_save(self):
+        self.sub.credits = 40
+        self.save()
+        self.assertEqual(self.sub.get_dirty_fields(), [])
+        self.assertEqual(self.save(), [])
+
+    def test_snapshot_follows_refresh(self):
+        UserSubscription.objects.filter(pk=self.sub.pk).update(credits=10)
+        self.sub.refresh_from_db(fields=['credits'])
+        self.assertEqual(self.sub.get_dirty_fields(), [])
+
+    def test_explicit_update_fields_are_respected(self):
+        self.sub.credits = 40
+        self.sub.status = 'past_due'
+        [update] = self.save(update_fields=['status'])
+        self.assertNotIn('"credits"', update)
+        self.assertEqual(self.sub.get_dirty_fields(), ['credits'])
+
+
+class RefreshedSubscriptionTests(StripeTestCase):
+    def test_expired_subscription_saves_only_new_changes(self):
+        UserSubscription.objects.filter(pk=self.user_sub.pk).update(
+            current_period_end=timezone.now() - timedelta(days=1))
+        sub = UserSubscription.objects.get(pk=self.user_sub.pk)
+        SummaryChange.objects.all().delete()
+
+        self.assertTrue(locking.expire_if_period_ended(sub))
+        sub.cancel_at_period_end_stripe = True
+        self.assertEqual(sub.get_dirty_fields(), ['cancel_at_period_end_stripe'])
+        sub.save()
+        self.assertEqual(list(SummaryChange.objects.values_list('churned_subscriptions', flat=True)), [1])
+
+    def test_save_after_debit_keeps_concurrent_debit(self):
+        sub = UserSubscription.objects.get(pk=self.user_sub.pk)
+        self.assertTrue(locking.debit_credits(sub, 10))
+        # Another request debits in between.
+        UserSubscription.objects.filter(pk=sub.pk).update(credits=F('credits') - 5)
+        sub.cancel_at_period_end_stripe = True
+        sub.save()
+        self.assertEqual(UserSubscription.objects.get(pk=sub.pk).credits, 35)
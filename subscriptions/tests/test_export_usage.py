@@ -0,0 +1,92 @@
+"""
+export_usage without a meter, pruning of buckets that are never reported, and
+claiming reports before sending them to Stripe.
+"""
+
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+
+from subscriptions import usage
+from subscriptions.models import UsageBucket, UsageReport, UserSubscription
+from subscriptions.stripe_client import stripe
+
+from .base import StripeTestCase
+
+
+class ExportUsageTests(StripeTestCase):
+    def bucket(self, days_ago, reported=0):
+        return UsageBucket.objects.create(
+            user_subscription=self.user_sub, window_start=timezone.now() - timedelta(days=days_ago),
+            quantity=5, reported_quantity=reported, summarized_quantity=5)
+
+    def export(self):
+        stderr = StringIO()
+        call_command('export_usage', verbosity=0, stderr=stderr)
+        return stderr.getvalue()
+
+    @override_settings(STRIPE_USAGE_METER_EVENT='')
+    def test_without_meter_only_prunes(self):
+        self.bucket(40)
+        recent = self.bucket(1)
+        self.assertIn("STRIPE_USAGE_METER_EVENT is not set", self.export())
+        self.assertEqual(list(UsageBucket.objects.all()), [recent])
+        self.assertEqual(self.standin.count('POST'), 0)
+
+    @override_settings(STRIPE_USAGE_METER_EVENT='credits')
+    def test_buckets_without_customer_are_pruned_unreported(self):
+        UserSubscription.objects.filter(pk=self.user_sub.pk).update(stripe_customer_id='')
+        self.bucket(40)
+        recent = self.bucket(1)
+        self.export()
+        self.assertEqual(list(UsageBucket.objects.all()), [recent])
+        self.assertEqual(self.standin.count('POST'), 0)
+
+
+class SendUsageTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.report = UsageReport.objects.create(
+            stripe_customer_id=self.customer_id, event_name='credits', quantity=7,
+            timestamp=timezone.now(), identifier='usage-test')
+
+    def refresh(self):
+        self.report.refresh_from_db()
+        return self.report
+
+    def test_report_is_sent_once(self):
+        self.assertEqual(usage.send_due(), 1)
+        self.assertEqual(usage.send_due(), 0)
+        report = self.refresh()
+        self.assertEqual((report.status, report.attempts), (UsageReport.SENT, 1))
+        self.assertEqual(self.standin.count('POST', '/v1/billing/meter_events'), 1)
+
+    def test_transient_failure_backs_off(self):
+        with mock.patch.object(stripe.billing.MeterEvent, 'create',
+                               side_effect=stripe.error.APIConnectionError("Connection reset")):
+            self.assertEqual(usage.send_due(), 0)
+        report = self.refresh()
+        self.assertEqual((report.status, report.attempts), (UsageReport.PENDING, 1))
+        self.assertGreater(report.next_attempt_at, timezone.now())
+        self.assertIn("Connection reset", report.last_error)
+
+    def test_claimed_report_is_not_sent_again(self):
+        self.assertIsNotNone(usage._claim(self.report.pk))
+        # A second exporter while the first one is calling Stripe
+        self.assertEqual(usage.send_due(), 0)
+        self.assertEqual(self.standin.count('POST'), 0)
+
+    def test_stale_outcome_is_ignored(self):
+        stale = usage._claim(self.report.pk)
+        # The first exporter died mid-call; its claim runs out.
+        UsageReport.objects.filter(pk=self.report.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(usage.send_due(), 1)
+        with mock.patch.object(stripe.billing.MeterEvent, 'create',
+                               side_effect=stripe.error.InvalidRequestError("Late failure", None)):
+            usage._send(stale)
+        report = self.refresh()
+        self.assertEqual((report.status, report.attempts), (UsageReport.SENT, 2))
@@ -0,0 +1,102 @@
+"""
+The outbox for pause, resume and cancel: claims, confirmation by the webhook,
+reverting rejected changes, backoff and per-subscription order.
+"""
+
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.utils import timezone
+
+from subscriptions import outbox
+from subscriptions.models import StripeOutboxEntry, UserSubscription
+from subscriptions.stripe_client import stripe
+
+from .base import StripeTestCase
+
+
+class OutboxTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def click(self, path):
+        self.client.post(path)
+        return StripeOutboxEntry.objects.latest('pk')
+
+    def refresh(self, entry):
+        entry.refresh_from_db()
+        return entry
+
+    def test_sent_then_confirmed_by_webhook(self):
+        entry = self.click('/pause-subscription/')
+        self.assertEqual(outbox.dispatch_due(), 1)
+        self.assertEqual(self.refresh(entry).status, StripeOutboxEntry.SENT)
+        self.assertEqual(self.standin.count('POST', '/v1/subscriptions/sub_test'), 1)
+
+        self.post_event('customer.subscription.updated',
+                        self.subscription(price_id='price_pro', pause_collection={'behavior': 'mark_uncollectible'}),
+                        created=int(time.time()) + 1)
+        self.assertEqual(self.refresh(entry).status, StripeOutboxEntry.CONFIRMED)
+        self.assertTrue(UserSubscription.objects.get(pk=self.user_sub.pk).is_paused)
+
+    def test_rejected_change_is_reverted(self):
+        entry = self.click('/pause-subscription/')
+        self.assertTrue(UserSubscription.objects.get(pk=self.user_sub.pk).is_paused)
+        with mock.patch.object(stripe.Subscription, 'modify',
+                               side_effect=stripe.error.InvalidRequestError("No such subscription", None)):
+            self.assertEqual(outbox.dispatch_due(), 0)
+        self.assertEqual(self.refresh(entry).status, StripeOutboxEntry.FAILED)
+        user_sub = UserSubscription.objects.get(pk=self.user_sub.pk)
+        self.assertFalse(user_sub.is_paused)
+        self.assertEqual(user_sub.status, 'active')
+
+    def test_transient_failure_backs_off(self):
+        entry = self.click('/pause-subscription/')
+        with mock.patch.object(stripe.Subscription, 'modify',
+                               side_effect=stripe.error.APIConnectionError("Connection reset")) as modify:
+            self.assertEqual(outbox.dispatch_due(), 0)
+            self.assertEqual(outbox.dispatch_due(), 0)
+        self.assertEqual(modify.call_count, 1)
+        entry = self.refresh(entry)
+        self.assertEqual((entry.status, entry.attempts), (StripeOutboxEntry.PENDING, 1))
+        self.assertGreater(entry.next_attempt_at, timezone.now())
+        self.assertIn("Connection reset", entry.last_error)
+
+    def test_later_change_waits_for_earlier_one(self):
+        self.click('/pause-subscription/')
+        resume = self.click('/resume-subscription/')
+        with mock.patch.object(stripe.Subscription, 'modify',
+                               side_effect=stripe.error.APIConnectionError("Connection reset")) as modify:
+            outbox.dispatch_due()
+        self.assertEqual(modify.call_count, 1)
+        self.assertEqual(self.refresh(resume).attempts, 0)
+
+    def test_claimed_entry_is_not_sent_again(self):
+        entry = self.click('/pause-subscription/')
+        claimed = outbox._claim(entry.pk, set())
+        self.assertIsNotNone(claimed)
+        # A second dispatcher while the first one is calling Stripe
+        self.assertEqual(outbox.dispatch_due(), 0)
+        self.assertEqual(self.standin.count('POST'), 0)
+
+    def test_outcome_does_not_overwrite_webhook_confirmation(self):
+        entry = self.click('/pause-subscription/')
+        claimed = outbox._claim(entry.pk, set())
+        StripeOutboxEntry.objects.filter(pk=entry.pk).update(status=StripeOutboxEntry.CONFIRMED)
+        self.assertTrue(outbox._send(claimed))
+        self.assertEqual(self.refresh(entry).status, StripeOutboxEntry.CONFIRMED)
+
+    def test_expired_claim_is_retried_and_stale_outcome_ignored(self):
+        entry = self.click('/pause-subscription/')
+        stale = outbox._claim(entry.pk, set())
+        # The first dispatcher died mid-call; its claim runs out.
+        StripeOutboxEntry.objects.filter(pk=entry.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.dispatch_due(), 1)
+        with mock.patch.object(stripe.Subscription, 'modify',
+                               side_effect=stripe.error.InvalidRequestError("Late failure", None)):
+            outbox._send(stale)
+        entry = self.refresh(entry)
+        self.assertEqual((entry.status, entry.attempts), (StripeOutboxEntry.SENT, 2))
+        self.assertTrue(UserSubscription.objects.get(pk=self.user_sub.pk).is_paused)
@@ -0,0 +1,159 @@
+"""
+replay_webhooks: holding replayed events until all are stored, order per
+customer across Stripe's newest-first pages, skipping stored events, and when
+the replay's workers stop.
+"""
+
+import os
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.utils import timezone
+
+from subscriptions import webhook_queue
+from subscriptions.management.commands import replay_webhooks
+from subscriptions.models import StripeWebhookEvent
+from subscriptions.webhook_queue import WebhookWorker
+
+from .base import StripeTestCase, stripe_event
+
+ARCHIVE = os.path.join(os.path.dirname(__file__), 'fixtures', 'replay_archive.jsonl')
+
+
+class ReplayWebhooksTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.applied = []
+        patcher = mock.patch('subscriptions.views.process_stripe_event', side_effect=self.process)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def process(self, event, stripe_data=None):
+        self.applied.append((webhook_queue.ordering_key(event), event['created'], event['id']))
+        return HttpResponse(status=200)
+
+    def replay(self, **options):
+        stdout = StringIO()
+        call_command('replay_webhooks', queue_only=True, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def apply_all(self):
+        worker = WebhookWorker('test')
+        while worker.run_once():
+            pass
+
+    def in_stripe(self, events):
+        for event in events:
+            self.standin.objects[('events', event['id'])] = event
+            self.addCleanup(self.standin.objects.pop, ('events', event['id']), None)
+
+    def test_events_are_held_until_all_are_stored(self):
+        enqueue_many = webhook_queue.enqueue_many
+        now = timezone.now()
+
+        def enqueue_and_check(events, available_at=None):
+            stored = enqueue_many(events, available_at)
+            held = StripeWebhookEvent.objects.filter(stripe_event_id__in=[event['id'] for event in events])
+            self.assertTrue(all(queued.next_attempt_at >= now + replay_webhooks.REPLAY_HOLD
+                                for queued in held))
+            # A live delivery arrives during the replay and fails: its backoff is its own.
+            webhook_queue.enqueue(stripe_event('invoice.paid', {'id': 'in_live', 'customer': 'cus_live'},
+                                               event_id='evt_live'))
+            StripeWebhookEvent.objects.filter(stripe_event_id='evt_live').update(
+                next_attempt_at=timezone.now() + timedelta(minutes=10))
+            return stored
+
+        with mock.patch.object(replay_webhooks, 'enqueue_many', side_effect=enqueue_and_check):
+            output = self.replay(archive=ARCHIVE)
+        self.assertIn("Read 3 events", output)
+
+        replayed = StripeWebhookEvent.objects.exclude(stripe_event_id='evt_live')
+        self.assertEqual(replayed.count(), 3)
+        self.assertFalse(replayed.filter(next_attempt_at__gt=timezone.now()).exists())
+        live = StripeWebhookEvent.objects.get(stripe_event_id='evt_live')
+        self.assertGreater(live.next_attempt_at, timezone.now() + timedelta(minutes=9))
+        self.assertEqual(StripeWebhookEvent.objects.get(stripe_event_id='evt_archive_2').payload['data']['object']['name'],
+                         "Zoë Łukasiewicz")
+
+    def test_stripe_pages_apply_in_order_per_customer(self):
+        start = int(time.time()) - 3600
+        self.in_stripe(
+            stripe_event('invoice.paid', {'id': f"in_{number}", 'customer': f"cus_{number % 3}"},
+                         created=start + number, event_id=f"evt_page_{number}")
+            for number in range(250)
+        )
+        self.replay(since=str(start), batch_size=60)
+        # Three pages of 100, newest first.
+        self.assertEqual(self.standin.count('GET', '/v1/events'), 3)
+        self.apply_all()
+
+        self.assertEqual(len(self.applied), 250)
+        for customer in ('cus_0', 'cus_1', 'cus_2'):
+            created = [when for key, when, _ in self.applied if key == customer]
+            self.assertEqual(created, sorted(created))
+
+    def test_archive_is_filtered_by_type(self):
+        output = self.replay(archive=ARCHIVE, types=['invoice.*'])
+        self.assertIn("Read 2 events", output)
+        self.assertEqual(set(StripeWebhookEvent.objects.values_list('event_type', flat=True)), {'invoice.paid'})
+
+    def test_archive_cannot_be_filtered_by_delivery(self):
+        with self.assertRaises(CommandError):
+            self.replay(archive=ARCHIVE, undelivered=True)
+        self.assertFalse(StripeWebhookEvent.objects.exists())
+
+    def test_stored_events_are_skipped(self):
+        webhook_queue.enqueue(stripe_event('invoice.paid', {'id': 'in_archive_1', 'customer': 'cus_archive_a'},
+                                           created=1767225600, event_id='evt_archive_1'))
+        StripeWebhookEvent.objects.update(status=StripeWebhookEvent.PROCESSED)
+
+        output = self.replay(archive=ARCHIVE)
+        self.assertIn("queued 2, skipped 1 already stored", output)
+        self.apply_all()
+        self.assertCountEqual([event_id for _, _, event_id in self.applied], ['evt_archive_2', 'evt_archive_3'])
+
+
+class ReplayWorkerStopTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.command = replay_webhooks.Command(stdout=StringIO(), stderr=StringIO())
+        self.command.started = timezone.now()
+        # The worker threads close their own connections; here that would end the test's transaction.
+        patcher = mock.patch.object(replay_webhooks.connection, 'close')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def queue(self, event_id, **fields):
+        webhook_queue.enqueue(stripe_event('invoice.paid', {'id': f"in_{event_id}", 'customer': 'cus_test'},
+                                           event_id=event_id))
+        StripeWebhookEvent.objects.filter(stripe_event_id=event_id).update(**fields)
+
+    def test_worker_waits_while_replayed_events_are_due(self):
+        self.queue('evt_due')
+        worker = mock.Mock(owner='test')
+        worker.run_once.side_effect = [2, 0, 0]
+
+        def other_worker_applies(seconds):
+            StripeWebhookEvent.objects.update(status=StripeWebhookEvent.PROCESSED)
+
+        with mock.patch.object(replay_webhooks.time, 'sleep', side_effect=other_worker_applies) as sleep:
+            self.command.run_worker(worker)
+        self.assertEqual(worker.run_once.call_count, 3)
+        sleep.assert_called_once()
+
+    def test_worker_leaves_retries_to_process_webhooks(self):
+        self.queue('evt_retry', next_attempt_at=timezone.now() + timedelta(minutes=5))
+        worker = mock.Mock(owner='test')
+        worker.run_once.return_value = 0
+        self.command.run_worker(worker)
+        self.assertEqual(worker.run_once.call_count, 1)
+
+    def test_worker_error_stops_only_that_worker(self):
+        worker = mock.Mock(owner='test')
+        worker.run_once.side_effect = RuntimeError("database gone")
+        self.command.run_worker(worker)
+        self.assertIn("Worker test stopped: RuntimeError('database gone')", self.command.stderr.getvalue())
@@ -0,0 +1,103 @@
+"""
+Two-phase credit debits: reserving, settling exactly once, and the expiry
+sweep racing late commits and releases.
+"""
+
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from subscriptions import reservations
+from subscriptions.models import CreditReservation, UsageBucket, UserSubscription
+
+from .base import StripeTestCase
+
+
+class ReservationTests(StripeTestCase):
+    def credits(self):
+        return UserSubscription.objects.get(pk=self.user_sub.pk).credits
+
+    def expire(self, reservation):
+        CreditReservation.objects.filter(pk=reservation.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_reserve_takes_credits_up_front(self):
+        reservation = reservations.reserve(self.user_sub, 20)
+        self.assertEqual((reservation.status, self.credits(), self.user_sub.credits), (CreditReservation.HELD, 30, 30))
+
+    def test_reserve_more_than_balance_holds_nothing(self):
+        self.assertIsNone(reservations.reserve(self.user_sub, 51))
+        self.assertEqual(self.credits(), 50)
+        self.assertFalse(CreditReservation.objects.exists())
+
+    def test_reserve_rejects_non_positive_amounts(self):
+        for amount in (0, -5):
+            with self.assertRaises(ValueError):
+                reservations.reserve(self.user_sub, amount)
+        self.assertEqual(self.credits(), 50)
+
+    def test_commit_records_usage_and_returns_the_rest(self):
+        reservation = reservations.reserve(self.user_sub, 20)
+        self.assertTrue(reservations.commit(reservation, 15))
+        self.assertEqual(self.credits(), 35)
+        self.assertEqual(UsageBucket.objects.get(user_subscription=self.user_sub).quantity, 15)
+        self.assertFalse(reservations.commit(reservation))
+        self.assertFalse(reservations.release(reservation))
+        self.assertEqual(self.credits(), 35)
+
+    def test_saving_after_reserve_and_commit_keeps_concurrent_debits(self):
+        reservation = reservations.reserve(self.user_sub, 20)
+        reservations.commit(reservation, 5)
+        for user_sub in (self.user_sub, reservation.user_subscription):
+            self.assertEqual(user_sub.get_dirty_fields(), [])
+        # Another request debits in between.
+        UserSubscription.objects.filter(pk=self.user_sub.pk).update(credits=F('credits') - 10)
+        self.user_sub.cancel_at_period_end_stripe = True
+        self.user_sub.save()
+        self.assertEqual(self.credits(), 35)
+
+    def test_sweep_returns_credits_once(self):
+        reservation = reservations.reserve(self.user_sub, 20)
+        self.expire(reservation)
+        self.assertEqual(reservations.release_expired(), 1)
+        self.assertEqual(reservations.release_expired(), 0)
+        self.assertEqual(self.credits(), 50)
+        self.assertEqual(CreditReservation.objects.get(pk=reservation.pk).status, CreditReservation.EXPIRED)
+
+    def test_late_commit_after_expiry_is_refused(self):
+        reservation = reservations.reserve(self.user_sub, 20)
+        self.expire(reservation)
+        # The job finishes after its reservation ran out, before the sweep.
+        self.assertFalse(reservations.commit(reservation))
+        self.assertEqual(reservations.release_expired(), 1)
+        self.assertEqual(self.credits(), 50)
+        self.assertFalse(UsageBucket.objects.exists())
+
+    def test_late_release_after_sweep_does_not_refund_twice(self):
+        reservation = reservations.reserve(self.user_sub, 20)
+        self.expire(reservation)
+        reservations.release_expired()
+        self.assertFalse(reservations.release(reservation))
+        self.assertEqual(self.credits(), 50)
+
+    def test_ended_subscription_gets_nothing_back(self):
+        reservation = reservations.reserve(self.user_sub, 20)
+        UserSubscription.objects.filter(pk=self.user_sub.pk).update(is_active=False, credits=0)
+        self.expire(reservation)
+        self.assertEqual(reservations.release_expired(), 1)
+        self.assertEqual(self.credits(), 0)
+
+    def test_sweep_publishes_after_its_transaction(self):
+        reservation = reservations.reserve(self.user_sub, 20)
+        self.expire(reservation)
+        depth = len(connection.atomic_blocks)
+        published = []
+
+        def publish(user_sub):
+            published.append((user_sub.credits, len(connection.atomic_blocks)))
+
+        with mock.patch.object(reservations.live_updates, 'publish_subscription_update', side_effect=publish):
+            reservations.release_expired()
+        self.assertEqual(published, [(50, depth)])
@@ -0,0 +1,44 @@
+"""
+Daily plan summaries: folding recorded changes per plan, day and currency.
+"""
+
+from decimal import Decimal
+
+from django.utils import timezone
+
+from subscriptions import summaries
+from subscriptions.models import DailyPlanSummary, Invoice
+
+from .base import StripeTestCase
+
+
+class SummaryFoldTests(StripeTestCase):
+    def setUp(self):
+        super().setUp()
+        # Creating the fixture subscription recorded it as new and active.
+        summaries.fold()
+
+    def paid(self, amount, currency):
+        summaries.record_invoice(Invoice(amount_due=amount, currency=currency, is_successful_payment=True), self.plan.pk)
+
+    def row(self, currency):
+        return DailyPlanSummary.objects.get(plan=self.plan, day=timezone.localdate(), currency=currency)
+
+    def test_currencies_are_kept_apart(self):
+        self.paid(1000, 'usd')
+        self.paid(900, 'EUR')
+        self.assertEqual(summaries.fold(), 2)
+        self.assertEqual((self.row('usd').revenue, self.row('eur').revenue), (Decimal('1000'), Decimal('900')))
+
+    def test_later_fold_adds_to_existing_row(self):
+        self.paid(1000, 'usd')
+        summaries.fold()
+        self.paid(500, 'usd')
+        summaries.record_subscription_change(None, summaries.subscription_state(self.user_sub))
+        summaries.fold()
+
+        row = self.row('usd')
+        self.assertEqual((row.revenue, row.invoices_paid), (Decimal('1500'), 2))
+        self.assertEqual((row.active_subscriptions, row.mrr), (2, Decimal('20.00')))
+        self.assertEqual(summaries.totals_on(timezone.localdate()),
+                         {(self.plan.pk, 'usd'): {'active_subscriptions': 2, 'mrr': Decimal('20.00')}})
@@ -0,0 +1,137 @@
+"""
+The partitioned webhook queue: per-customer order, partition leases, and
+pruning handled events.
+"""
+
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import TestCase
+from django.utils import timezone
+
+from subscriptions import stripe_guard, webhook_queue
+from subscriptions.models import StripeWebhookEvent, WebhookPartition
+from subscriptions.webhook_queue import WebhookWorker
+
+from .base import stripe_event
+
+
+class WebhookQueueTests(TestCase):
+    def setUp(self):
+        self.now = int(time.time())
+        self.applied = []
+        self.failing = set()
+        patcher = mock.patch('subscriptions.views.process_stripe_event', side_effect=self.process)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def process(self, event, stripe_data=None):
+        self.applied.append(event['id'])
+        return HttpResponse(status=500 if event['id'] in self.failing else 200)
+
+    def enqueue(self, event_id, customer='cus_a', seconds=0):
+        webhook_queue.enqueue(stripe_event('invoice.paid', {'id': f"in_{event_id}", 'customer': customer},
+                                           created=self.now + seconds, event_id=event_id))
+
+    def status(self, event_id):
+        return StripeWebhookEvent.objects.values_list('status', flat=True).get(stripe_event_id=event_id)
+
+    def test_customer_events_apply_in_created_order(self):
+        self.enqueue('evt_3', seconds=2)
+        self.enqueue('evt_1', seconds=0)
+        self.enqueue('evt_2', seconds=1)
+        self.assertEqual(WebhookWorker('test').run_once(), 3)
+        self.assertEqual(self.applied, ['evt_1', 'evt_2', 'evt_3'])
+
+    def test_failed_event_holds_back_later_events_of_its_customer(self):
+        self.failing.add('evt_1')
+        self.enqueue('evt_1', seconds=0)
+        self.enqueue('evt_2', seconds=1)
+        self.enqueue('evt_other', customer='cus_b', seconds=2)
+        WebhookWorker('test').run_once()
+
+        self.assertCountEqual(self.applied, ['evt_1', 'evt_other'])
+        failed = StripeWebhookEvent.objects.get(stripe_event_id='evt_1')
+        self.assertEqual((failed.status, failed.attempts), (StripeWebhookEvent.PENDING, 1))
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        self.assertEqual(self.status('evt_2'), StripeWebhookEvent.PENDING)
+
+        # The retry succeeds and the held-back event follows it.
+        self.failing.clear()
+        StripeWebhookEvent.objects.filter(stripe_event_id='evt_1').update(next_attempt_at=timezone.now())
+        WebhookWorker('test').run_once()
+        self.assertEqual(self.applied[2:], ['evt_1', 'evt_2'])
+
+    def test_failed_attempt_leaves_no_writes(self):
+        self.enqueue('evt_1')
+
+        def writes_then_fails(event, stripe_data=None):
+            self.applied.append(event['id'])
+            WebhookPartition.objects.create(number=999)
+            return HttpResponse(status=500)
+
+        with mock.patch('subscriptions.views.process_stripe_event', side_effect=writes_then_fails):
+            WebhookWorker('test').run_once()
+        self.assertEqual(self.applied, ['evt_1'])
+        self.assertFalse(WebhookPartition.objects.filter(number=999).exists())
+        failed = StripeWebhookEvent.objects.get(stripe_event_id='evt_1')
+        self.assertEqual((failed.status, failed.attempts, failed.last_error), (StripeWebhookEvent.PENDING, 1, "HTTP 500"))
+
+    def test_partition_leased_by_another_worker_is_skipped(self):
+        self.enqueue('evt_1')
+        number = webhook_queue.partition_for('cus_a')
+        self.assertTrue(WebhookWorker('other').lease(number))
+        self.assertEqual(WebhookWorker('test').run_once(), 0)
+
+        # The other worker crashed; its lease runs out.
+        WebhookPartition.objects.filter(number=number).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(WebhookWorker('test').run_once(), 1)
+        self.assertEqual(self.status('evt_1'), StripeWebhookEvent.PROCESSED)
+
+    def test_event_rolled_back_when_lease_is_lost(self):
+        self.enqueue('evt_1', seconds=0)
+        self.enqueue('evt_2', seconds=1)
+        # This worker stalled past its lease and another one took the partition over.
+        with mock.patch.object(WebhookWorker, 'holds', return_value=False):
+            self.assertEqual(WebhookWorker('test').run_once(), 0)
+        self.assertEqual(self.applied, ['evt_1'])
+        event = StripeWebhookEvent.objects.get(stripe_event_id='evt_1')
+        self.assertEqual((event.status, event.processed_at), (StripeWebhookEvent.PENDING, None))
+
+    def test_lease_held_until_released(self):
+        number = webhook_queue.partition_for('cus_a')
+        worker = WebhookWorker('test')
+        self.assertTrue(worker.lease(number))
+        self.assertTrue(worker.holds(number))
+        self.assertFalse(WebhookWorker('other').holds(number))
+        worker.release(number)
+        self.assertFalse(worker.holds(number))
+
+    def test_lease_is_renewed_while_processing(self):
+        worker = WebhookWorker('test')
+        worker.lease_seconds = 0.03
+        with mock.patch.object(worker, 'renew', return_value=True) as renew:
+            with worker.keep_lease(1):
+                time.sleep(0.1)
+        self.assertGreaterEqual(renew.call_count, 2)
+        renew.assert_called_with(1)
+
+    def test_lease_outlasts_a_stripe_call(self):
+        self.assertGreater(WebhookWorker('test', lease_seconds=1).lease_seconds, stripe_guard.max_call_seconds())
+
+    def test_prune_deletes_old_handled_events(self):
+        for event_id in ('evt_old', 'evt_recent', 'evt_pending'):
+            self.enqueue(event_id)
+        StripeWebhookEvent.objects.exclude(stripe_event_id='evt_pending').update(
+            status=StripeWebhookEvent.PROCESSED, processed_at=timezone.now())
+        StripeWebhookEvent.objects.filter(stripe_event_id='evt_old').update(
+            processed_at=timezone.now() - timedelta(days=31))
+        StripeWebhookEvent.objects.filter(stripe_event_id='evt_pending').update(
+            next_attempt_at=timezone.now() + timedelta(hours=1))
+
+        call_command('process_webhooks', keep_days=30, verbosity=0)
+        self.assertEqual(set(StripeWebhookEvent.objects.values_list('stripe_event_id', flat=True)),
+                         {'evt_recent', 'evt_pending'})
@@ -15,6 +15,8 @@ path('cancel-at-period-end/', views.cancel_subscription_at_period_end, name='can
             path('pause-subscription/', views.pause_subscription, name='pause-subscription'),
 path('resume-subscription/', views.resume_subscription, name='resume-subscription'),
 path('update-payment-method/', views.update_payment_method, name='update-payment-method'),
+path('events/subscription/', views.subscription_events, name='subscription-events'),
+path('exports/<str:kind>/', views.export_records, name='export-records'),
 
 
 
@@ -0,0 +1,193 @@
+# subscriptions/usage.py
+"""
+Reports credit usage to Stripe meters without adding Stripe calls to the debit
+path.
+
+- Every debit adds its amount to the subscription's UsageBucket for the current
+  STRIPE_USAGE_WINDOW_SECONDS window, in the debit's own transaction
+  (record()). That is one small UPDATE and never waits on Stripe.
+- close_windows() takes the buckets of windows that ended more than
+  STRIPE_USAGE_FLUSH_DELAY seconds ago and sums them into one UsageReport per
+  Stripe customer. In the same transaction each bucket's reported_quantity
+  watermark moves up to its quantity, so no credit is reported twice or
+  skipped, even when a late debit lands in an already reported window.
+- send_due() sends the reports as meter events for STRIPE_USAGE_METER_EVENT.
+  A report keeps its identifier across retries, and Stripe ignores meter
+  events whose identifier it has seen, so a retry after a lost response does
+  not double-bill. Like the outbox, each attempt is claimed in a short
+  transaction and Stripe is called after it commits, so no row lock or
+  transaction stays open during the call.
+
+`python manage.py export_usage --loop` runs both steps.
+"""
+
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics, stripe_guard
+from .models import UsageBucket, UsageReport
+from .stripe_client import stripe
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+MAX_BACKOFF = timedelta(minutes=30)
+
+
+def window_start(moment=None):
+    seconds = settings.STRIPE_USAGE_WINDOW_SECONDS
+    timestamp = (moment or timezone.now()).timestamp()
+    return datetime.fromtimestamp(timestamp - timestamp % seconds, tz=dt_timezone.utc)
+
+
+def record(user_sub, amount):
+    """
+    Adds `amount` credits to the subscription's bucket for the current window.
+    Call it in the same transaction as the debit.
+    """
+    start = window_start()
+    bucket = UsageBucket.objects.filter(user_subscription_id=user_sub.pk, window_start=start)
+    if bucket.update(quantity=F('quantity') + amount):
+        return
+    try:
+        with transaction.atomic():
+            UsageBucket.objects.create(user_subscription_id=user_sub.pk, window_start=start, quantity=amount)
+    except IntegrityError:
+        # A concurrent debit created the bucket first
+        bucket.update(quantity=F('quantity') + amount)
+
+
+def close_windows(limit=1000):
+    """
+    Moves unreported usage of closed windows into UsageReports, one per
+    customer. Returns the number of reports created.
+    """
+    cutoff = timezone.now() - timedelta(
+        seconds=settings.STRIPE_USAGE_WINDOW_SECONDS + settings.STRIPE_USAGE_FLUSH_DELAY)
+    with transaction.atomic():
+        # Skipped rows are being closed by another exporter, or debited right now.
+        buckets = list(
+            UsageBucket.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('user_subscription')
+            .filter(window_start__lte=cutoff, quantity__gt=F('reported_quantity'))
+            .exclude(user_subscription__stripe_customer_id='')
+            .order_by('pk')[:limit]
+        )
+        if not buckets:
+            return 0
+
+        quantities = defaultdict(int)
+        last_window = {}
+        for bucket in buckets:
+            customer_id = bucket.user_subscription.stripe_customer_id
+            quantities[customer_id] += bucket.quantity - bucket.reported_quantity
+            last_window[customer_id] = max(bucket.window_start, last_window.get(customer_id, bucket.window_start))
+            bucket.reported_quantity = bucket.quantity
+
+        window = timedelta(seconds=settings.STRIPE_USAGE_WINDOW_SECONDS)
+        UsageReport.objects.bulk_create([
+            UsageReport(
+                stripe_customer_id=customer_id,
+                event_name=settings.STRIPE_USAGE_METER_EVENT,
+                quantity=quantity,
+                timestamp=last_window[customer_id] + window,
+                identifier=f"usage-{uuid.uuid4().hex}",
+            )
+            for customer_id, quantity in quantities.items()
+        ])
+        UsageBucket.objects.bulk_update(buckets, ['reported_quantity'])
+    metrics.incr('stripe.usage.reports_created', len(quantities))
+    return len(quantities)
+
+
+def send_due(limit=100):
+    """
+    Sends pending reports whose next attempt is due. Returns the number sent.
+    """
+    due = UsageReport.objects.filter(status=UsageReport.PENDING, next_attempt_at__lte=timezone.now())
+    sent = 0
+    for pk in due.order_by('pk').values_list('pk', flat=True)[:limit]:
+        report = _claim(pk)
+        if report is not None and _send(report):
+            sent += 1
+    return sent
+
+
+def _claim(pk):
+    """
+    Takes a due report for one attempt and commits, or returns None. Until the
+    claim runs out, other exporters consider the report not due; they only
+    retry it if this exporter dies during the call.
+    """
+    with transaction.atomic():
+        # The row lock keeps concurrent exporters from claiming the same report.
+        report = (
+            UsageReport.objects.select_for_update(skip_locked=True)
+            .filter(pk=pk, status=UsageReport.PENDING, next_attempt_at__lte=timezone.now()).first()
+        )
+        if report is None:
+            return None
+        report.attempts += 1
+        report.next_attempt_at = timezone.now() + timedelta(seconds=stripe_guard.max_call_seconds() + 30)
+        report.save(update_fields=['attempts', 'next_attempt_at'])
+    return report
+
+
+def unreported_lag():
+    """
+    Seconds since the start of the oldest window with usage not yet in a report.
+    """
+    oldest = (
+        UsageBucket.objects.filter(quantity__gt=F('reported_quantity'))
+        .exclude(user_subscription__stripe_customer_id='')
+        .order_by('window_start').values_list('window_start', flat=True).first()
+    )
+    return (timezone.now() - oldest).total_seconds() if oldest else 0.0
+
+
+def _send(report):
+    try:
+        stripe.billing.MeterEvent.create(
+            event_name=report.event_name,
+            payload={'stripe_customer_id': report.stripe_customer_id, 'value': str(report.quantity)},
+            identifier=report.identifier,
+            timestamp=int(report.timestamp.timestamp()),
+            idempotency_key=report.identifier,
+        )
+    except stripe.error.StripeError as e:
+        permanent = isinstance(e, (stripe.error.InvalidRequestError, stripe.error.AuthenticationError,
+                                   stripe.error.PermissionError, stripe.error.IdempotencyError))
+        if permanent or report.attempts >= MAX_ATTEMPTS:
+            if _record(report, status=UsageReport.FAILED, last_error=str(e)):
+                metrics.incr('stripe.usage.failed')
+                logger.error("Usage report %s for %s failed for good: %s", report.pk, report.stripe_customer_id, e)
+        else:
+            backoff = min(MAX_BACKOFF, timedelta(seconds=2 ** report.attempts))
+            if _record(report, last_error=str(e), next_attempt_at=timezone.now() + backoff):
+                metrics.incr('stripe.usage.retried')
+        return False
+
+    if _record(report, status=UsageReport.SENT, sent_at=timezone.now(), last_error=''):
+        metrics.incr('stripe.usage.sent')
+    return True
+
+
+def _record(report, **fields):
+    """
+    Records the outcome of the attempt `report` was claimed for. Changes
+    nothing when the claim ran out and another exporter has claimed it again.
+    """
+    recorded = UsageReport.objects.filter(
+        pk=report.pk, status=UsageReport.PENDING, attempts=report.attempts,
+    ).update(**fields)
+    if recorded:
+        for field, value in fields.items():
+            setattr(report, field, value)
+    return bool(recorded)
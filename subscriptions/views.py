@@ -1,50 +1,94 @@
-import stripe
+import asyncio
+import hashlib
 import json
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
-from django.http import HttpResponse, JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET, require_POST
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.models import User
 
-from subscriptions.utils import assign_credits_based_on_plan, assign_credits_by_price_id, check_and_expire_subscription, handle_subscription_period_end
-from .models import Invoice, StripeCustomer, StripePlan, UserSubscription
+from subscriptions.utils import assign_credits_based_on_plan, handle_subscription_period_end
+from . import catalog, exports, live_updates, locking, metrics, outbox, summaries, webhook_queue
+from .catalog import plans_last_modified
+from .customers import get_stripe_customer_id, record_stripe_customer
+from .models import Invoice, OpenCheckoutSession, StripeCustomer, StripePlan, UserSubscription
+from .stripe_client import stripe
 from django.utils import timezone as dj_timezone
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Now
 
 
+def get_request_subscription(request):
+    """
+    Returns the user's subscription (or None), reusing the one CreditRefillMiddleware
+    already loaded for this request when available.
+    """
+    if not hasattr(request, 'user_subscription'):
+        request.user_subscription = UserSubscription.objects.select_related('plan').filter(user=request.user).first()
+    return request.user_subscription
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+
+def subscribe_page_etag(request):
+    """
+    The plans page changes when the catalog, the user's subscription or their CSRF
+    cookie (embedded in the form) changes. Pending flash messages are rendered once,
+    so the page is never answered with a 304 while there are any.
+    """
+    if len(messages.get_messages(request)):
+        return None
+    user_subscription = get_request_subscription(request)
+    parts = [
+        plans_last_modified().isoformat(),
+        str(request.user.pk),
+        user_subscription.updated_at.isoformat() if user_subscription else '',
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+    ]
+    return hashlib.md5(':'.join(parts).encode()).hexdigest()
+
+
+def subscribe_page_last_modified(request):
+    if len(messages.get_messages(request)):
+        return None
+    user_subscription = get_request_subscription(request)
+    last_modified = plans_last_modified()
+    if user_subscription and user_subscription.updated_at > last_modified:
+        last_modified = user_subscription.updated_at
+    return last_modified
 
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=subscribe_page_etag, last_modified_func=subscribe_page_last_modified)
 def subscribe_view(request):
     """
     Displays the subscription page with available plans and the user's current plan.
+    Repeat visits are answered with a 304, and the plan list itself is a cached
+    fragment versioned by the catalog's last change, so the plans are not queried.
     """
-    user = request.user
-    user_subscription = None
     current_plan_name = None
-    
-    try:
-        user_subscription = UserSubscription.objects.get(user=user)
-        if user_subscription.is_active and user_subscription.plan:
-            current_plan_name = user_subscription.plan.name
-    except UserSubscription.DoesNotExist:
-        #logger.info(f"No existing subscription found for user {user.username}.")
-        pass # No active subscription, current_plan_name remains None
 
-    # Fetch active plans from the database
+    user_subscription = get_request_subscription(request)
+    if user_subscription and user_subscription.is_active and user_subscription.plan:
+        current_plan_name = user_subscription.plan.name
+
+    # Lazy: only evaluated when the cached plan list fragment has to be re-rendered
     available_plans = StripePlan.objects.filter(is_active=True).order_by('monthly_credit_allotment')
 
     context = {
         'current_plan_name': current_plan_name,
         'user_subscription': user_subscription, # Pass user_subscription for conditional rendering
         'available_plans': available_plans,
+        'plans_version': plans_last_modified().timestamp(),
+        'plans_cache_timeout': settings.PLANS_CACHE_TIMEOUT,
         #'STRIPE_PUBLIC_KEY': settings.STRIPE_PUBLIC_KEY, # Pass public key for client-side JS
     }
     return render(request, 'subscription.html', context)
@@ -85,6 +129,10 @@ def subscription_cancel(request):
     return render(request, "subscription_cancel.html")
 
 
+# An open Checkout Session is only reused if it stays valid at least this long
+CHECKOUT_SESSION_REUSE_MARGIN = timedelta(minutes=10)
+
+
 @login_required
 @require_POST
 def create_checkout_session(request):
@@ -111,12 +159,9 @@ def create_checkout_session(request):
         return redirect('subscribe')
     
 
-    customer_id = None
     old_subscription_id = ""
     try:
-        # Check if the user already has a Stripe customer ID
         user_sub = UserSubscription.objects.get(user=user)
-        customer_id = user_sub.stripe_customer_id
 
         # If an active subscription exists, cancel it first before creating a new one.
         # Stripe will handle proration and effective dates.
@@ -138,13 +183,26 @@ def create_checkout_session(request):
                 return redirect('subscribe')
 
     except UserSubscription.DoesNotExist:
-        #logger.info(f"No existing UserSubscription for {user.username}. A new customer will be created if needed.")
-        pass # No existing subscription, proceed to create customer/checkout session
+        #logger.info(f"No existing UserSubscription for {user.username}.")
+        pass # No existing subscription, proceed to create checkout session
+
+    # Repeat clicks reuse the session Stripe already has open for this plan, as long as
+    # it still replaces the same subscription and leaves the user time to pay.
+    open_session = OpenCheckoutSession.objects.filter(
+        user=user,
+        stripe_price_id=price_id,
+        old_subscription_id=old_subscription_id,
+        expires_at__gt=dj_timezone.now() + CHECKOUT_SESSION_REUSE_MARGIN,
+    ).first()
+    if open_session:
+        return redirect(open_session.url)
 
     try:
+        # Normally provisioned at signup; only created here if that has not happened yet
+        customer_id = get_stripe_customer_id(user)
+
         checkout_session = stripe.checkout.Session.create(
-            customer_email=user.email if not customer_id else None, # Only provide email if creating new customer
-            customer=customer_id, # Use existing customer if available
+            customer=customer_id, # Always the user's single Stripe customer, never a new one
             payment_method_types=['card'],
             line_items=[{
                 'price': price_id,
@@ -159,6 +217,16 @@ def create_checkout_session(request):
                 "old_subscription_id": old_subscription_id
             }
         )
+        OpenCheckoutSession.objects.update_or_create(
+            user=user,
+            stripe_price_id=price_id,
+            defaults={
+                'stripe_session_id': checkout_session.id,
+                'old_subscription_id': old_subscription_id,
+                'url': checkout_session.url,
+                'expires_at': datetime.fromtimestamp(checkout_session.expires_at, tz=timezone.utc),
+            }
+        )
         return redirect(checkout_session.url)
     except stripe.error.StripeError as e:
         messages.error(request, f"Payment processing error: {e}")
@@ -169,12 +237,98 @@ def create_checkout_session(request):
         #logger.critical(f"Unexpected error creating checkout session for {user.username}: {e}", exc_info=True)
         return redirect('subscribe')
 
+
+def _apply_subscription_updated(event_created, sub_data):
+    """
+    Applies a customer.subscription.updated payload unless a newer event for the
+    subscription was already applied. Returns the HTTP status for the webhook.
+    """
+    subscription_id = sub_data['id']
+    customer_id = sub_data['customer']
+
+    try:
+        user_sub = UserSubscription.objects.select_for_update().get(stripe_subscription_id=subscription_id, stripe_customer_id=customer_id)
+    except UserSubscription.DoesNotExist:
+        #logger.error(f"UserSubscription not found for sub ID {subscription_id} and customer ID {customer_id}.")
+        return 404
+
+    if user_sub.last_event_created and event_created < user_sub.last_event_created:
+        # An older event delivered late; everything it says is already superseded.
+        metrics.incr('webhooks.stale_discarded')
+        return 200
+
+    # Update plan if it changed
+    current_stripe_price_id = sub_data['items']['data'][0]['price']['id']
+    try:
+        new_plan = StripePlan.objects.get(stripe_price_id=current_stripe_price_id)
+        user_sub.plan = new_plan
+        #user_sub.monthly_credit_allotment = new_plan.monthly_credit_allotment
+    except StripePlan.DoesNotExist:
+        pass
+        #logger.error(f"Plan with price ID {current_stripe_price_id} not found on subscription update for {user_sub.user.username}.")
+
+    user_sub.status = sub_data['status']
+    user_sub.is_active = sub_data['status'] == 'active' or sub_data['status'] == 'trialing'
+    user_sub.current_period_start = datetime.fromtimestamp(sub_data["items"]["data"][0]["current_period_start"], tz=timezone.utc)
+    user_sub.current_period_end = datetime.fromtimestamp(sub_data["items"]["data"][0]["current_period_end"], tz=timezone.utc)
+
+    pause_collection_behavior = None
+    if 'pause_collection' in sub_data and sub_data['pause_collection'] is not None:
+        pause_collection_behavior = sub_data['pause_collection'].get('behavior')
+    # Handle pause/resume related fields
+    #pause_collection_behavior = sub_data.get('pause_collection', {}).get('behavior')
+    if pause_collection_behavior:
+        # When paused, Stripe sets the status to 'paused' and provides pause_collection details
+        user_sub.is_paused = True
+        user_sub.status = 'paused' # Override status for clarity if paused
+        #user_sub.is_active = False # If paused, it's not considered active for billing
+    else:
+        # When unpaused, pause_collection will be null
+
+        # Ensure status is correctly set back if it was paused and now active
+        if user_sub.status == 'paused' and sub_data['status'] == 'active':
+            user_sub.status = 'active'
+            user_sub.is_paused = False
+            #user_sub.is_active = True
+            
+    # --- NEW: Update cancel_at_period_end_stripe field ---
+    user_sub.cancel_at_period_end_stripe = sub_data.get('cancel_at_period_end', False)
+    # --- END NEW ---
+
+    # Keep the user's changes still on their way to Stripe, so the dashboard does not flip back.
+    outbox.apply_open(user_sub)
+
+    # One conditional UPDATE: it only applies if no newer event got there first.
+    fields = ['plan', 'status', 'is_active', 'current_period_start', 'current_period_end',
+              'is_paused', 'cancel_at_period_end_stripe']
+    applied = UserSubscription.objects.filter(
+        Q(last_event_created__isnull=True) | Q(last_event_created__lte=event_created),
+        pk=user_sub.pk,
+    ).update(
+        last_event_created=event_created,
+        updated_at=Now(),
+        **{field: getattr(user_sub, field) for field in fields},
+    )
+    if not applied:
+        metrics.incr('webhooks.stale_discarded')
+        return 200
+
+    # update() bypasses post_save, so notify live clients and the summaries here.
+    live_updates.publish_subscription_update(user_sub)
+    summaries.record_subscription_change(
+        summaries.subscription_state(user_sub, loaded=True), summaries.subscription_state(user_sub))
+    outbox.confirm(subscription_id, sub_data, event_created)
+    #logger.info(f"User {user_sub.user.username} subscription {subscription_id} updated to status: {user_sub.status}.")
+    return 200
+
+
 @require_POST
 @csrf_exempt
 def stripe_webhook(request):
     """
-    Handles Stripe webhook events to keep the local database in sync.
-    Uses Django's transaction.atomic for database consistency.
+    Receives Stripe webhook events and verifies their signature. Events are
+    queued for the webhook workers, or applied right away when
+    STRIPE_WEBHOOK_QUEUE is off.
     """
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
@@ -193,6 +347,43 @@ def stripe_webhook(request):
         #logger.critical(f"Unexpected error in webhook signature verification: {e}", exc_info=True)
         return HttpResponse(status=500)
 
+    if settings.STRIPE_WEBHOOK_QUEUE:
+        # Applied in order per customer by the process_webhooks workers (see webhook_queue.py)
+        webhook_queue.enqueue(event)
+        return HttpResponse(status=200)
+    return process_stripe_event(event)
+
+
+def read_from_stripe(event):
+    """
+    The Stripe objects the handler of `event` needs beyond the event itself,
+    or None. Called before the handler's transaction opens, so no transaction
+    or row lock stays open while Stripe answers.
+    """
+    event_type = event['type']
+    object_id = event['data']['object']['id']
+    if event_type in ('price.created', 'price.updated'):
+        # Re-read the price: events can arrive out of order, and the catalog needs its product.
+        return [stripe.Price.retrieve(object_id, expand=['product'])]
+    if event_type in ('product.created', 'product.updated'):
+        # Names, descriptions and availability of all the product's plans may have changed.
+        return list(catalog.fetch_prices(product=object_id))
+    return None
+
+
+def process_stripe_event(event, stripe_data=None):
+    """
+    Applies one verified Stripe event to the local database and returns the
+    response Stripe should get for it; anything but a 200 makes Stripe, or the
+    webhook queue, deliver it again. `stripe_data` is what read_from_stripe()
+    returned for the event; it is read here when not given.
+    """
+    if stripe_data is None:
+        try:
+            stripe_data = read_from_stripe(event)
+        except Exception as e:
+            print(f"Error reading Stripe objects for webhook event {event['type']}: {e}")
+            return JsonResponse({'error': str(e)}, status=500)
 
     # Use atomic transactions to ensure database consistency
     with transaction.atomic():
@@ -207,6 +398,9 @@ def stripe_webhook(request):
                 user_id = session["metadata"].get("user_id")
                 old_subscription_id = session["metadata"].get('old_subscription_id')
 
+                # The session can no longer be reused for repeat clicks
+                OpenCheckoutSession.objects.filter(stripe_session_id=session['id']).delete()
+
                 if not user_id:
                     #logger.error(f"checkout.session.completed event missing user_id in metadata: {session.id}")
                     return HttpResponse(status=400)
@@ -257,7 +451,9 @@ def stripe_webhook(request):
                             'last_credit_refill_date': dj_timezone.now() # Mark credits refilled
                         }
                     )
-                    user_sub = UserSubscription.objects.get(user=user) # Retrieve the updated/created sub
+                    # Adopt the customer Checkout used if none was recorded for the user yet
+                    record_stripe_customer(user, customer_id)
+                    user_sub = UserSubscription.objects.select_for_update().get(user=user) # Retrieve the updated/created sub
                     assign_credits_based_on_plan(user_sub, selected_plan) # Assign initial credits
                     #logger.info(f"User {user.username} subscription (ID: {subscription_id}) created/updated.")
 
@@ -312,6 +508,10 @@ def stripe_webhook(request):
                         return HttpResponse(status=500)
 
 
+            elif event_type == 'checkout.session.expired':
+                OpenCheckoutSession.objects.filter(stripe_session_id=data_object['id']).delete()
+
+
             elif event_type == 'invoice.payment_succeeded':
                 invoice = data_object
                 # CORRECTED LINE: Access subscription ID directly from the invoice object
@@ -332,7 +532,7 @@ def stripe_webhook(request):
                     return HttpResponse(status=200) # Acknowledge the webhook
                 
                 try:
-                    user_sub = UserSubscription.objects.get(stripe_subscription_id=subscription_id)#, stripe_customer_id=customer_id)
+                    user_sub = UserSubscription.objects.select_for_update().get(stripe_subscription_id=subscription_id)#, stripe_customer_id=customer_id)
                 except UserSubscription.DoesNotExist:
                     #logger.error(f"UserSubscription not found for sub ID {subscription_id} and customer ID {customer_id}.")
                     return HttpResponse(status=404)
@@ -357,7 +557,7 @@ def stripe_webhook(request):
                 # Otherwise, this only ensures the subscription is active.
                 
                 # Create invoice record
-                Invoice.objects.create(
+                invoice_record = Invoice.objects.create(
                     user=user_sub.user,
                     #user_subscription=user_sub,
                     stripe_invoice_id=invoice['id'],
@@ -370,6 +570,7 @@ def stripe_webhook(request):
                     period_end=datetime.fromtimestamp(line_item["period"]["end"], tz=timezone.utc),
                     is_successful_payment=True
                 )
+                summaries.record_invoice(invoice_record, user_sub.plan_id)
                 #logger.info(f"Invoice {invoice['id']} payment succeeded for user {user_sub.user.username}.")
 
 
@@ -393,7 +594,7 @@ def stripe_webhook(request):
                     return HttpResponse(status=200) # Acknowledge the webhook
                 
                 try:
-                    user_sub = UserSubscription.objects.get(stripe_subscription_id=subscription_id)#, stripe_customer_id=customer_id)
+                    user_sub = UserSubscription.objects.select_for_update().get(stripe_subscription_id=subscription_id)#, stripe_customer_id=customer_id)
                     user_sub.is_active = False # Mark as inactive
                     user_sub.status = 'past_due' if invoice['billing_reason'] == 'subscription_cycle' else 'unpaid'
                     user_sub.credits = 0 # Revoke credits
@@ -404,7 +605,7 @@ def stripe_webhook(request):
                 
 
                 # Create invoice record for failed payment
-                Invoice.objects.create(
+                invoice_record = Invoice.objects.create(
                     user=user_sub.user,
                     #user_subscription=user_sub,
                     stripe_invoice_id=invoice['id'],
@@ -417,59 +618,17 @@ def stripe_webhook(request):
                     period_end=datetime.fromtimestamp(line_item["period"]["end"], tz=timezone.utc),
                     is_successful_payment=False
                 )
+                summaries.record_invoice(invoice_record, user_sub.plan_id)
                 #logger.warning(f"Invoice {invoice['id']} payment failed for user {user_sub.user.username}.")
 
 
             elif event_type == 'customer.subscription.updated':
-                sub_data = data_object
-                subscription_id = sub_data['id']
-                customer_id = sub_data['customer']
-
-                try:
-                    user_sub = UserSubscription.objects.get(stripe_subscription_id=subscription_id, stripe_customer_id=customer_id)
-                except UserSubscription.DoesNotExist:
-                    #logger.error(f"UserSubscription not found for sub ID {subscription_id} and customer ID {customer_id}.")
-                    return HttpResponse(status=404)
-
-                # Update plan if it changed
-                current_stripe_price_id = sub_data['items']['data'][0]['price']['id']
-                try:
-                    new_plan = StripePlan.objects.get(stripe_price_id=current_stripe_price_id)
-                    user_sub.plan = new_plan
-                    #user_sub.monthly_credit_allotment = new_plan.monthly_credit_allotment
-                except StripePlan.DoesNotExist:
-                    pass
-                    #logger.error(f"Plan with price ID {current_stripe_price_id} not found on subscription update for {user_sub.user.username}.")
-
-                user_sub.status = sub_data['status']
-                user_sub.is_active = sub_data['status'] == 'active' or sub_data['status'] == 'trialing'
-                user_sub.current_period_start = datetime.fromtimestamp(sub_data["items"]["data"][0]["current_period_start"], tz=timezone.utc)
-                user_sub.current_period_end = datetime.fromtimestamp(sub_data["items"]["data"][0]["current_period_end"], tz=timezone.utc)
-
-                pause_collection_behavior = None
-                if 'pause_collection' in sub_data and sub_data['pause_collection'] is not None:
-                    pause_collection_behavior = sub_data['pause_collection'].get('behavior')
-                # Handle pause/resume related fields
-                #pause_collection_behavior = sub_data.get('pause_collection', {}).get('behavior')
-                if pause_collection_behavior:
-                    # When paused, Stripe sets the status to 'paused' and provides pause_collection details
-                    user_sub.is_paused = True
-                    user_sub.status = 'paused' # Override status for clarity if paused
-                    #user_sub.is_active = False # If paused, it's not considered active for billing
-                else:
-                    # When unpaused, pause_collection will be null
-
-                    # Ensure status is correctly set back if it was paused and now active
-                    if user_sub.status == 'paused' and sub_data['status'] == 'active':
-                        user_sub.status = 'active'
-                        user_sub.is_paused = False
-                        #user_sub.is_active = True
-                        
-                # --- NEW: Update cancel_at_period_end_stripe field ---
-                user_sub.cancel_at_period_end_stripe = sub_data.get('cancel_at_period_end', False)
-                # --- END NEW ---
-                user_sub.save()
-                #logger.info(f"User {user_sub.user.username} subscription {subscription_id} updated to status: {user_sub.status}.")
+                # Bursts for one subscription are merged by the webhook queue, which
+                # skips an update when a newer one is already queued.
+                event_created = datetime.fromtimestamp(event['created'], tz=timezone.utc)
+                status = _apply_subscription_updated(event_created, data_object)
+                if status != 200:
+                    return HttpResponse(status=status)
 
 
             elif event_type == 'customer.subscription.deleted':
@@ -478,10 +637,14 @@ def stripe_webhook(request):
                 customer_id = sub_data['customer']
 
                 try:
-                    user_sub = UserSubscription.objects.get(stripe_subscription_id=subscription_id, stripe_customer_id=customer_id)
+                    user_sub = UserSubscription.objects.select_for_update().get(stripe_subscription_id=subscription_id, stripe_customer_id=customer_id)
                     user_sub.is_active = False
                     user_sub.status = 'canceled' # Or 'ended' depending on your lifecycle
                     user_sub.credits = 0 # Clear credits on deletion
+                    # A late customer.subscription.updated must not bring it back
+                    event_created = datetime.fromtimestamp(event['created'], tz=timezone.utc)
+                    if not user_sub.last_event_created or event_created > user_sub.last_event_created:
+                        user_sub.last_event_created = event_created
                     #user_sub.stripe_subscription_id = None # Clear subscription ID as it's deleted
 
                     # lifetime_plan = get_object_or_404(StripePlan, plan_type='lifetime')
@@ -514,6 +677,21 @@ def stripe_webhook(request):
                     #logger.warning(f"customer.subscription.deleted: UserSubscription not found for sub ID {subscription_id} and customer ID {customer_id}.")
                     return HttpResponse(status=404)
             
+            elif event_type in ('price.created', 'price.updated'):
+                catalog.sync_prices(stripe_data)
+
+
+            elif event_type == 'price.deleted':
+                catalog.deactivate_plans(stripe_price_id=data_object['id'])
+
+
+            elif event_type in ('product.created', 'product.updated'):
+                catalog.sync_prices(stripe_data)
+
+
+            elif event_type == 'product.deleted':
+                catalog.deactivate_plans(stripe_product_id=data_object['id'])
+
             else:
                 pass
                 #logger.info(f"Unhandled webhook event type: {event_type}")
@@ -583,8 +761,10 @@ def home(request):
             return redirect('dashboard')
 
         try:
-            user_subscription.credits = max(0, user_subscription.credits - credits_to_use)
-            user_subscription.save()
+            # One conditional UPDATE, so concurrent debits can neither overdraw nor overwrite each other
+            if not locking.debit_credits(user_subscription, credits_to_use):
+                messages.error(request, f"Not enough credits. You have {user_subscription.credits} but tried to use {credits_to_use}.")
+                return redirect('dashboard')
             messages.success(request, f"Used {credits_to_use} credits. Remaining: {user_subscription.credits}.")
             #logger.info(f"User {user.username} used {credits_to_use} credits. Remaining: {user_subscription.credits}")
         except Exception as e:
@@ -600,6 +780,76 @@ def home(request):
     return render(request, "dashboard.html", context)
 
 
+SUBSCRIPTION_EVENTS_KEEPALIVE = 15  # Seconds between comments that keep proxies from closing idle streams
+
+
+def _sse_message(payload, event='subscription'):
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+@login_required
+async def subscription_events(request):
+    """
+    Server-sent events stream of the user's credit balance and subscription status.
+    Sends the current state on connect, then a new snapshot after every debit,
+    refill or webhook update (see live_updates).
+
+    Needs the ASGI worker class, where an idle connection is just a parked
+    coroutine. A WSGI worker cannot hold streams cheaply, and polling would run
+    every open dashboard through the whole middleware stack, so it answers 204,
+    which tells the browser not to reconnect: the page keeps the state it was
+    rendered with.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    user = await request.auser()
+    user_subscription = await UserSubscription.objects.filter(user=user).afirst()
+    initial = json.dumps(live_updates.subscription_snapshot(user_subscription)) if user_subscription else 'null'
+
+    async def stream():
+        async with live_updates.subscribe(user.pk) as queue:
+            yield _sse_message(initial)
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), SUBSCRIPTION_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                else:
+                    yield _sse_message(payload)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let a reverse proxy buffer the stream
+    return response
+
+
+@staff_member_required
+@require_GET
+def export_records(request, kind):
+    """
+    Streams all invoices or subscriptions as CSV (default) or JSON Lines, filtered
+    by ?start=&end= (created_at dates, inclusive), ?status= and ?plan= (plan id
+    or Stripe price id).
+    """
+    fmt = request.GET.get('format', 'csv')
+    if kind not in exports.EXPORTS or fmt not in exports.FORMATS:
+        return HttpResponse(status=404)
+    try:
+        filters = exports.parse_filters(
+            request.GET.get('start'), request.GET.get('end'), request.GET.get('status'), request.GET.get('plan'))
+    except exports.ExportFilterError as e:
+        return HttpResponse(str(e), status=400, content_type='text/plain')
+
+    chunks = exports.stream(kind, fmt, **filters)
+    if isinstance(request, ASGIRequest):
+        chunks = exports.astream(chunks)
+    response = StreamingHttpResponse(chunks, content_type=exports.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{exports.filename(kind, fmt)}"'
+    response['X-Accel-Buffering'] = 'no'  # Let the proxy pass rows on as they are written
+    return response
+
+
 def login(request):
     """
     Placeholder for login view.
@@ -613,37 +863,30 @@ def login(request):
 @require_POST
 def pause_subscription(request):
     """
-    Pauses the user's Stripe subscription.
+    Pauses the user's Stripe subscription. The change shows immediately; the
+    outbox sends it to Stripe after the response.
     """
     user = request.user
     try:
-        user_sub = UserSubscription.objects.get(user=user)
-        if not user_sub.stripe_subscription_id:
-            messages.error(request, "You don't have an active Stripe subscription to pause.")
-            return redirect('dashboard')
-        
-        # Pause the subscription in Stripe.
-        # 'void' behavior sets future invoices to void.
-        # Stripe will move the subscription to 'paused' status.
-        stripe.Subscription.modify(
-            user_sub.stripe_subscription_id,
-            pause_collection={"behavior": "mark_uncollectible"}
-            #pause_collection={'behavior': 'void'}
-        )
-        
-        # Update local model immediately, but webhook will provide final confirmation
-        user_sub.status = 'paused'
-        user_sub.is_paused = True # Deactivate locally until resumed
-        user_sub.save()
+        with transaction.atomic():
+            user_sub = locking.lock_for_user_action(user)
+            if not user_sub.stripe_subscription_id:
+                messages.error(request, "You don't have an active Stripe subscription to pause.")
+                return redirect('dashboard')
+
+            # Stripe marks invoices created while paused as uncollectible;
+            # the webhook provides final confirmation.
+            revert = outbox.apply_change(user_sub, 'pause')
+            user_sub.save()
+            outbox.enqueue(user_sub, 'pause', revert)
 
         messages.success(request, "Your subscription has been paused.")
         #logger.info(f"Subscription {user_sub.stripe_subscription_id} paused for user {user.username}.")
     except UserSubscription.DoesNotExist:
         messages.error(request, "Subscription not found for your account.")
         #logger.warning(f"Attempt to pause non-existent subscription for user {user.username}.")
-    except stripe.error.StripeError as e:
-        messages.error(request, f"Stripe error pausing subscription: {e}")
-        #logger.error(f"Stripe error pausing subscription for user {user.username}: {e}", exc_info=True)
+    except locking.SubscriptionBusy:
+        messages.error(request, "Your subscription is being updated right now. Please try again in a moment.")
     except Exception as e:
         messages.error(request, "An unexpected error occurred while pausing your subscription.")
         #logger.critical(f"Unexpected error pausing subscription for user {user.username}: {e}", exc_info=True)
@@ -654,39 +897,30 @@ def pause_subscription(request):
 @require_POST
 def resume_subscription(request):
     """
-    Resumes a paused Stripe subscription.
+    Resumes a paused Stripe subscription. The change shows immediately; the
+    outbox sends it to Stripe after the response.
     """
     user = request.user
     try:
-        user_sub = UserSubscription.objects.get(user=user)
-        if not user_sub.stripe_subscription_id:
-            messages.error(request, "You don't have a Stripe subscription to resume.")
-            return redirect('dashboard')
-            
-        # Clear the pause_collection to resume billing.
-        # Stripe will move the subscription back to 'active' status.
-        stripe.Subscription.modify(
-            user_sub.stripe_subscription_id,
-            pause_collection='' # Empty string or None clears the pause
-        )
-        # Fetch updated subscription details from Stripe to get current_period_end
-        # This is important as resuming can sometimes shift billing cycles.
-        subscription = stripe.Subscription.retrieve(user_sub.stripe_subscription_id)
-        
-        # Update local model immediately, but webhook will provide final confirmation
-        user_sub.status = subscription["status"] # Will likely be 'active'
-        user_sub.current_period_end = datetime.fromtimestamp(subscription["items"]["data"][0]["current_period_end"], tz=timezone.utc)
-        user_sub.is_paused= True
-        user_sub.save()
+        with transaction.atomic():
+            user_sub = locking.lock_for_user_action(user)
+            if not user_sub.stripe_subscription_id:
+                messages.error(request, "You don't have a Stripe subscription to resume.")
+                return redirect('dashboard')
+
+            # Clearing pause_collection resumes billing. The new period end arrives
+            # with the customer.subscription.updated webhook.
+            revert = outbox.apply_change(user_sub, 'resume')
+            user_sub.save()
+            outbox.enqueue(user_sub, 'resume', revert)
 
         messages.success(request, "Your subscription has been resumed.")
         #logger.info(f"Subscription {user_sub.stripe_subscription_id} resumed for user {user.username}.")
     except UserSubscription.DoesNotExist:
         messages.error(request, "Subscription not found for your account.")
         #logger.warning(f"Attempt to resume non-existent subscription for user {user.username}.")
-    except stripe.error.StripeError as e:
-        messages.error(request, f"Stripe error resuming subscription: {e}")
-        #logger.error(f"Stripe error resuming subscription for user {user.username}: {e}", exc_info=True)
+    except locking.SubscriptionBusy:
+        messages.error(request, "Your subscription is being updated right now. Please try again in a moment.")
     except Exception as e:
         messages.error(request, "An unexpected error occurred while resuming your subscription.")
         #logger.critical(f"Unexpected error resuming subscription for user {user.username}: {e}", exc_info=True)
@@ -703,13 +937,13 @@ def update_payment_method(request):
     """
     user = request.user
     try:
-        user_sub = UserSubscription.objects.get(user=user)
-        if not user_sub.stripe_customer_id:
+        customer_id = get_stripe_customer_id(user, create=False)
+        if not customer_id:
             messages.error(request, "No Stripe customer found for your account.")
             return redirect('dashboard')
 
         session = stripe.checkout.Session.create(
-            customer=user_sub.stripe_customer_id,
+            customer=customer_id,
             payment_method_types=['card'],
             mode='setup', # Use setup mode for updating payment methods
             success_url=request.build_absolute_uri('/dashboard/'),
@@ -720,9 +954,6 @@ def update_payment_method(request):
         )
         #logger.info(f"User {user.username} redirected to Stripe for payment method update.")
         return redirect(session.url)
-    except UserSubscription.DoesNotExist:
-        messages.error(request, "Subscription details not found for your account.")
-        #logger.warning(f"Attempt to update payment method for non-existent subscription for user {user.username}.")
     except stripe.error.StripeError as e:
         messages.error(request, f"Stripe error creating payment method update session: {e}")
         #logger.error(f"Stripe error creating setup session for user {user.username}: {e}", exc_info=True)
@@ -737,38 +968,33 @@ def update_payment_method(request):
 @require_POST
 def cancel_subscription_at_period_end(request):
     """
-    Sets a user's Stripe subscription to cancel at the end of the current billing period.
+    Sets a user's Stripe subscription to cancel at the end of the current billing
+    period. The change shows immediately; the outbox sends it to Stripe after the response.
     """
     user = request.user
     try:
-        user_sub = UserSubscription.objects.get(user=user)
-        if not user_sub.stripe_subscription_id:
-            messages.error(request, "You don't have an active Stripe subscription to cancel.")
-            return redirect('dashboard')
-        
-        # Prevent multiple clicks / redundant API calls if already set to cancel
-        if user_sub.cancel_at_period_end_stripe:
-            messages.info(request, "Your subscription is already set to cancel at the end of the period.")
-            return redirect('dashboard')
+        with transaction.atomic():
+            user_sub = locking.lock_for_user_action(user)
+            if not user_sub.stripe_subscription_id:
+                messages.error(request, "You don't have an active Stripe subscription to cancel.")
+                return redirect('dashboard')
 
-        # Modify the Stripe subscription to cancel at period end
-        stripe.Subscription.modify(
-            user_sub.stripe_subscription_id,
-            cancel_at_period_end=True
-        )
-        
-        # Immediately update local model for responsive UI
-        user_sub.cancel_at_period_end_stripe = True
-        user_sub.save()
+            # Prevent multiple clicks / redundant API calls if already set to cancel
+            if user_sub.cancel_at_period_end_stripe:
+                messages.info(request, "Your subscription is already set to cancel at the end of the period.")
+                return redirect('dashboard')
+
+            revert = outbox.apply_change(user_sub, 'cancel_at_period_end')
+            user_sub.save()
+            outbox.enqueue(user_sub, 'cancel_at_period_end', revert)
 
         messages.success(request, "Your subscription will be canceled at the end of the current billing period.")
         #logger.info(f"Subscription {user_sub.stripe_subscription_id} for user {user.username} set to cancel at period end.")
     except UserSubscription.DoesNotExist:
         messages.error(request, "Subscription not found for your account.")
         #logger.warning(f"Attempt to cancel non-existent subscription for user {user.username}.")
-    except stripe.error.StripeError as e:
-        messages.error(request, f"Stripe error setting subscription to cancel at period end: {e}")
-        #logger.error(f"Stripe error canceling subscription at period end for user {user.username}: {e}", exc_info=True)
+    except locking.SubscriptionBusy:
+        messages.error(request, "Your subscription is being updated right now. Please try again in a moment.")
     except Exception as e:
         messages.error(request, "An unexpected error occurred while canceling your subscription.")
         #logger.critical(f"Unexpected error canceling subscription at period end for user {user.username}: {e}", exc_info=True)
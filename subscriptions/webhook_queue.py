@@ -0,0 +1,297 @@
+# subscriptions/webhook_queue.py
+"""
+Queue of verified Stripe webhook events, applied by `python manage.py
+process_webhooks` workers.
+
+Each event gets an ordering key: the Stripe customer it concerns, or the object
+id for events without one. The key is hashed into one of
+STRIPE_WEBHOOK_PARTITIONS partitions. Workers on any number of nodes lease
+partitions through a conditional UPDATE on WebhookPartition, one batch at a
+time. Only the leaseholder processes a partition, one event after the other,
+so a customer's events apply in the order Stripe created them while other
+customers' events are processed in parallel. A background thread renews the
+lease while the worker holds it, however long an event takes; a crashed
+worker's lease expires after STRIPE_WEBHOOK_LEASE_SECONDS. Each event is
+applied in a transaction that locks the partition row and checks the lease
+before committing, so a worker that lost its lease anyway (a stalled process)
+rolls back instead of racing the new leaseholder.
+
+An event that fails is retried with backoff. Later events with the same
+ordering key wait for it, so they cannot overtake it. A
+customer.subscription.updated event is skipped when a newer one for the same
+subscription is already queued; only the newest is written.
+
+Stripe redelivers events it did not get a 2xx for, so enqueue() ignores event
+ids it has already stored.
+"""
+
+import random
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import db_router, metrics, profiling, stripe_guard
+from .models import StripeWebhookEvent, WebhookPartition
+from .stripe_client import stripe
+
+MAX_ATTEMPTS = 10
+MAX_BACKOFF = timedelta(minutes=30)
+
+# Only the newest of these events per object matters.
+SUPERSEDABLE_EVENTS = ('customer.subscription.updated',)
+
+
+def ordering_key(event):
+    data_object = event['data']['object']
+    if data_object.get('object') == 'customer':
+        return data_object['id']
+    customer = data_object.get('customer')
+    if isinstance(customer, dict):
+        customer = customer.get('id')
+    return customer or data_object.get('id', '')
+
+
+def partition_for(key, partitions=None):
+    # crc32 is stable across processes and Python versions, unlike hash().
+    return zlib.crc32(key.encode()) % (partitions or settings.STRIPE_WEBHOOK_PARTITIONS)
+
+
+def _queue_fields(event):
+    key = ordering_key(event)
+    return {
+        'event_type': event['type'],
+        'ordering_key': key,
+        'object_id': event['data']['object'].get('id', ''),
+        'partition': partition_for(key),
+        'created': datetime.fromtimestamp(event['created'], tz=dt_timezone.utc),
+        'payload': event,
+    }
+
+
+def enqueue(event):
+    """
+    Stores a verified event for the workers. Returns False for a redelivery of
+    an event already stored.
+    """
+    _, created = StripeWebhookEvent.objects.get_or_create(stripe_event_id=event['id'], defaults=_queue_fields(event))
+    metrics.incr('webhooks.queued' if created else 'webhooks.duplicate')
+    return created
+
+
+def enqueue_many(events, available_at=None):
+    """
+    Stores a batch of events with one lookup and one insert, skipping event ids
+    already stored in any status. Workers leave them alone until `available_at`
+    (default: now). Returns the number of events stored.
+    """
+    by_id = {event['id']: event for event in events}
+    stored = set(
+        StripeWebhookEvent.objects.filter(stripe_event_id__in=by_id).values_list('stripe_event_id', flat=True)
+    )
+    new = [
+        StripeWebhookEvent(stripe_event_id=event_id, next_attempt_at=available_at or timezone.now(), **_queue_fields(event))
+        for event_id, event in by_id.items() if event_id not in stored
+    ]
+    # A concurrent delivery of the same event may still win the insert.
+    StripeWebhookEvent.objects.bulk_create(new, ignore_conflicts=True)
+    metrics.incr('webhooks.queued', len(new))
+    metrics.incr('webhooks.duplicate', len(events) - len(new))
+    return len(new)
+
+
+class LeaseLost(Exception):
+    """
+    Another worker took the partition over while this one was applying an event.
+    """
+
+
+class WebhookWorker:
+    def __init__(self, owner, batch_size=100, lease_seconds=None):
+        self.owner = owner
+        self.batch_size = batch_size
+        # Even a worker whose renewals stall keeps the lease through one Stripe call.
+        self.lease_seconds = max(lease_seconds or settings.STRIPE_WEBHOOK_LEASE_SECONDS,
+                                 stripe_guard.max_call_seconds() + 30)
+
+    def run_once(self):
+        """
+        Processes one batch from every partition with due events that no other
+        worker holds. Returns the number of events handled.
+        """
+        busy = list(
+            StripeWebhookEvent.objects.filter(status=StripeWebhookEvent.PENDING, next_attempt_at__lte=timezone.now())
+            .values_list('partition', flat=True).distinct()
+        )
+        # Start at different partitions than the other workers.
+        random.shuffle(busy)
+        handled = 0
+        for number in busy:
+            if self.lease(number):
+                try:
+                    with self.keep_lease(number):
+                        handled += self.process_partition(number)
+                finally:
+                    self.release(number)
+        return handled
+
+    def lease(self, number):
+        now = timezone.now()
+        WebhookPartition.objects.get_or_create(number=number)
+        return WebhookPartition.objects.filter(
+            Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now) | Q(lease_owner=self.owner),
+            number=number,
+        ).update(lease_owner=self.owner, lease_expires_at=now + timedelta(seconds=self.lease_seconds)) == 1
+
+    def renew(self, number):
+        """
+        Extends the lease; False means it expired and another worker took the partition over.
+        """
+        return WebhookPartition.objects.filter(number=number, lease_owner=self.owner).update(
+            lease_expires_at=timezone.now() + timedelta(seconds=self.lease_seconds)) == 1
+
+    def holds(self, number):
+        """
+        Locks the partition row until the end of the transaction and checks the
+        lease is still this worker's.
+        """
+        return WebhookPartition.objects.select_for_update().filter(
+            number=number, lease_owner=self.owner, lease_expires_at__gt=timezone.now(),
+        ).values_list('number', flat=True).first() is not None
+
+    def release(self, number):
+        WebhookPartition.objects.filter(number=number, lease_owner=self.owner).update(
+            lease_owner='', lease_expires_at=None)
+
+    @contextmanager
+    def keep_lease(self, number):
+        """
+        Renews the lease on `number` every third of its length from a background
+        thread, with its own database connection, until the block exits.
+        """
+        stop = threading.Event()
+
+        def heartbeat():
+            try:
+                while not stop.wait(self.lease_seconds / 3):
+                    if not self.renew(number):
+                        return
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=heartbeat, name=f"webhook-lease-{number}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def process_partition(self, number):
+        events = (
+            StripeWebhookEvent.objects.filter(
+                partition=number, status=StripeWebhookEvent.PENDING, next_attempt_at__lte=timezone.now())
+            .order_by('created', 'id')[:self.batch_size]
+        )
+        handled = 0
+        blocked = set()
+        for queued in events:
+            if queued.ordering_key in blocked or self.waits_for_earlier(queued):
+                blocked.add(queued.ordering_key)
+                continue
+            stripe_data, read_error = self.read_from_stripe(queued)
+            try:
+                with transaction.atomic():
+                    if self.is_superseded(queued):
+                        self.finish(queued, StripeWebhookEvent.SUPERSEDED)
+                        applied = True
+                    else:
+                        applied = self.apply(queued, stripe_data, read_error)
+                    if not self.holds(number):
+                        raise LeaseLost(number)
+            except LeaseLost:
+                metrics.incr('webhooks.lease_lost')
+                break
+            if not applied:
+                blocked.add(queued.ordering_key)
+            handled += 1
+        return handled
+
+    def waits_for_earlier(self, queued):
+        return StripeWebhookEvent.objects.filter(
+            Q(created__lt=queued.created) | Q(created=queued.created, id__lt=queued.id),
+            ordering_key=queued.ordering_key,
+            status=StripeWebhookEvent.PENDING,
+        ).exists()
+
+    def is_superseded(self, queued):
+        return queued.event_type in SUPERSEDABLE_EVENTS and StripeWebhookEvent.objects.filter(
+            event_type=queued.event_type,
+            object_id=queued.object_id,
+            ordering_key=queued.ordering_key,
+            status=StripeWebhookEvent.PENDING,
+            created__gt=queued.created,
+        ).exists()
+
+    def read_from_stripe(self, queued):
+        """
+        Reads what the event's handler needs from Stripe before the event's
+        transaction opens, which holds the partition row at its end. Returns
+        the data and the error, if reading failed.
+        """
+        from .views import read_from_stripe
+
+        try:
+            return read_from_stripe(queued.payload), None
+        except Exception as e:
+            return None, e
+
+    def apply(self, queued, stripe_data=None, read_error=None):
+        from .views import process_stripe_event
+
+        event = stripe.Event.construct_from(queued.payload, stripe.api_key)
+        try:
+            if read_error is not None:
+                raise read_error
+            # A failed event rolls back to here, whether the handler raised or
+            # returned an error response; its retry is still recorded.
+            with db_router.use_primary(), transaction.atomic():
+                if profiling.sampled():
+                    with profiling.profile(f"webhook {queued.event_type} {queued.stripe_event_id}") as current:
+                        status = process_stripe_event(event, stripe_data).status_code
+                    current.extra['status'] = status
+                    profiling.write(current)
+                else:
+                    status = process_stripe_event(event, stripe_data).status_code
+                if not 200 <= status < 300:
+                    transaction.set_rollback(True)
+            error = f"HTTP {status}"
+        except Exception as e:
+            status, error = 500, repr(e)
+
+        if 200 <= status < 300:
+            self.finish(queued, StripeWebhookEvent.PROCESSED)
+            return True
+
+        queued.attempts += 1
+        queued.last_error = error
+        if status == 400 or queued.attempts >= MAX_ATTEMPTS:
+            # A malformed event does not get better with retries.
+            self.finish(queued, StripeWebhookEvent.FAILED)
+        else:
+            queued.next_attempt_at = timezone.now() + min(MAX_BACKOFF, timedelta(seconds=2 ** queued.attempts))
+            queued.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+            metrics.incr('webhooks.retried')
+        return False
+
+    def finish(self, queued, status):
+        queued.status = status
+        queued.processed_at = timezone.now()
+        queued.save(update_fields=['status', 'processed_at', 'attempts', 'last_error'])
+        metrics.incr(f"webhooks.{status}")
+        metrics.timing('webhooks.queue_delay', (queued.processed_at - queued.received_at).total_seconds() * 1000)